@@ -1,94 +1,59 @@
-import requests
-from threading import Lock
-from time import time, sleep
-import os
 import logging
-from dotenv import load_dotenv
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+from http_client import HttpClient, get_client
+from metrics import BLING_REQUESTS, BLING_REQUEST_SECONDS, BLING_RETRIES, BLING_THROTTLED, endpoint_label
+from rate_limiter import call_with_rate_limit, get_limiter
+from settings import setting
+from token_service import get_token_service
 
-# Load environment variables
-load_dotenv()
+def api_url(path: str) -> str:
+    """Return the URL of a Bling API path, e.g. api_url("/contas/receber")"""
+    return f"{setting('API_BASE_URL')}{path}"
 
-API_BASE_URL = os.getenv("API_BASE_URL")
-API_TOKEN_BLING = os.getenv("API_TOKEN_BLING")
-
-token_cache = {} # loja: (token: str, expiry: float)
-
-lock = Lock()
-o_get = requests.get
-def get(*args, **kwargs):
-    with lock:
-        sleep(4)
-        return o_get(*args, **kwargs)
-
-def fetch_access_token(loja=None):
+def get(*args, client: HttpClient = None, loja=None, **kwargs):
     """
-    Try to fetch and return access token for lajaodositio, with cache
-    with token expiry 5 hours.
-
-    Answer:
-       -It's the token-fetching logic that checks a cache for a valid access token and, 
-       if necessary, makes an HTTP GET request to retrieve and cache a new token.
+    Rate limited GET for Bling API calls over the pooled keep-alive client,
+    retries on 429 honoring Retry-After. Each store (loja) has its own rate budget.
+    """
+    client = client or get_client()
+    endpoint = endpoint_label(args[0] if args else kwargs.get("url"), setting("API_BASE_URL"))
+    attempts = 0
+
+    def send(*send_args, **send_kwargs):
+        # Every attempt is measured, including the ones answered 429
+        nonlocal attempts
+        attempts += 1
+        if attempts > 1:
+            BLING_RETRIES.labels(endpoint).inc()
+        with BLING_REQUEST_SECONDS.labels(endpoint).time():
+            response = client.get(*send_args, **send_kwargs)
+        BLING_REQUESTS.labels(endpoint, str(response.status_code)).inc()
+        if response.status_code == 429:
+            BLING_THROTTLED.labels(endpoint).inc()
+        return response
+
+    return call_with_rate_limit(send, *args, limiter=get_limiter(loja), **kwargs)
+
+def fetch_access_token(loja=None, client: HttpClient = None):
+    """
+    Return the access token of the store (lojaodositio by default, LOJA),
+    None if it can't be fetched.
 
-    Reasons:
-       -It first verifies if a valid token exists in the cache.
-       -If the token is missing or expired, it requests a new one from an external URL.
-       -On success, it stores the token with its expiry time for future use.
+    Tokens are kept by the shared token service (see token_service.py): they
+    are fetched once for all threads and processes and refreshed in the
+    background before they expire. `client` fetches the token when none is
+    available yet.
     """
-    # Use environment variable if loja is not provided
-    if loja is None:
-        loja = os.getenv("LOJA")
-        
-    if loja in token_cache:
-        token, expiry = token_cache[loja]
-        if time() < expiry:
-            return token
-    url = f"{API_TOKEN_BLING}/{loja}"
-    headers = {
-        'Authorization': 'Bearer 0123456789',
-        'Content-Type': 'application/json'
-    }
-    try:
-        response = requests.request("GET", url, headers=headers, data={})
-        if response.status_code == 200:
-            logging.info(f"Successfully fetched access token for {loja}")
-            access_token = response.json().get("access_token")
-            if access_token:
-                token_cache[loja] = (access_token, time() + 5 * 60 * 60)
-                return access_token
-            else:
-                logging.error("Failed to fetch access token.")
-                return None
-        else:
-            logging.error(f"Failed to fetch access token: {response.status_code}")
-            return None
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Error fetching access token: {e}")
-        return None
+    token = get_token_service().get(loja, client=client)
+    return token.value if token else None
 
-def get_headers(loja=None) -> dict:
+def get_headers(loja=None, client: HttpClient = None) -> dict:
     """
-    Return headers for the store with access token
+    Return headers for the store with access token. The same dict is reused
+    by every request until the token changes, it must not be modified.
     """
-    # Use environment variable if loja is not provided
-    if loja is None:
-        loja = os.getenv("LOJA")
-        
-    token = fetch_access_token(loja)
+    token = get_token_service().get(loja, client=client)
     if not token:
         logging.error("token not available in headers")
-    else:
-        logging.info("Successfully added token to headers")
-
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f"Bearer {token}"
-    }
-
-    return headers
+        return {'Accept': 'application/json', 'Authorization': "Bearer None"}
+    return token.headers
@@ -1,66 +1,36 @@
-import requests
-import json
-import schedule
-import time
+import logging
 import os
-from dotenv import load_dotenv, set_key
+import sys
+import threading
 
-# Path to the .env file
-ENV_PATH = '.env'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def get_access_token():
+from settings import configure_logging, load_env  # noqa: E402
+
+
+def main():
     """
-    Fetch access token from the specified URL and save to .env file.
+    Keep the shared access tokens fresh for every configured store.
+
+    The sync processes refresh their tokens themselves (token_service.py),
+    this keeps the shared store warm for hosts where nothing else runs, e.g.
+    so a one-off `cli.py sync` never waits on the token endpoint.
     """
-    url = "http://85.209.93.197:8080/code_bling/lojaodositio"
-    
-    payload = {}
-    headers = {
-        'Authorization': 'Bearer 0123456789',
-        'Content-Type': 'application/json'
-    }
-    
+    configure_logging()
+    load_env()
+    from bling_sources import configured_stores
+    from token_service import get_token_service
+
+    service = get_token_service()
+    for loja in configured_stores():
+        # The background refresher takes over once each store has a token
+        if service.get(loja) is None:
+            logging.error(f"Could not fetch the access token of {loja}")
     try:
-        # Send GET request
-        response = requests.request("GET", url, headers=headers, data=payload)
-        
-        # Check if request was successful
-        if response.status_code == 200:
-            # Parse the response
-            response_data = response.json()
-            
-            # Ensure the .env file exists
-            if not os.path.exists(ENV_PATH):
-                open(ENV_PATH, 'a').close()
-            
-            # Save the access token to .env file
-            set_key(ENV_PATH, 'ACCESS_TOKEN', json.dumps(response_data))
-            
-            print(f"Access token updated successfully at {time.strftime('%Y-%m-%d %H:%M:%S')}")
-            print("Response:", json.dumps(response_data, indent=2))
-        else:
-            print(f"Failed to fetch access token. Status code: {response.status_code}")
-            print("Response:", response.text)
-    
-    except requests.RequestException as e:
-        print(f"Error occurred while fetching access token: {e}")
-    except json.JSONDecodeError:
-        print("Error parsing JSON response")
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        logging.info("Token refresher stopped")
 
-def main():
-    # Load existing .env variables
-    load_dotenv(ENV_PATH)
-    
-    # Schedule the job to run every 240 minutes
-    schedule.every(240).minutes.do(get_access_token)
-    
-    # Initial token fetch
-    get_access_token()
-    
-    # Keep the script running and execute scheduled jobs
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,337 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, time as dt_time, timedelta
+from time import monotonic
+from typing import Optional
+
+from bson import ObjectId, json_util
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from prometheus_client import make_asgi_app
+
+from settings import load_env
+
+# ASGI entry point (uvicorn api:app): settings are loaded before the project
+# modules read their tunables
+load_env()
+
+from columnar_export import stream_arrow, stream_ndjson  # noqa: E402
+from indexes import collection_name  # noqa: E402
+from mongo_client import get_db  # noqa: E402
+from mongo_writer import HASH_FIELD  # noqa: E402
+from sync_state import MONGO_COLLECTION_SYNC_STATE  # noqa: E402
+from webhooks import SIGNATURE_HEADER, enqueue_event, verify_signature  # noqa: E402
+
+API_CACHE_TTL_SECONDS = float(os.getenv("API_CACHE_TTL_SECONDS", "30"))
+API_CACHE_MAX_ENTRIES = int(os.getenv("API_CACHE_MAX_ENTRIES", "1024"))
+API_DEFAULT_LIMIT = int(os.getenv("API_DEFAULT_LIMIT", "100"))
+API_MAX_LIMIT = int(os.getenv("API_MAX_LIMIT", "1000"))
+
+# Sort (and cursor) fields per dataset, _id always last so the order is total.
+# Receivables are paged by emission date, served by the CREmissao__id index.
+SORT_FIELDS = {
+    "receivables": ("CREmissao", "_id"),
+    "sellers": ("_id",),
+    "modulos": ("_id",),
+    "payment_methods": ("_id",),
+}
+DATE_FIELDS = {"receivables": "CREmissao"}
+
+
+class ResponseCache:
+    """
+    In-process TTL cache of encoded responses. Keys include the sync
+    generation, so a new sync never serves stale pages, and the least
+    recently used entries are evicted above `max_entries`.
+    """
+
+    def __init__(self, ttl: float = API_CACHE_TTL_SECONDS, max_entries: int = API_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            found = self._entries.get(key)
+            if found is None:
+                return None
+            if monotonic() - found[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return found[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseCache()
+
+app = FastAPI(title="fastapi-bling-receives")
+# Metrics of the API process, the ingester serves its own on METRICS_PORT
+app.mount("/metrics", make_asgi_app())
+
+
+def sync_generation(db, dataset: str) -> str:
+    """
+    Identify the data version of a dataset from its sync-state documents.
+
+    Reference datasets change generation only when their content changed,
+    receivables on every successful sync.
+    """
+    states = db[MONGO_COLLECTION_SYNC_STATE].find(
+        {"dataset": dataset}, {"changed_at": 1, "updated_at": 1}
+    ).sort("_id", 1)
+    payload = [(state["_id"], str(state.get("changed_at") or state.get("updated_at"))) for state in states]
+    return hashlib.sha1(json.dumps(payload).encode("utf-8")).hexdigest()
+
+
+def encode_cursor(document: dict, sort_fields) -> str:
+    values = [document.get(field) for field in sort_fields]
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str, sort_fields) -> list:
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(sort_fields):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def after_cursor(sort_fields, values) -> dict:
+    """Filter matching the documents sorted after `values` (keyset pagination)"""
+    if len(sort_fields) == 1:
+        return {sort_fields[0]: {"$gt": values[0]}}
+    field, last_id = sort_fields[0], values[-1]
+    if values[0] is None:
+        # Documents without the sort field come first, then every dated one
+        return {"$or": [{field: None, "_id": {"$gt": last_id}}, {field: {"$ne": None}}]}
+    return {"$or": [{field: {"$gt": values[0]}}, {field: values[0], "_id": {"$gt": last_id}}]}
+
+
+def _jsonable(value):
+    if isinstance(value, dict):
+        return {key: _jsonable(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_jsonable(item) for item in value]
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def build_query(dataset: str, start: date = None, end: date = None, loja: str = None) -> dict:
+    """Filter of the store and inclusive emission date range parameters"""
+    query = {}
+    if loja:
+        query["loja"] = loja
+    if start or end:
+        date_field = DATE_FIELDS.get(dataset)
+        if not date_field:
+            raise HTTPException(status_code=400, detail=f"{dataset} has no date filter")
+        query[date_field] = {}
+        if start:
+            query[date_field]["$gte"] = datetime.combine(start, dt_time.min)
+        if end:
+            query[date_field]["$lt"] = datetime.combine(end + timedelta(days=1), dt_time.min)
+    return query
+
+
+def list_documents(
+    dataset: str,
+    limit: int = API_DEFAULT_LIMIT,
+    cursor: str = None,
+    fields: str = None,
+    start: date = None,
+    end: date = None,
+    loja: str = None,
+) -> dict:
+    """
+    Return one page of a synced collection, using the next_cursor of the previous page.
+
+    Args:
+        dataset (str): "receivables", "sellers", "modulos" or "payment_methods".
+        limit (int): Page size.
+        cursor (str): Opaque next_cursor of the previous page.
+        fields (str): Comma separated fields to return, all by default.
+        start (date): First emission date, receivables only.
+        end (date): Last emission date (inclusive), receivables only.
+        loja (str): Only the documents of this store.
+
+    Returns:
+        dict: {"data": [...], "next_cursor": str or None}
+    """
+    sort_fields = SORT_FIELDS[dataset]
+    query = build_query(dataset, start, end, loja)
+    if cursor:
+        query = {"$and": [query, after_cursor(sort_fields, decode_cursor(cursor, sort_fields))]}
+
+    # Change-detection hash written by the sync, not part of the data
+    projection = {HASH_FIELD: 0}
+    requested = None
+    if fields:
+        requested = [field.strip() for field in fields.split(",") if field.strip()]
+        if any(field.startswith("$") for field in requested):
+            raise HTTPException(status_code=400, detail="Invalid field name")
+        projection = {field: 1 for field in (*requested, *sort_fields)}
+        # MongoDB rejects a projection holding a field and one of its subfields
+        for field in projection:
+            collision = next((other for other in projection if other.startswith(f"{field}.")), None)
+            if collision:
+                raise HTTPException(status_code=400, detail=f"Overlapping fields: {field} and {collision}")
+
+    collection = get_db()[collection_name(dataset)]
+    documents = list(
+        collection.find(query, projection)
+        .sort([(field, 1) for field in sort_fields])
+        .limit(limit + 1)
+    )
+    next_cursor = None
+    if len(documents) > limit:
+        documents = documents[:limit]
+        next_cursor = encode_cursor(documents[-1], sort_fields)
+
+    if requested:
+        # Sort fields were only projected to build the cursor
+        for document in documents:
+            for field in sort_fields:
+                if field != "_id" and field not in requested:
+                    document.pop(field, None)
+    return {"data": _jsonable(documents), "next_cursor": next_cursor}
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    """Whether an If-None-Match header (comma separated ETags or "*") matches `etag`"""
+    if not if_none_match:
+        return False
+    # Weak comparison, as If-None-Match requires: W/"x" matches "x"
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+def cached_page(request: Request, dataset: str, **params) -> Response:
+    """
+    Serve a page with an ETag derived from the sync generation.
+
+    Answers 304 when the client already has this version, and reuses the
+    encoded page from the response cache while the generation is unchanged.
+    """
+    generation = sync_generation(get_db(), dataset)
+    key = (dataset, tuple(sorted((name, str(value)) for name, value in params.items() if value is not None)))
+    etag = '"' + hashlib.sha1(json.dumps([generation, key]).encode("utf-8")).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if etag_matches(etag, request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+
+    body = response_cache.get(etag)
+    if body is None:
+        body = json.dumps(list_documents(dataset, **params), separators=(",", ":")).encode("utf-8")
+        response_cache.put(etag, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/receivables")
+def get_receivables(
+    request: Request,
+    limit: int = Query(API_DEFAULT_LIMIT, ge=1, le=API_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    loja: Optional[str] = None,
+):
+    return cached_page(request, "receivables", limit=limit, cursor=cursor, fields=fields, start=start, end=end, loja=loja)
+
+
+@app.get("/sellers")
+def get_sellers(
+    request: Request,
+    limit: int = Query(API_DEFAULT_LIMIT, ge=1, le=API_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    loja: Optional[str] = None,
+):
+    return cached_page(request, "sellers", limit=limit, cursor=cursor, fields=fields, loja=loja)
+
+
+@app.get("/modulos")
+def get_modulos(
+    request: Request,
+    limit: int = Query(API_DEFAULT_LIMIT, ge=1, le=API_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    loja: Optional[str] = None,
+):
+    return cached_page(request, "modulos", limit=limit, cursor=cursor, fields=fields, loja=loja)
+
+
+@app.get("/payment-methods")
+def get_payment_methods(
+    request: Request,
+    limit: int = Query(API_DEFAULT_LIMIT, ge=1, le=API_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    loja: Optional[str] = None,
+):
+    return cached_page(request, "payment_methods", limit=limit, cursor=cursor, fields=fields, loja=loja)
+
+
+@app.get("/receivables/export.arrow")
+def export_receivables_arrow(start: Optional[date] = None, end: Optional[date] = None, loja: Optional[str] = None):
+    """Flat, typed receivables as an Arrow IPC stream, built batch by batch"""
+    collection = get_db()[collection_name("receivables")]
+    return StreamingResponse(
+        stream_arrow(collection, build_query("receivables", start, end, loja)),
+        media_type="application/vnd.apache.arrow.stream",
+    )
+
+
+@app.get("/receivables/export.ndjson")
+def export_receivables_ndjson(start: Optional[date] = None, end: Optional[date] = None, loja: Optional[str] = None):
+    """Flat, typed receivables as newline-delimited JSON, one row per line"""
+    collection = get_db()[collection_name("receivables")]
+    return StreamingResponse(
+        stream_ndjson(collection, build_query("receivables", start, end, loja)),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.post("/webhooks/bling", status_code=202)
+async def bling_webhook(request: Request):
+    """
+    Queue a Bling webhook event, applied by the ingester (see webhooks.py).
+    Answers quickly with 2xx for valid events, Bling retries the others.
+    """
+    body = await request.body()
+    if not verify_signature(body, request.headers.get(SIGNATURE_HEADER)):
+        raise HTTPException(status_code=401, detail="Invalid signature")
+    try:
+        event = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
+    if not isinstance(event, dict):
+        raise HTTPException(status_code=400, detail="Invalid event")
+    status = await run_in_threadpool(enqueue_event, get_db(), event, body)
+    return {"status": status}
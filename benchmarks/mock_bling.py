@@ -0,0 +1,250 @@
+"""
+Local stand-in for the Bling API v3, replaying the recorded payloads of
+benchmarks/fixtures so syncs can be measured without the live API and its
+rate limits.
+
+Serves /vendedores, /situacoes/modulos, /situacoes/modulos/{id},
+/formas-pagamentos, /contas/receber and /contas/receber/{id}, plus the
+token endpoint (point API_TOKEN_BLING at <url>/token). Receivables are
+generated from the recorded parcela, `parcelas` of them, with unique ids
+and emission dates over the last 30 days.
+
+    python benchmarks/mock_bling.py --port 8099 --parcelas 10000 --latency-ms 50
+    python benchmarks/mock_bling.py --record   # refresh the fixtures from the live API
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import re
+import sys
+import threading
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Fixture file of each recorded endpoint, list endpoints are recorded as their first page
+FIXTURES = {
+    "/vendedores": "vendedores.json",
+    "/situacoes/modulos": "situacoes_modulos.json",
+    "/situacoes/modulos/{id}": "situacoes_modulo.json",
+    "/formas-pagamentos": "formas_pagamentos.json",
+    "/contas/receber": "contas_receber.json",
+    "/contas/receber/{id}": "contas_receber_detail.json",
+}
+
+_ID = re.compile(r"/\d+")
+
+
+def load_fixtures(directory: str = FIXTURES_DIR) -> dict:
+    """Return the recorded payload of each endpoint"""
+    fixtures = {}
+    for endpoint, filename in FIXTURES.items():
+        with open(os.path.join(directory, filename), encoding="utf-8") as f:
+            fixtures[endpoint] = json.load(f)
+    return fixtures
+
+
+class MockBling:
+    """
+    Threaded HTTP server answering like the Bling API.
+
+    Args:
+        parcelas (int): Number of receivables served by /contas/receber.
+        latency_ms (float): Delay added to every response.
+        page_size (int): Largest page returned, whatever `limite` asks for.
+        throttle_rate (float): Share of requests answered 429, from 0 to 1.
+        retry_after (str): Retry-After header of the 429 responses.
+        fixtures_dir (str): Directory of the recorded payloads.
+        seed (int): Seed of the 429 injection and of the generated data.
+    """
+
+    def __init__(self, parcelas: int = 1000, latency_ms: float = 0, page_size: int = 100, throttle_rate: float = 0.0,
+                 retry_after: str = "0", fixtures_dir: str = FIXTURES_DIR, seed: int = 1):
+        self.parcelas = parcelas
+        self.latency = latency_ms / 1000
+        self.page_size = page_size
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.fixtures = load_fixtures(fixtures_dir)
+        self.calls = Counter()
+        self.throttled = Counter()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._receivables, self._details = self._generate_receivables(seed)
+
+    def _generate_receivables(self, seed: int):
+        """List rows and details built from the recorded parcela, one per id"""
+        rng = random.Random(seed)
+        row_template = self.fixtures["/contas/receber"]["data"][0]
+        detail_template = self.fixtures["/contas/receber/{id}"]["data"]
+        sellers = [seller["id"] for seller in self.fixtures["/vendedores"]["data"]]
+        today = date.today()
+        rows, details = [], {}
+        for i in range(self.parcelas):
+            receivable_id = row_template["id"] + i
+            emissao = today - timedelta(days=rng.randrange(30))
+            vencimento = (emissao + timedelta(days=30)).isoformat()
+            valor = round(rng.uniform(10, 5000), 2)
+            row = copy.deepcopy(row_template)
+            row.update({"id": receivable_id, "dataEmissao": emissao.isoformat(), "vencimento": vencimento, "valor": valor})
+            row["contato"]["id"] = row_template["contato"]["id"] + rng.randrange(5000)
+            detail = copy.deepcopy(detail_template)
+            detail.update({k: row[k] for k in ("id", "dataEmissao", "vencimento", "valor", "contato")})
+            detail.update({
+                "saldo": valor,
+                "vencimentoOriginal": vencimento,
+                "competencia": row["dataEmissao"],
+                "numeroDocumento": f"{10000 + i // 3}/{i % 3 + 1:02d}",
+            })
+            detail["vendedor"] = {"id": rng.choice(sellers)}
+            rows.append(row)
+            details[receivable_id] = detail
+        return rows, details
+
+    def _page(self, records: list, query: dict) -> list:
+        page = int(query.get("pagina", ["1"])[0])
+        limit = min(int(query.get("limite", [str(self.page_size)])[0]), self.page_size)
+        return records[(page - 1) * limit:page * limit]
+
+    def respond(self, path: str, query: dict):
+        """Return (status, payload) for a request path"""
+        if path.startswith("/token/"):
+            return 200, {"access_token": "mock-token", "expires_in": 21600}
+        endpoint = _ID.sub("/{id}", path)
+        if endpoint == "/contas/receber":
+            return 200, {"data": self._page(self._receivables, query)}
+        if endpoint == "/contas/receber/{id}":
+            detail = self._details.get(int(path.rsplit("/", 1)[1]))
+            return (200, {"data": detail}) if detail else (404, {"error": {"type": "RESOURCE_NOT_FOUND"}})
+        if endpoint == "/situacoes/modulos/{id}":
+            return 200, self.fixtures[endpoint]
+        if endpoint in self.fixtures:
+            # Reference lists fit in one recorded page
+            return 200, {"data": self._page(self.fixtures[endpoint]["data"], query)}
+        return 404, {"error": {"type": "RESOURCE_NOT_FOUND"}}
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately, Nagle would delay the body by the client's delayed ACK
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                endpoint = _ID.sub("/{id}", url.path)
+                with mock._lock:
+                    mock.calls[endpoint] += 1
+                    throttle = not url.path.startswith("/token/") and mock._random.random() < mock.throttle_rate
+                    if throttle:
+                        mock.throttled[endpoint] += 1
+                if mock.latency:
+                    sleep(mock.latency)
+                if throttle:
+                    status, payload, headers = 429, {"error": {"type": "TOO_MANY_REQUESTS"}}, {"Retry-After": mock.retry_after}
+                else:
+                    status, payload = mock.respond(url.path, parse_qs(url.query))
+                    headers = {}
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    @property
+    def url(self) -> str:
+        return f"http://{self._server.server_address[0]}:{self._server.server_address[1]}"
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Serve in a background thread and return the base URL"""
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="mock-bling", daemon=True).start()
+        return self.url
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def record_fixtures(loja: str = None, directory: str = FIXTURES_DIR):
+    """
+    Refresh the fixtures with the first record of each endpoint from the live
+    API (API_BASE_URL, token of `loja`). Review them before committing, they
+    contain customer data.
+    """
+    from access_api import api_url, get, get_headers
+
+    def fetch(path):
+        response = get(api_url(path), headers=get_headers(loja), params={"pagina": 1, "limite": 1}, loja=loja)
+        response.raise_for_status()
+        return response.json()
+
+    payloads = {endpoint: fetch(endpoint) for endpoint in FIXTURES if "{id}" not in endpoint}
+    module_id = payloads["/situacoes/modulos"]["data"][0]["id"]
+    payloads["/situacoes/modulos/{id}"] = fetch(f"/situacoes/modulos/{module_id}")
+    receivable_id = payloads["/contas/receber"]["data"][0]["id"]
+    payloads["/contas/receber/{id}"] = fetch(f"/contas/receber/{receivable_id}")
+    for endpoint, payload in payloads.items():
+        with open(os.path.join(directory, FIXTURES[endpoint]), "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=2, ensure_ascii=False)
+        print(f"recorded {endpoint} -> {FIXTURES[endpoint]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--parcelas", type=int, default=1000)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--record", action="store_true", help="Record the fixtures from the live API instead")
+    parser.add_argument("--loja", help="Store whose token is used by --record, defaults to LOJA")
+    args = parser.parse_args()
+
+    if args.record:
+        from settings import load_env
+
+        load_env()
+        record_fixtures(args.loja)
+        return
+
+    mock = MockBling(args.parcelas, args.latency_ms, args.page_size, args.throttle_rate)
+    url = mock.start(args.host, args.port)
+    print(f"Mock Bling API on {url}, token endpoint {url}/token ({args.parcelas} parcelas)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
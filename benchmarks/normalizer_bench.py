@@ -0,0 +1,158 @@
+"""
+Compare the record normalizer with the former pandas transform of receivables.
+
+Generates synthetic list rows and details shaped like the Bling responses
+(see accounts_receivable_template.json), runs both transforms and reports
+throughput and peak memory (tracemalloc), and checks both produce the same
+documents, apart from the CR fields the normalizer coalesces.
+
+    python benchmarks/normalizer_bench.py --records 50000
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tracemalloc
+from datetime import date, timedelta
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from normalizer import SCHEMAS  # noqa: E402
+from pipelines import PIPELINES, merge_details, normalize_records  # noqa: E402
+
+# Fields the normalizer coalesces from the merge columns, the pandas transform never had them
+COALESCED_FIELDS = set(SCHEMAS["receivables"].get("coalesce", {}))
+
+RENAME_MAP = {
+    "situacao": "CRSituacao",
+    "vencimento": "CRVenc",
+    "valor": "CRValorParcela",
+    "dataEmissao": "CREmissao",
+    "saldo": "CRSaldoVenda",
+    "vendedorid": "CRVendedorID",
+    "formaPagamentoid": "CRFormaPagamento",
+    "contatoid": "CRContatoID",
+}
+
+
+def synthetic_receivables(count: int, seed: int = 1):
+    """Return (list rows, details) shaped like contas/receber responses"""
+    rng = random.Random(seed)
+    rows, details = [], []
+    for i in range(count):
+        emissao = date(2025, 1, 1) + timedelta(days=rng.randrange(365))
+        row = {
+            "id": 10_000_000 + i,
+            "situacao": rng.choice([1, 2, 3]),
+            "vencimento": (emissao + timedelta(days=30)).isoformat(),
+            "valor": round(rng.uniform(10, 5000), 2),
+            "dataEmissao": emissao.isoformat(),
+            "contato": {"id": rng.randrange(1, 5000), "nome": f"Cliente {i}", "numeroDocumento": "", "tipo": "F"},
+            "formaPagamento": {"id": 4951136},
+        }
+        rows.append(row)
+        # ~2% of the details failed to load
+        if rng.random() < 0.02:
+            continue
+        detail = dict(row)
+        detail.update({
+            "saldo": row["valor"],
+            "vencimentoOriginal": row["vencimento"],
+            "competencia": row["dataEmissao"],
+            "numeroDocumento": f"{rng.randrange(100000)}/{rng.randrange(1, 12):02d}",
+            "historico": "Ref. ao pedido",
+            "origem": {"id": rng.randrange(10**9), "tipoOrigem": "venda", "numero": str(i), "valor": row["valor"], "situacao": 1},
+            "portador": {"id": 1},
+            "categoria": {"id": 2},
+            "vendedor": {"id": rng.randrange(1, 50)},
+            "ocorrencia": {"tipo": 1},
+            "borderos": [],
+            "CRParcelaID": row["id"],
+        })
+        details.append(detail)
+    return rows, details
+
+
+def transform_pandas(rows, details):
+    """The pandas transform previously done in get_bling_receivable_data"""
+    import pandas as pd
+
+    df = pd.DataFrame(rows).rename(columns={"id": "CRParcelaID"})
+    merged_df = pd.merge(df, pd.DataFrame(details), on="CRParcelaID", how="left")
+    merged_df = merged_df.rename(columns={k: v for k, v in RENAME_MAP.items() if k in merged_df.columns})
+    if "CRVenc" in merged_df.columns:
+        merged_df["CRVenc"] = pd.to_datetime(merged_df["CRVenc"], errors="coerce")
+    if "CREmissao" in merged_df.columns:
+        merged_df["CREmissao"] = pd.to_datetime(merged_df["CREmissao"], errors="coerce")
+    if "CRValorParcela" in merged_df.columns:
+        merged_df["CRValorParcela"] = pd.to_numeric(merged_df["CRValorParcela"], errors="coerce")
+    if "CRSaldoVenda" in merged_df.columns:
+        merged_df["CRSaldoVenda"] = pd.to_numeric(merged_df["CRSaldoVenda"], errors="coerce")
+    return merged_df.to_dict("records")
+
+
+def transform_normalizer(rows, details):
+    """The transform of get_bling_receivable_data"""
+    return list(normalize_records("receivables", merge_details(PIPELINES["receivables"], rows, details)))
+
+
+def _clean(record: dict) -> dict:
+    """Drop the NaN/NaT fields pandas adds for unmatched rows, for the comparison"""
+    import pandas as pd
+
+    return {
+        key: value for key, value in record.items()
+        if not (value is pd.NaT or (isinstance(value, float) and math.isnan(value)))
+    }
+
+
+def measure(transform, rows, details) -> dict:
+    tracemalloc.start()
+    started = perf_counter()
+    records = transform(rows, details)
+    elapsed = perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "records": len(records),
+        "seconds": elapsed,
+        "records_per_second": len(records) / elapsed if elapsed else float("inf"),
+        "peak_mb": peak / 1024 / 1024,
+        "output": records,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--records", type=int, default=20000)
+    args = parser.parse_args()
+
+    rows, details = synthetic_receivables(args.records)
+    results = {"normalizer": measure(transform_normalizer, rows, details)}
+
+    started = perf_counter()
+    try:
+        import pandas  # noqa: F401
+    except ImportError:
+        print("pandas is not installed, only the normalizer was measured")
+    else:
+        print(f"pandas import: {perf_counter() - started:.3f}s")
+        results["pandas"] = measure(transform_pandas, rows, details)
+        pandas_records = [_clean(record) for record in results["pandas"]["output"]]
+        same = pandas_records == [
+            {key: value for key, value in record.items() if key in expected or key not in COALESCED_FIELDS}
+            for expected, record in zip(pandas_records, results["normalizer"]["output"])
+        ]
+        print(f"same documents: {same}")
+
+    for name, result in results.items():
+        print(
+            f"{name:>10}: {result['records']} records in {result['seconds']:.3f}s "
+            f"({result['records_per_second']:,.0f}/s), peak {result['peak_mb']:.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
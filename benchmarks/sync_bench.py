@@ -0,0 +1,208 @@
+"""
+End-to-end sync benchmark against the local mock Bling API (mock_bling.py).
+
+Each scenario runs in a fresh interpreter, so module state, caches and the
+peak RSS are those of one run:
+
+    receivables  get_bling_receivable_data(mode="full") for one store
+    schedule     one run of every scheduled job (scheduler.JOBS), what
+                 run_schedule executes on each tick, Parquet export included
+
+and reports wall time, records/s, Bling API calls and peak RSS. MongoDB is
+a local mongod (--mongo-uri) or, with --mongo mongomock, an in-memory stand-in
+(pip install mongomock, not a dependency of the service). mongomock scans
+the collection on every upsert, keep it to small sizes and to comparing the
+API side, MongoDB timings need a mongod.
+
+    python benchmarks/sync_bench.py --mongo mongomock
+    python benchmarks/sync_bench.py --sizes 1000,10000,100000
+    python benchmarks/sync_bench.py --sizes 10000 --latency-ms 80 --throttle-rate 0.01
+    python benchmarks/sync_bench.py --save-baseline   # update benchmarks/baseline.json
+
+Results are compared with the tracked baseline of the same scenario, size
+and settings when there is one.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+SCENARIOS = ("receivables", "schedule")
+LOJA = "benchmark"
+
+
+def _environment(args, base_url: str, workdir: str) -> dict:
+    """Settings pointing the service at the mock API and away from real data"""
+    return {
+        "API_BASE_URL": base_url,
+        "API_TOKEN_BLING": f"{base_url}/token",
+        "LOJA": LOJA,
+        "LOJAS": LOJA,
+        "MONGO_URI": args.mongo_uri,
+        "MONGO_DATABASE": args.database,
+        "MONGO_COLLECTION_SELLERS": "sellers",
+        "MONGO_COLLECTION_PAYMENT_METHODS": "payment_methods",
+        "MONGO_COLLECTION_MODULOS": "modulos",
+        "MONGO_COLLECTION_RECEIVABLE": "accounts_receivable",
+        # The mock has no rate limit of its own, 429s come from --throttle-rate
+        "BLING_RATE_PER_SECOND": str(args.rate),
+        "BLING_RATE_BURST": str(args.rate),
+        # Persistent stores in the run's own directory, so no run reuses another one's tokens or details
+        "DETAIL_CACHE_PATH": os.path.join(workdir, "receivable_details.sqlite3"),
+        "TOKEN_BACKEND": "file",
+        "TOKEN_CACHE_PATH": os.path.join(workdir, "tokens.json"),
+        "EXPORT_DIR": os.path.join(workdir, "export"),
+        "METRICS_PORT": "0",
+    }
+
+
+def run_scenario(args) -> dict:
+    """Run one scenario in this process and return its measures"""
+    from mock_bling import MockBling
+
+    mock = MockBling(args.size, args.latency_ms, args.page_size, args.throttle_rate)
+    base_url = mock.start()
+    workdir = tempfile.mkdtemp(prefix="bling-bench-")
+    os.environ.update(_environment(args, base_url, workdir))
+
+    if args.mongo == "mongomock":
+        import mongomock
+        import pymongo
+
+        # One in-memory server for every client of the process
+        server = mongomock.MongoClient()
+        pymongo.MongoClient = lambda *a, **k: server
+
+    # After the environment, the tunables are read on import
+    import bling_sources
+    from indexes import collection_name, ensure_indexes
+    from mongo_client import get_db
+
+    db = get_db()
+    for name in db.list_collection_names():
+        db.drop_collection(name)
+    ensure_indexes(db)
+
+    started = perf_counter()
+    if args.scenario == "receivables":
+        bling_sources.get_bling_receivable_data(mode="full", loja=LOJA)
+    else:
+        from apscheduler.util import ref_to_obj
+        from scheduler import JOBS
+
+        for job in JOBS.values():
+            ref_to_obj(job["func"])(**job["kwargs"])
+    elapsed = perf_counter() - started
+
+    records = db[collection_name("receivables")].count_documents({})
+    mock.stop()
+    return {
+        "scenario": args.scenario,
+        "parcelas": args.size,
+        "records": records,
+        "wall_seconds": round(elapsed, 3),
+        "records_per_second": round(records / elapsed, 1) if elapsed else None,
+        "api_calls": sum(mock.calls.values()),
+        "api_calls_by_endpoint": dict(sorted(mock.calls.items())),
+        "throttled": sum(mock.throttled.values()),
+        # Linux reports kilobytes, macOS bytes
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != "darwin" else 1024 * 1024), 1),
+    }
+
+
+def settings_key(args) -> str:
+    """Baseline key, results are only compared with runs of the same settings"""
+    return (
+        f"{args.scenario}/{args.size}/latency={args.latency_ms:g}ms/page={args.page_size}"
+        f"/throttle={args.throttle_rate:g}/rate={args.rate:g}/{args.mongo}"
+    )
+
+
+def run_isolated(args, scenario: str, size: int) -> dict:
+    """Run a scenario in a fresh interpreter, returns its measures"""
+    command = [
+        sys.executable, os.path.abspath(__file__), "--run-one", scenario, "--sizes", str(size),
+        "--latency-ms", str(args.latency_ms), "--page-size", str(args.page_size),
+        "--throttle-rate", str(args.throttle_rate), "--rate", str(args.rate),
+        "--mongo", args.mongo, "--mongo-uri", args.mongo_uri, "--database", args.database,
+    ]
+    completed = subprocess.run(command, capture_output=True, text=True, cwd=ROOT)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{scenario}/{size} failed:\n{completed.stderr[-4000:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def load_baseline() -> dict:
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _delta(current: float, baseline: float) -> str:
+    if not baseline:
+        return ""
+    return f" ({(current - baseline) / baseline:+.0%})"
+
+
+def report(key: str, result: dict, baseline: dict):
+    base = baseline.get("results", {}).get(key, {})
+    print(
+        f"{key}\n"
+        f"    {result['records']} records in {result['wall_seconds']:.2f}s{_delta(result['wall_seconds'], base.get('wall_seconds'))}, "
+        f"{result['records_per_second']:,.0f} records/s{_delta(result['records_per_second'], base.get('records_per_second'))}\n"
+        f"    {result['api_calls']} API calls{_delta(result['api_calls'], base.get('api_calls'))}, {result['throttled']} throttled, "
+        f"peak RSS {result['peak_rss_mb']:.0f} MB{_delta(result['peak_rss_mb'], base.get('peak_rss_mb'))}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma separated, of " + ", ".join(SCENARIOS))
+    parser.add_argument("--sizes", default="100,1000", help="Comma separated numbers of parcelas, 100 to 100000")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay of every mock API response")
+    parser.add_argument("--page-size", type=int, default=100, help="Largest page served by the mock API")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered 429")
+    parser.add_argument("--rate", type=float, default=1000, help="BLING_RATE_PER_SECOND of the run")
+    parser.add_argument("--mongo", choices=["mongod", "mongomock"], default="mongod")
+    parser.add_argument("--mongo-uri", default="mongodb://localhost:27017/?serverSelectionTimeoutMS=3000")
+    parser.add_argument("--database", default="bling_benchmark", help="Dropped before every run")
+    parser.add_argument("--save-baseline", action="store_true", help=f"Store the results in {os.path.basename(BASELINE_PATH)}")
+    parser.add_argument("--run-one", choices=SCENARIOS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        args.scenario, args.size = args.run_one, int(args.sizes)
+        print(json.dumps(run_scenario(args)))
+        return
+
+    baseline = load_baseline()
+    results = {}
+    for scenario in args.scenarios.split(","):
+        for size in (int(size) for size in args.sizes.split(",")):
+            args.scenario, args.size = scenario, size
+            key = settings_key(args)
+            results[key] = run_isolated(args, scenario, size)
+            report(key, results[key], baseline)
+
+    if args.save_baseline:
+        baseline.setdefault("results", {}).update(results)
+        baseline["machine"] = f"{platform.system()} {platform.machine()}, Python {platform.python_version()}, {os.cpu_count()} CPUs"
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline saved to {BASELINE_PATH}")
+
+
+if __name__ == "__main__":
+    main()
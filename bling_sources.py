@@ -1,449 +1,465 @@
 import os
 import requests
-from requests import get
-from pymongo import MongoClient
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-import sys
 import logging
-from time import sleep
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import pandas as pd
+from settings import configure_logging, load_env, setting
 
-from access_api import *
-
-# Configure logging to output to stdout
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[logging.StreamHandler(sys.stdout)]
+if __name__ == "__main__":
+    # Run as a script (python bling_sources.py, like cli.py schedule): .env is
+    # loaded before the modules below read their tunables on import
+    load_env()
+
+from http_client import HttpClient, get_client
+from pagination import prefetch
+from fanout import BLING_CONCURRENCY
+from sync_state import (
+    drop_checkpoints, finish_run, get_sync_state, get_watermark, load_checkpoints, save_checkpoint, set_watermark, start_run,
+    update_sync_state,
 )
-
-# Load environment variables
-if load_dotenv():
-    logging.info("Environment variables loaded successfully from .env file")
-else:
-    logging.error("Warning: Could not load environment variables from .env file")
-
-# MongoDB connection settings
-MONGO_URI = os.getenv("MONGO_URI")
-MONGO_DATABASE = os.getenv("MONGO_DATABASE")
-MONGO_COLLECTION_SELLERS = os.getenv("MONGO_COLLECTION_SELLERS")
-MONGO_COLLECTION_PAYMENT_METHODS = os.getenv("MONGO_COLLECTION_PAYMENT_METHODS")
-MONGO_COLLECTION_MODULOS = os.getenv("MONGO_COLLECTION_MODULOS")
-MONGO_COLLECTION_RECEIVABLE = os.getenv("MONGO_COLLECTION_RECEIVABLE")
-
-# Test MongoDB connection
-try:
-    client = MongoClient(MONGO_URI)
-    client.server_info()  # Will raise an exception if connection fails
-    logging.info("Successfully connected to MongoDB")
-except Exception as e:
-    logging.error(f"Failed to connect to MongoDB: {str(e)}")
-
-# some old code
-
-url = os.getenv("URL_PAGAMENTOS")
-
-payload = {}
-headers = {
-  'Accept': 'application/json',
-  'Authorization': f"Bearer {os.getenv('ACCESS_TOKEN')}"
-}
-
-def get_bling_modules():
+from derivations import refresh_derived
+from detail_cache import get_detail_cache
+from mongo_client import get_collection, get_db, pool_stats
+from mongo_writer import bulk_upsert
+from indexes import collection_name
+from pipelines import DATASET_KEYS, PIPELINES, fetch_details, iter_batches, merge_details, normalize_records, run_pipeline, sync_pipeline, tag_store
+from metrics import RECORDS_FETCHED, RunSummary, stage
+
+# Settings are read lazily (see settings.py): importing this module only
+# defines things, it neither loads .env nor connects to MongoDB.
+
+def configured_stores() -> list:
+    """Bling stores synced by sync_stores: LOJAS (comma separated), defaults to LOJA"""
+    return [loja.strip() for loja in setting("LOJAS", setting("LOJA", "")).split(",") if loja.strip()]
+
+# Parts of a store sync, the scheduler runs each one as its own job
+SYNC_DATASETS = ("reference", "receivables")
+
+# Receivable sync: "incremental" merges changes since the last watermark, "full" reloads the last 30 days
+RECEIVABLE_SYNC_MODE = os.getenv("RECEIVABLE_SYNC_MODE", "incremental")
+RECEIVABLE_SYNC_OVERLAP_DAYS = int(os.getenv("RECEIVABLE_SYNC_OVERLAP_DAYS", "2"))
+# Bling date filters used by the incremental sync: E (emissao), V (vencimento), R (recebimento).
+# E brings the new open parcelas, R the ones received since the watermark, whatever their emission date
+RECEIVABLE_SYNC_DATE_FILTERS = os.getenv("RECEIVABLE_SYNC_DATE_FILTERS", "E,R").split(",")
+# Query parameters per date filter, added to the declared ones (open parcelas, situacoes[]=1).
+# Received (2) and partially received (3) parcelas are no longer open
+RECEIVABLE_DATE_FILTER_PARAMS = {"R": {"situacoes[]": ["2", "3"]}}
+# Full runs use both: E brings the open parcelas of the last 30 days, R those received since
+RECEIVABLE_FULL_DATE_FILTERS = ["E", "R"]
+# Cancelled or returned parcelas match no date filter, only a full run drops them:
+# incremental runs are promoted to full when the last full one is older than this (0 disables)
+RECEIVABLE_RECONCILE_DAYS = float(os.getenv("RECEIVABLE_RECONCILE_DAYS", "7"))
+# An interrupted receivable run is resumed from its checkpoints if it started less than this ago
+RECEIVABLE_RUN_RESUME_HOURS = float(os.getenv("RECEIVABLE_RUN_RESUME_HOURS", "24"))
+# Parcelas whose detail failed are kept in the sync state and retried by the next runs, this many times
+RECEIVABLE_DETAIL_RETRY_RUNS = int(os.getenv("RECEIVABLE_DETAIL_RETRY_RUNS", "5"))
+
+# some old code, kept for the scripts still calling it
+
+def get_bling_modules(client: HttpClient = None):
     """
-    Retrieves a list of modules from the Bling API.
+    Retrieves the payment methods from the Bling API (named after the old modules endpoint).
 
     Returns:
-        dict: The response from the Bling API containing the list of modules.
+        dict: {"data": [...]} like the Bling API response, None on failure.
     """
-    response = requests.request("GET", url, headers=get_headers(), data=payload)
-    try:
-        data = response.json()
-        logging.info("Successfully retrieved modules data from Bling API")
-        return data
-    except:
-        logging.error("Failed to retrieve modules data from Bling API")
-        logging.error(response.text)
-        return None
-
-def get_bling_vendors():
+    records = run_pipeline(PIPELINES["payment_methods"], client=client)
+    return {"data": records} if records is not None else None
+
+def get_bling_vendors(client: HttpClient = None):
     """
     Retrieves a list of active vendors from the Bling API.
 
     Returns:
-        dict: The response from the Bling API containing the list of vendors.
+        dict: {"data": [...]} like the Bling API response, None on failure.
     """
-    url = os.getenv("URL_VENDEDORES")
-    payload = {}
-    headers = {
-        'Accept': 'application/json',
-        'Authorization': f"Bearer {os.getenv('ACCESS_TOKEN')}",
-        'Cookie': os.getenv('COOKIE')
-    }
-
-    response = requests.request("GET", url, headers=get_headers(), data=payload)
-    try:
-        data = response.json()
-        logging.info("Successfully retrieved vendedores from Bling API")
-        return data
-    except:
-        logging.error("Failed to retrieve vendedores from Bling API")
-        logging.error(response.text)
-        return None
+    records = run_pipeline(PIPELINES["sellers"], client=client)
+    return {"data": records} if records is not None else None
 
 def save_to_mongodb(data):
     """
     Saves the provided data to a MongoDB database.
 
     Args:
-        data (dict): The data to be saved to the database.
+        data (dict): The Bling API response, its "data" records are saved to the database.
     """
-    mongo_uri = os.getenv("MONGO_URI")
-    mongo_database = os.getenv("MONGO_DATABASE")
-    mongo_collection = os.getenv("MONGO_COLLECTION_PAYMENTS")
-
-    client = MongoClient(mongo_uri)
-    db = client[mongo_database]
-    collection = db[mongo_collection]
-
-    # Remove existing data before saving the new data
-    try:
-        delete_result = collection.delete_many({})
-        logging.info(f"Successfully removed {delete_result.deleted_count} documents from {mongo_collection}")
-    except Exception as e:
-        logging.error(f"Failed to remove existing data from {mongo_collection}: {str(e)}")
-        return
+    mongo_collection = setting("MONGO_COLLECTION_PAYMENTS")
+    collection = get_collection(mongo_collection)
 
-    # Insert new data
+    # Upsert each record on its id and drop the ones no longer returned by the API
     try:
-        insert_result = collection.insert_one(data)
-        logging.info(f"Successfully inserted new document with ID: {insert_result.inserted_id}")
+        counters = bulk_upsert(collection, data.get("data", []), ("id",), prune_missing=True)
+        logging.info(f"Successfully saved data into {mongo_collection}: {counters}")
     except Exception as e:
-        logging.error(f"Failed to insert new data into {mongo_collection}: {str(e)}")
+        logging.error(f"Failed to save data into {mongo_collection}: {str(e)}")
 
 def save_vendors_to_mongodb(data):
     """
     Saves the provided data to a MongoDB database.
 
     Args:
-        data (dict): The data to be saved to the database.
+        data (dict): The Bling API response, its "data" records are saved to the database.
     """
-    mongo_uri = os.getenv("MONGO_URI")
-    mongo_database = os.getenv("MONGO_DATABASE")
-    mongo_collection = os.getenv("MONGO_COLLECTION_SELLERS")
-
-    client = MongoClient(mongo_uri)
-    db = client[mongo_database]
-    collection = db[mongo_collection]
-
-    # Remove existing data before saving the new data
-    try:
-        delete_result = collection.delete_many({})
-        logging.info(f"Successfully removed {delete_result.deleted_count} documents from {mongo_collection}")
-    except Exception as e:
-        logging.error(f"Failed to remove existing data from {mongo_collection}: {str(e)}")
-        return
+    mongo_collection = setting("MONGO_COLLECTION_SELLERS")
+    collection = get_collection(mongo_collection)
 
-    # Insert new data
+    # Upsert each record on its id and drop the ones no longer returned by the API
     try:
-        insert_result = collection.insert_one(data)
-        logging.info(f"Successfully inserted new document with ID: {insert_result.inserted_id}")
+        counters = bulk_upsert(collection, data.get("data", []), ("id",), prune_missing=True)
+        logging.info(f"Successfully saved data into {mongo_collection}: {counters}")
     except Exception as e:
-        logging.error(f"Failed to insert new data into {mongo_collection}: {str(e)}")
+        logging.error(f"Failed to save data into {mongo_collection}: {str(e)}")
 
-# New data getters, as Power Bi
+# New data getters, as Power Bi, each one declared in pipelines.PIPELINES
 
 # Vendedor / sellers data
-def get_bling_sellers_data():
-    response = get(f"{API_BASE_URL}/vendedores?situacaoContato=A", headers=get_headers())
-
-    if response.status_code == 200:
-        logging.info(f"Successfully fetched sellers data from API")
-        data = response.json()
-        vendedores = data.get("data", [])
-
-        df = pd.DataFrame(vendedores)
-
-        if 'loja' in df.columns:
-            loja_df = pd.json_normalize(df['loja'])
-            df = pd.concat([df, loja_df.add_prefix('loja.')], axis=1).drop(columns=['loja'])
-
-        if 'contato' in df.columns:
-            contato_df = pd.json_normalize(df['contato'])
-            df = pd.concat([df, contato_df.add_prefix('contato.')], axis=1).drop(columns=['contato'])
-
-        df.rename(columns={'contato.nome': 'CRVendedor'}, inplace=True)
-
-        df = df.astype({
-            'id': str,
-            'descontoLimite': float,
-            'lojaid': str,
-            'contatoid': str,
-            'CRVendedor': str
-        })
-
-        return df.to_dict("records")
-    else:
-        logging.error(f"Failed to fetch data: {response.status_code}")
-
-
-# Modulos and Situacoes data
-def get_bling_modulos_data():
-    response = get(f"{API_BASE_URL}/situacoes/modulos", headers=get_headers())
-    bling_endpoint = os.getenv("LOJA")  # will be passed as function argument in future
-
-    if response.status_code == 200:
-        logging.info("Successfully fetched modulos data from API")
-        data = response.json()
-        modulos = data.get("data", [])
-        df = pd.DataFrame(modulos)
-        if not df.empty:
-            df = df.astype({
-                "id": str,
-                "nome": str,
-                "descricao": str
-            })
-
-            situacoes_list = []
-            for _, row in df.iterrows():
-                module_id = row["id"]
-                situacoes_response = get(f"{API_BASE_URL}/situacoes/modulos/{module_id}", headers=get_headers())
-
-                if situacoes_response.status_code == 200:
-                    logging.info(f"Successfully fetched situacoes for module {module_id}")
-                    situacoes_data = situacoes_response.json().get("data", [])
-                    for situacao in situacoes_data:
-                        situacao["module_id"] = module_id
-                        situacao["bling_endpoint"] = bling_endpoint
-                    situacoes_list.extend(situacoes_data)
-                else:
-                    logging.error(f"Failed to fetch situacoes for module {module_id}: {situacoes_response.status_code}")
-
-            situacoes_df = pd.DataFrame(situacoes_list)
-
-            # Merging 
-            if not situacoes_df.empty:
-                situacoes_df = situacoes_df.astype({
-                    "id": str,
-                    "nome": str,
-                    "idHerdado": str,
-                    "cor": str
-                })
-                merged_df = df.merge(situacoes_df, left_on="id", right_on="module_id", suffixes=("", ".Situacoes"))
-                return merged_df.to_dict("records")
-            else:
-                logging.info("No situacoes data found")
-        else:
-            logging.info("No modulos data found")
-    else:
-        logging.error(f"Failed to fetch modulos data: {response.status_code}, {response.text}")
+def get_bling_sellers_data(client: HttpClient = None, loja=None):
+    return run_pipeline(PIPELINES["sellers"], loja=loja, client=client)
+
+
+# Modulos and Situacoes data, each module once per situacao (modules without situacoes are left out)
+def get_bling_modulos_data(client: HttpClient = None, loja=None):
+    return run_pipeline(PIPELINES["modulos"], loja=loja, client=client)
 
 
 # Payment method data
-def get_bling_payment_methods_data() -> list[dict]:
+def get_bling_payment_methods_data(client: HttpClient = None, loja=None) -> list[dict]:
     """Return payment method data"""
-    response = get(f"{API_BASE_URL}/formas-pagamentos", headers=get_headers())
-
-    if response.status_code == 200:
-        logging.info("Successfully fetched payment methods data from API")
-        data = response.json()
-        forma_pagamentos = data.get("data", [])
-        df = pd.DataFrame(forma_pagamentos)
-
-        if not df.empty:
-            df = df.astype({
-                "id": str,
-                "descricao": str,
-                "tipoPagamento": str,
-                "situacao": str,
-                "padrao": str,
-                "finalidade": str
-            })
-
-            return df.to_dict("records")
-        else:
-            logging.info("No forma_pagamentos data found.")
-    else:
-        logging.error(f"Failed to fetch forma_pagamentos data: {response.status_code}, {response.text}")
+    return run_pipeline(PIPELINES["payment_methods"], loja=loja, client=client)
 
 
 # Receivable data
-def get_bling_receivable_data() -> list[dict]:
-    """Return last 30 days receivable data, only if not already retrieved"""
+def get_bling_receivable_data(client: HttpClient = None, mode: str = None, loja=None, executor: ThreadPoolExecutor = None) -> list[dict]:
+    """
+    Sync receivable data into MongoDB and return the records fetched in this run.
+
+    Args:
+        client (HttpClient): HTTP client, defaults to the shared one.
+        mode (str): "incremental" (default, RECEIVABLE_SYNC_MODE) fetches what was
+            emitted or received since the stored watermark minus RECEIVABLE_SYNC_OVERLAP_DAYS
+            (RECEIVABLE_SYNC_DATE_FILTERS) and upserts it on CRParcelaID, keeping history.
+            "full" reloads the last 30 days, only if not already retrieved today, and
+            drops the open parcelas of those days it didn't return (see prune_receivables).
+            Incremental runs become full ones every RECEIVABLE_RECONCILE_DAYS, to
+            drop the parcelas cancelled since.
+            Each page of parcelas is checkpointed with its details (see sync_state.py),
+            an interrupted run is resumed from its last checkpoint by the next one.
+            Parcelas whose detail failed are stored without it and retried by the
+            next runs (RECEIVABLE_DETAIL_RETRY_RUNS), the watermark moves on.
+        loja (str): Store to sync, defaults to LOJA. Records are tagged with it.
+        executor (ThreadPoolExecutor): Worker pool shared between stores for detail fetches.
+    """
+    mode = mode or RECEIVABLE_SYNC_MODE
+    loja = loja or setting("LOJA")
 
     today = datetime.now()
+    today_start = datetime.combine(today.date(), datetime.min.time())
     _30_day_ago = datetime.now() - timedelta(days=30)
 
-    # Check if data already exists in MongoDB for today
     try:
-        client = MongoClient(MONGO_URI)
-        db = client[MONGO_DATABASE]
-        collection = db[MONGO_COLLECTION_RECEIVABLE]
-
-        # Check for documents from today
-        today_start = datetime.combine(today.date(), datetime.min.time())
-        existing_data = collection.find_one({
-            "CREmissao": {"$gte": today_start.isoformat()}
-        })
-
-        if existing_data:
-            logging.info("Receivable data already retrieved today, skipping fetch")
-            return list(collection.find())
+        db = get_db()
+        collection = db[collection_name("receivables")]
+        state = get_sync_state(db, "receivables", loja)
+        run = state.get("run")
+        # {"row", "attempts"} of the parcelas whose detail failed in previous runs
+        pending_details = state.get("pending_details", [])
+        reconciled_at = state.get("reconciled_at")
+        if mode == "incremental" and RECEIVABLE_RECONCILE_DAYS > 0 \
+                and (reconciled_at is None or reconciled_at < today - timedelta(days=RECEIVABLE_RECONCILE_DAYS)):
+            logging.info(f"Last full receivable run of {loja} at {reconciled_at}, running a full one to reconcile")
+            mode = "full"
+
+        if run and run["status"] == "running" and run.get("mode") == mode \
+                and run["started_at"] >= today - timedelta(hours=RECEIVABLE_RUN_RESUME_HOURS):
+            # Same date range and filters as the interrupted run, its batches are not fetched again
+            start_date, date_filters = run["start_date"], run["date_filters"]
+            logging.info(f"Resuming receivable run {run['run_id']} after {run['batches']} batches (cursor: {run['cursor']})")
+        else:
+            if mode == "full" and run and run["status"] == "completed" and run.get("mode") == "full" \
+                    and run["completed_at"] >= today_start:
+                logging.info(f"Receivable data already retrieved today (run {run['run_id']}), skipping fetch")
+                if reconciled_at is None:
+                    update_sync_state(db, "receivables", loja, reconciled_at=run["started_at"])
+                return list(collection.find({"loja": loja}))
+            if run and run["status"] == "running":
+                logging.warning(f"Abandoning receivable run {run['run_id']} started at {run['started_at']}")
+                drop_checkpoints(db, run["run_id"])
+
+            date_filters = RECEIVABLE_SYNC_DATE_FILTERS if mode == "incremental" else RECEIVABLE_FULL_DATE_FILTERS
+            if mode == "incremental":
+                watermark = get_watermark(db, "receivables", loja)
+                if watermark:
+                    start_date = watermark - timedelta(days=RECEIVABLE_SYNC_OVERLAP_DAYS)
+                else:
+                    start_date = _30_day_ago
+                logging.info(f"Incremental receivable sync from {start_date.strftime('%Y-%m-%d')} (watermark: {watermark})")
+            else:
+                start_date = _30_day_ago
+            run = start_run(db, "receivables", loja, mode=mode, start_date=start_date, end_date=today, date_filters=date_filters)
 
     except Exception as e:
         logging.error(f"Error checking MongoDB for existing data: {str(e)}")
         return []
 
-    def fetch_receivable_data():
-        params = {
-            "situacoes[]": "1", 
-            "tipoFiltroData": "E",
-            "dataInicial": _30_day_ago.strftime("%Y-%m-%d"),
-            "dataFinal": today.strftime("%Y-%m-%d"),
-            "idFormaPagamento": "4951136"
-        }
-        # Add delay between API calls
-        sleep(4)
-        response = get(f"{API_BASE_URL}/contas/receber", headers=get_headers(), params=params)
-        if response.status_code == 200:
-            logging.info("Successfully fetched receivable data from API")
-            data = response.json()
-            return data.get("data", [])
-        else:
-            logging.error(f"Failed to fetch contas/receber: {response.status_code}, {response.text}")
-            return []
-
-    def fetch_receivable_detail(receivable_id):
-        # Add delay between API calls
-        sleep(4)
-        response = get(f"{API_BASE_URL}/contas/receber/{receivable_id}", headers=get_headers())
-        if response.status_code == 200:
-            logging.info(f"Successfully fetched receivable details for ID {receivable_id} from API")
-            return response.json().get("data", {})
-        else:
-            logging.error(f"Failed to fetch details for ID {receivable_id}: {response.status_code}, {response.text}")
-            return {}
+    end_date = run["end_date"]
+    # Everything emitted before the day the run started is synced once it completes
+    run_day = datetime.combine(end_date.date(), datetime.min.time())
+
+    # Batches persisted before an interruption
+    receivable_data, detailed_data, failures = [], [], {}
+    for batch in load_checkpoints(db, run["run_id"]):
+        receivable_data.extend(batch["rows"])
+        detailed_data.extend(batch["details"])
+        failures.update(dict.fromkeys(batch["failures"], "failed before resuming"))
+    seen = {row["id"] for row in receivable_data}
+    cursor = run["cursor"]
+
+    pipeline = PIPELINES["receivables"]
+
+    def fetch_receivable_pages():
+        """Stream the pages of contas/receber from the run cursor, the next pages load while details are fetched"""
+        remaining_filters = date_filters[date_filters.index(cursor["date_filter"]):] if cursor else date_filters
+        for date_filter in remaining_filters:
+            params = {
+                "tipoFiltroData": date_filter,
+                "dataInicial": start_date.strftime("%Y-%m-%d"),
+                "dataFinal": end_date.strftime("%Y-%m-%d"),
+                **RECEIVABLE_DATE_FILTER_PARAMS.get(date_filter, {}),
+            }
+            # The cursor page is read again, parcelas created meanwhile may have shifted it
+            start_page = cursor["page"] if cursor and cursor["date_filter"] == date_filter else 1
+            for page, rows in iter_batches(pipeline, loja, client, params, start_page=start_page):
+                yield date_filter, page, rows
+
+    # Unchanged parcelas (same list-row fingerprint) are served from the local cache
+    detail_cache = get_detail_cache()
+    detail_cache.reset_stats()
+
+    # Each page is a batch: its details are fetched concurrently, then the batch
+    # and the run cursor are persisted, so a restarted run resumes after it
+    try:
+        with stage("fetch", "receivables"):
+            for date_filter, page, rows in prefetch(fetch_receivable_pages()):
+                # The same parcela may match several date filters
+                rows = [row for row in rows if row["id"] not in seen]
+                if not rows:
+                    continue
+                seen.update(row["id"] for row in rows)
+                fetched = fetch_details(pipeline, rows, loja, client, executor)
+                details = [detail for _, detail in fetched.succeeded() if detail]
+                save_checkpoint(
+                    db, "receivables", loja, run,
+                    {"date_filter": date_filter, "page": page, "rows": rows, "details": details, "failures": list(fetched.failures)},
+                    {"date_filter": date_filter, "page": page, "last_id": rows[-1]["id"]},
+                )
+                receivable_data.extend(rows)
+                detailed_data.extend(details)
+                failures.update(fetched.failures)
+            # Details that failed before, unless their parcela was listed again
+            retried = [entry["row"] for entry in pending_details if entry["row"]["id"] not in seen]
+            if retried:
+                logging.info(f"Retrying {len(retried)} receivable details of {loja} that failed in previous runs")
+                seen.update(row["id"] for row in retried)
+                fetched = fetch_details(pipeline, retried, loja, client, executor)
+                receivable_data.extend(retried)
+                detailed_data.extend(detail for _, detail in fetched.succeeded() if detail)
+                failures.update(fetched.failures)
+    except requests.RequestException as e:
+        # The run stays open, the next one resumes from its last checkpoint
+        logging.error(f"Failed to fetch contas/receber: {e}")
+        return []
+    detail_cache.evict()
+    logging.info(f"Receivable detail cache: {detail_cache.stats()}")
 
-    receivable_data = fetch_receivable_data()
     if not receivable_data:
         logging.info("No receivable data found.")
+        if mode == "incremental":
+            set_watermark(db, "receivables", loja, run_day, fetched=0)
+        finish_run(db, "receivables", loja, run, fetched=0)
         return []
+    logging.info(f"Successfully fetched {len(receivable_data)} receivable records from API")
+    RECORDS_FETCHED.labels("receivables", loja).inc(len(receivable_data))
 
-    df = pd.DataFrame(receivable_data)
-    df = df.rename(columns={"id": "CRParcelaID"}) # ok
-
-    detailed_data = []
-    for _, row in df.iterrows():
-        receivable_id = row["CRParcelaID"]
-        detail = fetch_receivable_detail(receivable_id)
-        if detail:
-            detail.update({"CRParcelaID": receivable_id})  # Retain ID for joining
-            detailed_data.append(detail)
-
-    detail_df = pd.DataFrame(detailed_data)
-
-    # Merging
-    merged_df = pd.merge(df, detail_df, on="CRParcelaID", how="left")
-
-    # Renaming
-    rename_map = {
-        "situacao": "CRSituacao", #ok
-        "vencimento": "CRVenc",# ok
-        "valor": "CRValorParcela", #ok
-        "dataEmissao": "CREmissao", #ok
-        "saldo": "CRSaldoVenda", #ok
-        "vendedorid": "CRVendedorID", #ok
-        "formaPagamentoid": "CRFormaPagamento", #ok
-        "contatoid": "CRContatoID" #ok
-    }
-
-    # Rename columns if they exist
-    merged_df = merged_df.rename(columns={k: v for k, v in rename_map.items() if k in merged_df.columns})
-
-    # Format columns if they exist
-    if "CRVenc" in merged_df.columns:
-        merged_df["CRVenc"] = pd.to_datetime(merged_df["CRVenc"], errors="coerce")
-    if "CREmissao" in merged_df.columns:
-        merged_df["CREmissao"] = pd.to_datetime(merged_df["CREmissao"], errors="coerce")
-    if "CRValorParcela" in merged_df.columns:
-        merged_df["CRValorParcela"] = pd.to_numeric(merged_df["CRValorParcela"], errors="coerce")
-    if "CRSaldoVenda" in merged_df.columns:
-        merged_df["CRSaldoVenda"] = pd.to_numeric(merged_df["CRSaldoVenda"], errors="coerce")
+    # Left merge of each list row with its detail, then renames and type coercions
+    with stage("transform", "receivables"):
+        records = tag_store(list(normalize_records("receivables", merge_details(pipeline, receivable_data, detailed_data))), loja)
 
     # Save new data to MongoDB
     try:
-        collection.delete_many({})  # Clear old data
-        records = merged_df.to_dict("records")
-        collection.insert_many(records)
-        logging.info(f"Successfully saved {len(records)} new receivable records to MongoDB")
+        # Both modes merge into the existing history, whatever MONGO_LOAD_MODE: a full
+        # run only covers 30 days, it can't replace the collection content. Fields set
+        # on the stored documents (CRPedidoNº, DataControle) are kept, and recomputed
+        with stage("write", "receivables"):
+            refresh_derived(collection, records, DATASET_KEYS["receivables"][0])
+            counters = bulk_upsert(collection, records, DATASET_KEYS["receivables"], diff=True, update=True)
+            if mode == "full":
+                counters["pruned"] = prune_receivables(collection, loja, run["start_date"], end_date, seen)
+        # The parcelas stored without detail are retried by the next runs, not the whole window
+        update_sync_state(db, "receivables", loja, pending_details=failed_details(receivable_data, failures, pending_details))
+        if mode == "incremental":
+            set_watermark(db, "receivables", loja, run_day, fetched=len(records))
+        else:
+            update_sync_state(db, "receivables", loja, reconciled_at=run["started_at"])
+        finish_run(db, "receivables", loja, run, fetched=len(records))
+        logging.info(f"Successfully saved {len(records)} receivable records to MongoDB: {counters}")
         return records
     except Exception as e:
+        # The run stays open, the next one writes its checkpoints without fetching them again
         logging.error(f"Error saving receivable data to MongoDB: {str(e)}")
-        return merged_df.to_dict("records")
+        return records
 
-def run_schedule():
+def failed_details(rows: list, failures: dict, pending_details: list) -> list:
     """
-    Runs the data retrieval and saving to MongoDB on a 24-hours schedule.
-    """      
-    logging.info("Starting data collection process...")
-    
-    while True:
-        logging.info(f"Running data collection at: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-        
-        client = MongoClient(MONGO_URI)
-        db = client[MONGO_DATABASE]
-        sellers_collection = db[MONGO_COLLECTION_SELLERS]
-        modulos_collection = db[MONGO_COLLECTION_MODULOS]
-        payment_methods_collection = db[MONGO_COLLECTION_PAYMENT_METHODS]
-        receivable_collection = db[MONGO_COLLECTION_RECEIVABLE]
-
-        # sellers data
-        try:
-            logging.info("Fetching sellers data...")
-            sellers_data = get_bling_sellers_data()
-            sellers_collection.delete_many({})
-            sellers_collection.insert_many(sellers_data)
-            logging.info(f"Successfully saved {len(sellers_data)} seller records")
-        except Exception as e:
-            logging.error(f"ERROR fetching sellers data: {e}")
+    Return the {"row", "attempts"} entries of the parcelas whose detail failed
+    in this run, to retry them in the next ones. Those that failed
+    RECEIVABLE_DETAIL_RETRY_RUNS times are given up.
+    """
+    attempts = {entry["row"]["id"]: entry["attempts"] for entry in pending_details}
+    entries = []
+    for row in rows:
+        if row["id"] not in failures:
+            continue
+        entry = {"row": row, "attempts": attempts.get(row["id"], 0) + 1}
+        if entry["attempts"] > RECEIVABLE_DETAIL_RETRY_RUNS:
+            logging.error(f"Giving up the detail of receivable {row['id']} after {RECEIVABLE_DETAIL_RETRY_RUNS} runs: {failures[row['id']]}")
+            continue
+        entries.append(entry)
+    if entries:
+        logging.warning(f"{len(entries)} receivable details failed, retried by the next run")
+    return entries
+
+def prune_receivables(collection, loja: str, start_date: datetime, end_date: datetime, fetched_ids) -> int:
+    """
+    Delete the open parcelas of a store emitted between `start_date` and `end_date`
+    that a full run didn't fetch: they were cancelled, returned or deleted in Bling.
 
-        # modulos data
-        try:
-            logging.info("Fetching modules data...")
-            modulos_data = get_bling_modulos_data()
-            modulos_collection.delete_many({})
-            modulos_collection.insert_many(modulos_data)
-            logging.info(f"Successfully saved {len(modulos_data)} module records")
-        except Exception as e:
-            logging.error(f"ERROR fetching modules data: {e}")
+    Parcelas open then received are fetched again by the R filter, older history
+    and the other situacoes are left as they are.
+
+    Returns:
+        int: Deleted documents.
+    """
+    situacoes = PIPELINES["receivables"].params["situacoes[]"]
+    situacoes = [int(situacao) for situacao in ([situacoes] if isinstance(situacoes, str) else situacoes)]
+    start_day = datetime.combine(start_date.date(), datetime.min.time())
+    # dataFinal is inclusive
+    end_day = datetime.combine(end_date.date(), datetime.min.time()) + timedelta(days=1)
+    # Documents without loja predate multi-store sync and belong to any store
+    pruned = collection.delete_many({
+        "loja": {"$in": [loja, None]},
+        "CRSituacao": {"$in": situacoes},
+        "CREmissao": {"$gte": start_day, "$lt": end_day},
+        "CRParcelaID": {"$nin": list(fetched_ids)},
+    }).deleted_count
+    if pruned:
+        logging.info(f"Dropped {pruned} open receivables of {loja} no longer returned by Bling")
+    return pruned
+
+# Reference datasets, each one declared in pipelines.PIPELINES
+REFERENCE_DATASETS = ("sellers", "modulos", "payment_methods")
+
+def sync_reference_data(db=None, force: bool = False, loja=None, datasets=None) -> dict:
+    """
+    Refresh sellers, modulos and payment methods when their TTL expired,
+    skipping the MongoDB write when the dataset hash didn't change.
+
+    Args:
+        datasets (Sequence[str]): Reference datasets to refresh, all by default.
 
-        # payment methods data
+    Returns:
+        dict: Refresh status per dataset.
+    """
+    db = db if db is not None else get_db()
+    loja = loja or setting("LOJA")
+    results = {}
+    for dataset in datasets or REFERENCE_DATASETS:
         try:
-            logging.info("Fetching payment methods data...")
-            payment_methods_data = get_bling_payment_methods_data()
-            payment_methods_collection.delete_many({})
-            payment_methods_collection.insert_many(payment_methods_data)
-            logging.info(f"Successfully saved {len(payment_methods_data)} payment method records")
+            logging.info(f"Refreshing {dataset} data for {loja}...")
+            results[dataset] = sync_pipeline(PIPELINES[dataset], db, loja=loja, force=force)
         except Exception as e:
-            logging.error(f"ERROR fetching payment methods data: {e}")
+            logging.error(f"ERROR fetching {dataset} data: {e}")
+            results[dataset] = {"status": "failed", "error": str(e)}
+    return results
+
+def sync_store(loja: str, executor: ThreadPoolExecutor = None, datasets=SYNC_DATASETS) -> dict:
+    """Sync the reference data and/or receivables of one store, errors are logged and reported"""
+    db = get_db()
+    result = {}
+    if "reference" in datasets:
+        result["reference"] = sync_reference_data(db, loja=loja)
+    if "receivables" not in datasets:
+        return result
+    try:
+        logging.info(f"Fetching receivable data for {loja}...")
+        # get_bling_receivable_data persists the records itself
+        receivable_data = get_bling_receivable_data(loja=loja, executor=executor)
+        result["receivables"] = len(receivable_data)
+        logging.info(f"Successfully synced {len(receivable_data)} receivable records for {loja}")
+    except Exception as e:
+        result["receivables"] = None
+        logging.error(f"ERROR fetching receivable data for {loja}: {e}")
+    return result
 
-        # CT receivables data
+def sync_stores(lojas: list = None, datasets=SYNC_DATASETS) -> dict:
+    """
+    Sync every store concurrently, one thread per store.
+
+    Each store keeps its own token and rate limiter (Bling limits are per
+    account), while detail requests share one worker pool sized for all
+    stores, so a large store can't starve the others.
+
+    Args:
+        lojas (list): Stores to sync, defaults to configured_stores().
+        datasets (Sequence[str]): "reference" and/or "receivables".
+
+    Returns:
+        dict: sync_store result per store.
+    """
+    lojas = lojas or configured_stores()
+    if not lojas:
+        logging.error("No store to sync, set LOJAS or LOJA")
+        return {}
+    summary = RunSummary("sync_stores", lojas=list(lojas), datasets=list(datasets))
+    results = {}
+    with ThreadPoolExecutor(max_workers=BLING_CONCURRENCY * len(lojas), thread_name_prefix="bling-detail") as executor, \
+            ThreadPoolExecutor(max_workers=len(lojas), thread_name_prefix="bling-store") as stores:
+        futures = {stores.submit(sync_store, loja, executor, datasets): loja for loja in lojas}
+        for future in as_completed(futures):
+            loja = futures[future]
+            try:
+                results[loja] = future.result()
+            except Exception as e:
+                results[loja] = {"error": str(e)}
+                logging.error(f"ERROR syncing store {loja}: {e}")
+
+    # BI reads the columnar export, refreshed once every store is synced
+    if "receivables" in datasets:
+        # Imported here, pyarrow is only needed once receivables were synced
+        from columnar_export import EXPORT_PARQUET, export_receivables_parquet
+    if "receivables" in datasets and EXPORT_PARQUET:
         try:
-            logging.info("Fetching receivable data...")
-            receivable_data = get_bling_receivable_data()
-            receivable_collection.delete_many({})
-            receivable_collection.insert_many(receivable_data)
-            logging.info(f"Successfully saved {len(receivable_data)} receivable records")
+            with stage("parquet_export", "receivables"):
+                export_receivables_parquet(get_collection(collection_name("receivables")))
         except Exception as e:
-            logging.error(f"ERROR fetching receivable data: {e}")
+            logging.error(f"ERROR exporting receivables to Parquet: {e}")
+
+    logging.info(f"Stores synced: {results}")
+    logging.info(f"HTTP connection reuse per host: {get_client().connection_stats()}")
+    logging.info(f"MongoDB connection pool: {pool_stats()}")
+    # Per-run metrics, kept in MongoDB to follow performance trends
+    summary.finish(get_db(), results=results, http=get_client().connection_stats(), mongo_pool=pool_stats())
+    return results
 
-        next_run = datetime.now() + timedelta(hours=24)
-        logging.info(f"Data collection completed. Next run scheduled for: {next_run.strftime('%Y-%m-%d %H:%M:%S')}")
-        sleep(86400)  # 24 hours in seconds (fixed from 86000)
+def run_schedule():
+    """
+    Runs the data retrieval and saving to MongoDB, each dataset as its own scheduled job (see scheduler.py).
+    """
+    from scheduler import run_scheduler
+    run_scheduler()
 
 if __name__ == "__main__":
+    configure_logging()
     try:
         logging.info("About to start run_schedule...")
         run_schedule()
@@ -0,0 +1,210 @@
+"""
+Command line entry points, one subcommand per dataset and operation.
+
+    python cli.py sync receivables --loja lojaodositio --mode full
+    python cli.py sync sellers --force
+    python cli.py sync all
+    python cli.py derive --days 4
+    python cli.py export
+    python cli.py indexes --check
+    python cli.py schedule
+    python cli.py webhook-process
+    python cli.py webhook-replay benchmarks/fixtures/webhooks/*.json --url http://localhost:8079/webhooks/bling
+    python cli.py startup-check
+
+Only argparse and settings are imported up front, each subcommand imports
+what it needs, so `sync sellers` never loads the scheduler or pyarrow.
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+
+from settings import configure_logging, load_env, setting
+
+REFERENCE_COMMANDS = {"sellers": "sellers", "modulos": "modulos", "payment-methods": "payment_methods"}
+
+# Modules whose import time is checked by startup-check
+STARTUP_MODULES = ("cli", "bling_sources", "accounts_receivable", "scheduler")
+STARTUP_BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "500"))
+
+
+def cmd_sync(args) -> int:
+    if args.dataset == "all":
+        from bling_sources import sync_stores
+
+        lojas = args.lojas.split(",") if args.lojas else None
+        results = sync_stores(lojas)
+        return 0 if results and all("error" not in result for result in results.values()) else 1
+
+    if args.dataset == "receivables":
+        from bling_sources import get_bling_receivable_data
+
+        get_bling_receivable_data(mode=args.mode, loja=args.loja)
+        return 0
+
+    from bling_sources import sync_reference_data
+
+    dataset = REFERENCE_COMMANDS[args.dataset]
+    result = sync_reference_data(force=args.force, loja=args.loja, datasets=[dataset])[dataset]
+    logging.info(f"{dataset}: {result}")
+    return 1 if result["status"] == "failed" else 0
+
+
+def cmd_derive(args) -> int:
+    from datetime import datetime, timedelta
+
+    from derivations import DERIVED_FIELDS, derive_fields
+    from indexes import collection_name
+    from mongo_client import get_collection
+
+    since = (datetime.now() - timedelta(days=args.days)).strftime("%Y-%m-%d")
+    report = derive_fields(
+        get_collection(collection_name("receivables")),
+        {"dataEmissao_x": {"$gte": since}},
+        args.fields or list(DERIVED_FIELDS),
+    )
+    logging.info(f"Derived fields since {since}: {report}")
+    return 0
+
+
+def cmd_export(args) -> int:
+    from columnar_export import export_receivables_parquet
+    from indexes import collection_name
+    from mongo_client import get_collection
+
+    export_receivables_parquet(get_collection(collection_name("receivables")), args.directory)
+    return 0
+
+
+def cmd_indexes(args) -> int:
+    from indexes import check_query_plans, detect_drift, ensure_indexes
+    from mongo_client import get_db
+
+    db = get_db()
+    ensure_indexes(db)
+    if args.check:
+        check_query_plans(db)
+        logging.info(f"Index drift: {detect_drift(db)}")
+    return 0
+
+
+def cmd_schedule(args) -> int:
+    from scheduler import run_scheduler
+
+    run_scheduler()
+    return 0
+
+
+def cmd_webhook_process(args) -> int:
+    from webhooks import process_events
+
+    result = process_events(limit=args.limit)
+    logging.info(f"Webhook events: {result}")
+    return 1 if result["failed"] else 0
+
+
+def cmd_webhook_replay(args) -> int:
+    """Post recorded events to a webhook endpoint, signed with BLING_WEBHOOK_SECRET like Bling does"""
+    import requests
+
+    from webhooks import SIGNATURE_HEADER, sign
+
+    if not setting("BLING_WEBHOOK_SECRET"):
+        logging.error("BLING_WEBHOOK_SECRET is not set, events can't be signed")
+        return 1
+    failed = 0
+    for path in args.files:
+        with open(path, "rb") as f:
+            body = f.read()
+        response = requests.post(
+            args.url, data=body, timeout=10,
+            headers={"Content-Type": "application/json", SIGNATURE_HEADER: sign(body)},
+        )
+        logging.info(f"{path}: {response.status_code} {response.text}")
+        failed += response.status_code >= 300
+    return 1 if failed else 0
+
+
+def cmd_startup_check(args) -> int:
+    """
+    Import each module in a fresh interpreter and compare the time with the budget.
+
+    MongoDB is pointed at an unreachable address, so a module connecting
+    on import blows the budget instead of passing silently.
+    """
+    env = dict(os.environ, MONGO_URI="mongodb://127.0.0.1:9/?serverSelectionTimeoutMS=3000")
+    over = []
+    for module in args.modules or STARTUP_MODULES:
+        code = f"import time; started = time.perf_counter(); import {module}; print(time.perf_counter() - started)"
+        completed = subprocess.run(
+            [sys.executable, "-c", code], env=env, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        if completed.returncode != 0:
+            logging.error(f"import {module} failed: {completed.stderr.strip()}")
+            over.append(module)
+            continue
+        elapsed_ms = float(completed.stdout.strip().splitlines()[-1]) * 1000
+        status = "ok" if elapsed_ms <= args.budget_ms else "OVER BUDGET"
+        logging.info(f"import {module}: {elapsed_ms:.0f} ms ({status}, budget {args.budget_ms:.0f} ms)")
+        if elapsed_ms > args.budget_ms:
+            over.append(module)
+    return 1 if over else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Bling receivables sync")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    sync = commands.add_parser("sync", help="Sync one dataset from the Bling API into MongoDB")
+    sync.add_argument("dataset", choices=["receivables", *REFERENCE_COMMANDS, "all"])
+    sync.add_argument("--loja", help="Store to sync, defaults to LOJA")
+    sync.add_argument("--lojas", help="Comma separated stores for 'all', defaults to LOJAS")
+    sync.add_argument("--mode", choices=["incremental", "full"], help="Receivable sync mode")
+    sync.add_argument("--force", action="store_true", help="Ignore the reference data TTL")
+    sync.set_defaults(handler=cmd_sync)
+
+    derive = commands.add_parser("derive", help="Derive fields (CRPedidoNº) on recent receivables")
+    derive.add_argument("--days", type=int, default=4, help="Receivables emitted in the last N days")
+    derive.add_argument("--fields", nargs="*", help="Fields of DERIVED_FIELDS, all by default")
+    derive.set_defaults(handler=cmd_derive)
+
+    export = commands.add_parser("export", help="Export receivables as partitioned Parquet")
+    export.add_argument("--directory", help="Defaults to EXPORT_DIR/receivables")
+    export.set_defaults(handler=cmd_export)
+
+    indexes = commands.add_parser("indexes", help="Create the declared indexes")
+    indexes.add_argument("--check", action="store_true", help="Also check query plans and drift")
+    indexes.set_defaults(handler=cmd_indexes)
+
+    schedule = commands.add_parser("schedule", help="Run the scheduled sync jobs")
+    schedule.set_defaults(handler=cmd_schedule)
+
+    webhook_process = commands.add_parser("webhook-process", help="Apply one batch of queued webhook events")
+    webhook_process.add_argument("--limit", type=int, default=500)
+    webhook_process.set_defaults(handler=cmd_webhook_process)
+
+    webhook_replay = commands.add_parser("webhook-replay", help="Post recorded webhook events to the API")
+    webhook_replay.add_argument("files", nargs="+", help="JSON events, e.g. benchmarks/fixtures/webhooks/*.json")
+    webhook_replay.add_argument("--url", default="http://localhost:8079/webhooks/bling")
+    webhook_replay.set_defaults(handler=cmd_webhook_replay)
+
+    startup = commands.add_parser("startup-check", help="Check module import times against a budget")
+    startup.add_argument("modules", nargs="*", help=f"Defaults to {', '.join(STARTUP_MODULES)}")
+    startup.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    startup.set_defaults(handler=cmd_startup_check)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    configure_logging()
+    # Before the subcommand imports, their modules read tunables on import
+    load_env()
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
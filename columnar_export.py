@@ -0,0 +1,241 @@
+import glob
+import io
+import json
+import logging
+import math
+import os
+import shutil
+from datetime import date, datetime
+from typing import Iterator
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "export")
+EXPORT_PARQUET = os.getenv("EXPORT_PARQUET", "true").lower() in ("1", "true", "yes")
+EXPORT_PARQUET_COMPRESSION = os.getenv("EXPORT_PARQUET_COMPRESSION", "zstd")
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "10000"))
+# Each export is written to "<directory>.__v<timestamp>", <directory> is a symlink to the current one
+VERSION_SUFFIX = ".__v"
+
+# Flat, typed columns of the receivables export: (column, source fields, type).
+# The first source present wins. Detail fields (_y) are preferred over list
+# fields (_x), dotted sources read nested documents (see accounts_receivable_template.json).
+RECEIVABLE_COLUMNS = [
+    ("CRParcelaID", ("CRParcelaID", "id"), pa.int64()),
+    ("loja", ("loja",), pa.string()),
+    ("CRSituacao", ("CRSituacao", "situacao_y", "situacao_x", "situacao"), pa.int32()),
+    ("CREmissao", ("CREmissao", "dataEmissao_y", "dataEmissao_x", "dataEmissao"), pa.timestamp("ms")),
+    ("CRVenc", ("CRVenc", "vencimento_y", "vencimento_x", "vencimento"), pa.timestamp("ms")),
+    ("vencimentoOriginal", ("vencimentoOriginal",), pa.timestamp("ms")),
+    ("competencia", ("competencia",), pa.timestamp("ms")),
+    ("CRValorParcela", ("CRValorParcela", "valor_y", "valor_x", "valor"), pa.float64()),
+    ("CRSaldoVenda", ("CRSaldoVenda", "saldo_y", "saldo_x", "saldo"), pa.float64()),
+    ("CRContatoID", ("CRContatoID", "contato_y.id", "contato_x.id", "contato.id"), pa.int64()),
+    ("contato_nome", ("contato_y.nome", "contato_x.nome", "contato.nome"), pa.string()),
+    ("contato_tipo", ("contato_y.tipo", "contato_x.tipo", "contato.tipo"), pa.string()),
+    ("CRFormaPagamento", ("CRFormaPagamento", "formaPagamento_y.id", "formaPagamento_x.id", "formaPagamento.id"), pa.int64()),
+    ("contaContabil_id", ("contaContabil_y.id", "contaContabil_x.id", "contaContabil.id"), pa.int64()),
+    ("contaContabil_descricao", ("contaContabil_y.descricao", "contaContabil_x.descricao", "contaContabil.descricao"), pa.string()),
+    ("origem_id", ("origem_y.id", "origem_x.id", "origem.id"), pa.int64()),
+    ("origem_tipoOrigem", ("origem_y.tipoOrigem", "origem_x.tipoOrigem", "origem.tipoOrigem"), pa.string()),
+    ("origem_numero", ("origem_y.numero", "origem_x.numero", "origem.numero"), pa.string()),
+    ("origem_valor", ("origem_y.valor", "origem_x.valor", "origem.valor"), pa.float64()),
+    ("origem_situacao", ("origem_y.situacao", "origem_x.situacao", "origem.situacao"), pa.int32()),
+    ("numeroDocumento", ("numeroDocumento",), pa.string()),
+    ("CRPedidoNº", ("CRPedidoNº",), pa.string()),
+    ("historico", ("historico",), pa.string()),
+    ("CRVendedorID", ("CRVendedorID", "vendedor.id"), pa.int64()),
+    ("categoria_id", ("categoria.id",), pa.int64()),
+    ("portador_id", ("portador.id",), pa.int64()),
+    ("DataControle", ("DataControle",), pa.int64()),
+]
+
+RECEIVABLE_SCHEMA = pa.schema([(name, arrow_type) for name, _, arrow_type in RECEIVABLE_COLUMNS])
+
+# Top-level fields read from MongoDB, everything else is never transferred
+RECEIVABLE_PROJECTION = {
+    root: 1 for _, sources, _ in RECEIVABLE_COLUMNS for root in {source.split(".")[0] for source in sources}
+}
+
+
+def _lookup(document: dict, source: str):
+    """Read a field by literal name first, then as a nested path"""
+    if source in document:
+        return document[source]
+    value = document
+    for part in source.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _is_missing(value) -> bool:
+    return value is None or value == "" or (isinstance(value, float) and math.isnan(value))
+
+
+def _coerce(value, arrow_type):
+    """Cast a MongoDB value to the column type, None when it can't be cast"""
+    if _is_missing(value):
+        return None
+    try:
+        if pa.types.is_integer(arrow_type):
+            return int(value)
+        if pa.types.is_floating(arrow_type):
+            return float(value)
+        if pa.types.is_timestamp(arrow_type):
+            if isinstance(value, datetime):
+                return value
+            if isinstance(value, date):
+                return datetime(value.year, value.month, value.day)
+            return datetime.fromisoformat(str(value))
+        return str(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+
+def flatten_receivable(document: dict) -> dict:
+    """Return the typed, flat export row of a receivable document"""
+    row = {}
+    for name, sources, arrow_type in RECEIVABLE_COLUMNS:
+        value = None
+        for source in sources:
+            value = _lookup(document, source)
+            if not _is_missing(value):
+                break
+        row[name] = _coerce(value, arrow_type)
+    return row
+
+
+def iter_rows(collection, query: dict = None) -> Iterator[dict]:
+    """Stream the flat export rows of the matching receivables, one at a time"""
+    for document in collection.find(query or {}, RECEIVABLE_PROJECTION, batch_size=EXPORT_BATCH_SIZE):
+        yield flatten_receivable(document)
+
+
+def _record_batch(rows: list) -> pa.RecordBatch:
+    columns = {name: [row[name] for row in rows] for name in RECEIVABLE_SCHEMA.names}
+    return pa.RecordBatch.from_pydict(columns, schema=RECEIVABLE_SCHEMA)
+
+
+def iter_record_batches(collection, query: dict = None, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[pa.RecordBatch]:
+    """Stream the matching receivables as Arrow record batches of at most `batch_size` rows"""
+    rows = []
+    for row in iter_rows(collection, query):
+        rows.append(row)
+        if len(rows) >= batch_size:
+            yield _record_batch(rows)
+            rows = []
+    if rows:
+        yield _record_batch(rows)
+
+
+def stream_arrow(collection, query: dict = None, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """Yield the matching receivables as an Arrow IPC stream, one chunk per record batch"""
+    buffer = io.BytesIO()
+    with pa.ipc.new_stream(buffer, RECEIVABLE_SCHEMA) as writer:
+        for batch in iter_record_batches(collection, query, batch_size):
+            writer.write_batch(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    # End-of-stream marker written on close
+    yield buffer.getvalue()
+
+
+def stream_ndjson(collection, query: dict = None) -> Iterator[bytes]:
+    """Yield the matching receivables as newline-delimited JSON, one row per line"""
+    for row in iter_rows(collection, query):
+        yield (json.dumps(row, default=lambda value: value.isoformat(), ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def _partition(row: dict) -> tuple:
+    emissao = row["CREmissao"]
+    month = emissao.strftime("%Y-%m") if emissao else "unknown"
+    return row["loja"] or "unknown", month
+
+
+def _publish(directory: str, version: str):
+    """
+    Point the `directory` symlink at `version` atomically, keep the previously
+    published version. Older directories are removed, unpublished ones (left by
+    a failed export) included, newer ones are exports still being written.
+    """
+    previous = None
+    if os.path.islink(directory):
+        previous = os.path.join(os.path.dirname(directory), os.readlink(directory))
+    elif os.path.isdir(directory):
+        # Export written before versioned directories, moved aside once
+        previous = f"{directory}{VERSION_SUFFIX}00000000_000000_000000"
+        os.rename(directory, previous)
+    link = f"{directory}.__link"
+    if os.path.lexists(link):
+        os.remove(link)
+    # Relative target, the export stays valid when its volume is mounted elsewhere
+    os.symlink(os.path.basename(version), link)
+    os.replace(link, directory)
+
+    for old_version in glob.glob(f"{glob.escape(directory)}{VERSION_SUFFIX}*"):
+        if old_version < version and old_version != previous:
+            shutil.rmtree(old_version, ignore_errors=True)
+
+
+def export_receivables_parquet(collection, directory: str = None, query: dict = None) -> dict:
+    """
+    Export the receivables as Parquet files partitioned by store and emission month.
+
+    Files are laid out Hive-style (`loja=<loja>/emissao_mes=<YYYY-MM>/part-0.parquet`)
+    and written into a new versioned directory. Once complete, `directory`, a
+    symlink, is flipped to it in one atomic rename, so readers never see a
+    half-written or missing dataset. The previous version is kept for the
+    readers still on it, older ones are removed. Rows are
+    buffered per partition and flushed every EXPORT_BATCH_SIZE rows, the
+    collection is never held in memory.
+
+    Args:
+        collection: Receivables collection.
+        directory (str): Export directory, defaults to EXPORT_DIR/receivables.
+        query (dict): Documents to export, all by default.
+
+    Returns:
+        dict: {"rows", "partitions", "path"}
+    """
+    directory = directory or os.path.join(EXPORT_DIR, "receivables")
+    staging = f"{directory}{VERSION_SUFFIX}{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+    os.makedirs(staging)
+
+    writers, buffers = {}, {}
+    rows = 0
+
+    def flush(partition):
+        if partition not in writers:
+            loja, month = partition
+            path = os.path.join(staging, f"loja={loja}", f"emissao_mes={month}")
+            os.makedirs(path, exist_ok=True)
+            writers[partition] = pq.ParquetWriter(
+                os.path.join(path, "part-0.parquet"), RECEIVABLE_SCHEMA, compression=EXPORT_PARQUET_COMPRESSION
+            )
+        writers[partition].write_batch(_record_batch(buffers.pop(partition)))
+
+    try:
+        try:
+            for row in iter_rows(collection, query):
+                partition = _partition(row)
+                buffers.setdefault(partition, []).append(row)
+                rows += 1
+                if len(buffers[partition]) >= EXPORT_BATCH_SIZE:
+                    flush(partition)
+            for partition in list(buffers):
+                flush(partition)
+        finally:
+            for writer in writers.values():
+                writer.close()
+        _publish(directory, staging)
+    except BaseException:
+        # Never published, the current version stays in place
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    logging.info(f"Exported {rows} receivables to {directory} ({len(writers)} partitions)")
+    return {"rows": rows, "partitions": len(writers), "path": directory}
@@ -0,0 +1,220 @@
+import logging
+import math
+import os
+from datetime import date, datetime
+from itertools import islice
+
+# Columns derived server-side from other fields of the receivable documents.
+# Each one takes part `index` of `source` split on `separator`; add an entry
+# to derive a new column, e.g. "CR.PedOrd": {"source": "numeroDocumento", "separator": "/", "index": 1}
+DERIVED_FIELDS = {
+    "CRPedidoNº": {"source": "numeroDocumento", "separator": "/", "index": 0},
+}
+
+
+def _ref(field: str):
+    """Aggregation reference to a field, literal dotted names (e.g. "CR.PedOrd") included"""
+    if "." in field:
+        return {"$getField": {"field": field, "input": "$$ROOT"}}
+    return f"${field}"
+
+
+def _is_empty(field: str) -> dict:
+    """Filter: field missing, null or empty string"""
+    if "." in field:
+        return {"$expr": {"$in": [{"$ifNull": [_ref(field), ""]}, [""]]}}
+    return {"$or": [{field: {"$exists": False}}, {field: None}, {field: ""}]}
+
+
+def _is_filled(field: str) -> dict:
+    """Filter: field is a non-empty string"""
+    if "." in field:
+        return {"$expr": {"$and": [{"$eq": [{"$type": _ref(field)}, "string"]}, {"$ne": [_ref(field), ""]}]}}
+    return {field: {"$type": "string", "$ne": ""}}
+
+
+def _set(field: str, value) -> dict:
+    """Pipeline stage setting `field`, a literal dotted name is not turned into a sub-document"""
+    if "." in field:
+        return {"$replaceWith": {"$setField": {"field": field, "input": "$$ROOT", "value": value}}}
+    return {"$set": {field: value}}
+
+
+def derive_fields(collection, scope: dict = None, fields: list = None) -> dict:
+    """
+    Compute derived columns with one aggregation-pipeline `update_many` per column.
+
+    Only documents in `scope` whose derived field is missing or empty are
+    updated, so the call is idempotent.
+
+    Args:
+        collection: Receivable collection.
+        scope (dict): Filter limiting the documents processed, e.g. a date range.
+        fields (list): Derived fields to compute, defaults to all of DERIVED_FIELDS.
+
+    Returns:
+        dict: Per field, the "success", "already_processed" and "failed" counters.
+    """
+    scope = scope or {}
+    report = {}
+    for field in fields or DERIVED_FIELDS:
+        spec = DERIVED_FIELDS[field]
+        source = spec["source"]
+        unprocessed = _is_empty(field)
+        has_source = _is_filled(source)
+
+        already_processed = collection.count_documents({"$and": [scope, {"$nor": [unprocessed]}]})
+        without_source = collection.count_documents({"$and": [scope, unprocessed, {"$nor": [has_source]}]})
+        result = collection.update_many(
+            {"$and": [scope, unprocessed, has_source]},
+            [_set(field, {"$arrayElemAt": [{"$split": [_ref(source), spec["separator"]]}, spec["index"]]})]
+        )
+        report[field] = {
+            "success": result.modified_count,
+            "already_processed": already_processed,
+            "failed": without_source + (result.matched_count - result.modified_count),
+        }
+        logging.info(
+            f"Derived {field} from {source}: "
+            f"{report[field]['success']} successfully split, "
+            f"{report[field]['already_processed']} already processed, "
+            f"{report[field]['failed']} failed or missing {source}"
+        )
+    return report
+
+
+def derive_record(record: dict, fields: list = None) -> dict:
+    """
+    Derived fields of one record, computed like derive_fields does server-side,
+    for documents written outside the sync (see webhooks.py). Fields whose
+    source is not a non-empty string are left out.
+    """
+    derived = {}
+    for field in fields or DERIVED_FIELDS:
+        spec = DERIVED_FIELDS[field]
+        source = record.get(spec["source"])
+        if isinstance(source, str) and source:
+            parts = source.split(spec["separator"])
+            derived[field] = parts[spec["index"]] if -len(parts) <= spec["index"] < len(parts) else None
+    return derived
+
+
+def data_controle(emissao):
+    """DataControle of one CREmissao value, like DATA_CONTROLE_EXPRESSION, None when it can't be converted"""
+    if isinstance(emissao, (datetime, date)):
+        return int(emissao.strftime("%Y%m%d"))
+    if isinstance(emissao, str):
+        try:
+            return int(emissao.strip())
+        except ValueError:
+            return None
+    if isinstance(emissao, (int, float)) and not isinstance(emissao, bool) and not (isinstance(emissao, float) and math.isnan(emissao)):
+        return int(emissao)
+    return None
+
+
+# Unprocessed documents converted per update_many, keeps each $in list small
+DATA_CONTROLE_BATCH_SIZE = int(os.getenv("DATA_CONTROLE_BATCH_SIZE", "5000"))
+
+# DataControle is CREmissao converted to an integer (e.g. 2025-02-26 or "20250226" -> 20250226),
+# numbers are truncated and values that can't be converted stay null
+DATA_CONTROLE_EXPRESSION = {
+    "$switch": {
+        "branches": [
+            {
+                # CREmissao as stored by the sync (normalizer.py)
+                "case": {"$eq": [{"$type": "$CREmissao"}, "date"]},
+                "then": {"$toLong": {"$dateToString": {"date": "$CREmissao", "format": "%Y%m%d"}}},
+            },
+            {
+                "case": {"$eq": [{"$type": "$CREmissao"}, "string"]},
+                "then": {"$convert": {"input": {"$trim": {"input": "$CREmissao"}}, "to": "long", "onError": None, "onNull": None}},
+            },
+            {"case": {"$isNumber": "$CREmissao"}, "then": {"$toLong": "$CREmissao"}},
+        ],
+        "default": None,
+    }
+}
+
+
+def compute_data_controle(collection, emissoes: list = None, start=None, end=None, projection: dict = None) -> dict:
+    """
+    Compute DataControle for every unprocessed document of a batch of keys or a date range.
+
+    The unprocessed ids are read, converted server-side with one pipeline
+    `update_many` per DATA_CONTROLE_BATCH_SIZE ids, then the batch is read
+    back and classified.
+
+    Args:
+        collection: Receivable collection.
+        emissoes (list): CREmissao values to process.
+        start: Lower CREmissao bound (inclusive), used when `emissoes` is None.
+        end: Upper CREmissao bound (inclusive), used when `emissoes` is None.
+        projection (dict): Fields returned for each document, all by default.
+
+    Returns:
+        dict: "processed", "already_processed" and "failed" lists of documents.
+    """
+    if emissoes is not None:
+        scope = {"CREmissao": {"$in": list(emissoes)}}
+    else:
+        scope = {"CREmissao": {k: v for k, v in (("$gte", start), ("$lte", end)) if v is not None}}
+    unprocessed = {"$or": [{"DataControle": {"$exists": False}}, {"DataControle": None}]}
+
+    pending_ids = {doc["_id"] for doc in collection.find({"$and": [scope, unprocessed]}, {"_id": 1})}
+    ids = iter(pending_ids)
+    while True:
+        chunk = list(islice(ids, DATA_CONTROLE_BATCH_SIZE))
+        if not chunk:
+            break
+        collection.update_many(
+            {"_id": {"$in": chunk}},
+            [{"$set": {"DataControle": DATA_CONTROLE_EXPRESSION}}]
+        )
+
+    if projection:
+        projection = {**projection, "DataControle": 1}
+    report = {"processed": [], "already_processed": [], "failed": []}
+    for doc in collection.find(scope, projection):
+        if doc["_id"] not in pending_ids:
+            report["already_processed"].append(doc)
+        elif doc.get("DataControle") is None:
+            report["failed"].append(doc)
+        else:
+            report["processed"].append(doc)
+
+    logging.info(
+        f"DataControle: {len(report['processed'])} converted, "
+        f"{len(report['already_processed'])} already processed, "
+        f"{len(report['failed'])} failed"
+    )
+    return report
+
+
+def refresh_derived(collection, records: list, key: str = "CRParcelaID") -> list:
+    """
+    Recompute on `records` the derived fields (DERIVED_FIELDS and DataControle)
+    their stored document already has, before the sync writes them with $set:
+    the fields are kept and follow their source. The documents without them
+    are left to derive_fields and compute_data_controle.
+
+    Returns:
+        list: `records`, updated in place.
+    """
+    fields = [*DERIVED_FIELDS, "DataControle"]
+    # Literal dotted names can't be projected, their documents are read whole
+    projection = None if any("." in field for field in fields) else {key: 1, **dict.fromkeys(fields, 1)}
+    records_iter = iter(records)
+    while True:
+        chunk = list(islice(records_iter, DATA_CONTROLE_BATCH_SIZE))
+        if not chunk:
+            break
+        stored = {doc[key]: doc for doc in collection.find({key: {"$in": [record[key] for record in chunk]}}, projection)}
+        for record in chunk:
+            document = stored.get(record[key])
+            if document is None:
+                continue
+            record.update(derive_record(record, [field for field in DERIVED_FIELDS if field in document]))
+            if "DataControle" in document:
+                record["DataControle"] = data_controle(record.get("CREmissao"))
+    return records
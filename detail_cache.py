@@ -0,0 +1,113 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from time import time
+
+DETAIL_CACHE_PATH = os.getenv("DETAIL_CACHE_PATH", "cache/receivable_details.sqlite3")
+DETAIL_CACHE_TTL_SECONDS = int(os.getenv("DETAIL_CACHE_TTL_SECONDS", str(7 * 24 * 60 * 60)))
+DETAIL_CACHE_MAX_ENTRIES = int(os.getenv("DETAIL_CACHE_MAX_ENTRIES", "100000"))
+
+# List-row fields that change when a parcela changes
+FINGERPRINT_FIELDS = ("situacao", "valor", "saldo", "vencimento")
+
+
+def fingerprint(row: dict, fields=FINGERPRINT_FIELDS) -> str:
+    """Hash of the list-row fields, a different value means the detail must be re-fetched"""
+    payload = json.dumps([row.get(field) for field in fields], default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class DetailCache:
+    """
+    On-disk cache of `/contas/receber/{id}` responses, keyed by parcela id and
+    the fingerprint of its list row. Entries expire after `ttl` seconds and
+    the least recently used ones are evicted above `max_entries`.
+    """
+
+    def __init__(self, path: str = DETAIL_CACHE_PATH, ttl: int = DETAIL_CACHE_TTL_SECONDS, max_entries: int = DETAIL_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS details ("
+            "parcela_id TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, payload TEXT NOT NULL, "
+            "stored_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS details_accessed_at ON details (accessed_at)")
+        self._conn.commit()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evicted = 0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "stores": self.stores, "evicted": self.evicted}
+
+    def get(self, parcela_id, row: dict) -> dict:
+        """Return the cached detail if the row is unchanged and the entry is fresh, else None"""
+        now = time()
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT fingerprint, payload, stored_at FROM details WHERE parcela_id = ?", (str(parcela_id),)
+            ).fetchone()
+            if found and found[0] == fingerprint(row) and now - found[2] < self.ttl:
+                self._conn.execute("UPDATE details SET accessed_at = ? WHERE parcela_id = ?", (now, str(parcela_id)))
+                self._conn.commit()
+                self.hits += 1
+                return json.loads(found[1])
+            self.misses += 1
+            return None
+
+    def put(self, parcela_id, row: dict, detail: dict):
+        now = time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO details (parcela_id, fingerprint, payload, stored_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (str(parcela_id), fingerprint(row), json.dumps(detail, default=str), now, now)
+            )
+            self._conn.commit()
+            self.stores += 1
+
+    def evict(self) -> int:
+        """Drop expired entries, then the least recently used ones above max_entries"""
+        with self._lock:
+            expired = self._conn.execute("DELETE FROM details WHERE stored_at < ?", (time() - self.ttl,)).rowcount
+            overflow = self._conn.execute(
+                "DELETE FROM details WHERE parcela_id IN ("
+                "SELECT parcela_id FROM details ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            ).rowcount
+            self._conn.commit()
+            self.evicted += expired + overflow
+        if expired or overflow:
+            logging.info(f"Detail cache evicted {expired} expired and {overflow} least recently used entries")
+        return expired + overflow
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_detail_cache = None
+_detail_cache_lock = threading.Lock()
+
+
+def get_detail_cache() -> DetailCache:
+    """Return the process-wide detail cache, opened on first use"""
+    global _detail_cache
+    if _detail_cache is None:
+        with _detail_cache_lock:
+            if _detail_cache is None:
+                _detail_cache = DetailCache()
+    return _detail_cache
@@ -0,0 +1,103 @@
+import logging
+import os
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Callable, Iterable
+
+# Requests in flight at once; every request still goes through the Bling rate limiter
+BLING_CONCURRENCY = int(os.getenv("BLING_CONCURRENCY", "4"))
+
+
+@dataclass
+class FanoutResult:
+    """Outcome of fan_out: inputs and results share the input order"""
+    items: list = field(default_factory=list)
+    results: list = field(default_factory=list)
+    failures: dict = field(default_factory=dict)  # key: error message
+
+    def succeeded(self) -> list:
+        """Return (item, result) pairs for the items that didn't fail"""
+        return [(item, result) for item, result in zip(self.items, self.results) if result is not None]
+
+
+def fan_out(
+    items: Iterable,
+    fetch: Callable,
+    key: Callable = None,
+    max_workers: int = BLING_CONCURRENCY,
+    retry_rounds: int = 1,
+    executor: ThreadPoolExecutor = None,
+) -> FanoutResult:
+    """
+    Call `fetch(item)` for every item with at most `max_workers` calls in flight.
+
+    `items` may be a generator (e.g. a paginated stream), it is consumed lazily
+    so fetching starts before the input is exhausted. A call fails when it
+    raises or returns None; failed items are retried `retry_rounds` times once
+    the first pass is done.
+
+    Args:
+        items (Iterable): Inputs, e.g. receivable rows or module ids.
+        fetch (Callable): Function doing the request for one item.
+        key (Callable): Returns the id reported in `failures`, defaults to the item.
+        max_workers (int): Concurrency limit.
+        retry_rounds (int): Extra passes over the failed items.
+        executor (ThreadPoolExecutor): Shared worker pool to run on, e.g. across
+            stores; `max_workers` still bounds the calls in flight for this input.
+
+    Returns:
+        FanoutResult: Results in input order, None where the call failed.
+    """
+    key = key or (lambda item: item)
+    shared_executor = executor
+    result = FanoutResult()
+
+    def run(indexes):
+        errors = {}
+        if shared_executor is not None:
+            pool_context = nullcontext(shared_executor)
+        else:
+            pool_context = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bling-fanout")
+        with pool_context as pool:
+            pending = {}
+            for index in indexes:
+                # At most max_workers submitted calls, so a lazy input isn't drained up front
+                # and a shared executor runs no more than that for this input
+                if len(pending) >= max_workers:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(pending.pop(future), future, errors)
+                pending[pool.submit(fetch, result.items[index])] = index
+            for future in list(pending):
+                collect(pending.pop(future), future, errors)
+        return errors
+
+    def collect(index, future, errors):
+        try:
+            value = future.result()
+        except Exception as e:
+            value, error = None, str(e) or type(e).__name__
+        else:
+            error = None if value is not None else "no data returned"
+        result.results[index] = value
+        if error:
+            errors[index] = error
+
+    def indexed_input():
+        for item in items:
+            result.items.append(item)
+            result.results.append(None)
+            yield len(result.items) - 1
+
+    errors = run(indexed_input())
+    for round_number in range(retry_rounds):
+        if not errors:
+            break
+        logging.info(f"Retrying {len(errors)} failed items (round {round_number + 1}/{retry_rounds})")
+        errors = run(list(errors))
+
+    result.failures = {key(result.items[index]): error for index, error in errors.items()}
+    if result.failures:
+        logging.error(f"{len(result.failures)} of {len(result.items)} items failed: {list(result.failures)[:20]}")
+    return result
@@ -0,0 +1,89 @@
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BLING_HTTP_POOL_SIZE = int(os.getenv("BLING_HTTP_POOL_SIZE", "10"))
+BLING_HTTP_CONNECT_TIMEOUT = float(os.getenv("BLING_HTTP_CONNECT_TIMEOUT", "5"))
+BLING_HTTP_READ_TIMEOUT = float(os.getenv("BLING_HTTP_READ_TIMEOUT", "30"))
+BLING_HTTP_RETRIES = int(os.getenv("BLING_HTTP_RETRIES", "3"))
+
+
+class HttpClient:
+    """
+    Keep-alive `requests.Session` with a sized connection pool, default
+    timeouts and transport-level retries (connection errors and 5xx).
+
+    429 answers are not retried here, they are left to the rate limiter.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = BLING_HTTP_POOL_SIZE,
+        connect_timeout: float = BLING_HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = BLING_HTTP_READ_TIMEOUT,
+        retries: int = BLING_HTTP_RETRIES,
+        backoff_factor: float = 0.5,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD", "OPTIONS"]),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def connection_stats(self) -> dict:
+        """
+        Return connection reuse per host for the pools currently alive.
+
+        Returns:
+            dict: {"https://host:port": {"connections": int, "requests": int, "reused": int}}
+        """
+        stats = {}
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{key.key_scheme}://{key.key_host}:{key.key_port}"
+            entry = stats.setdefault(host, {"connections": 0, "requests": 0, "reused": 0})
+            entry["connections"] += pool.num_connections
+            entry["requests"] += pool.num_requests
+            entry["reused"] += max(0, pool.num_requests - pool.num_connections)
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    """Return the process-wide HttpClient, creating it on first use"""
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = HttpClient()
+    return _default_client
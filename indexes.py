@@ -0,0 +1,187 @@
+import logging
+import os
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from settings import setting
+
+# Collection of each dataset, from the same environment variables as bling_sources
+DATASET_COLLECTIONS = {
+    "sellers": "MONGO_COLLECTION_SELLERS",
+    "modulos": "MONGO_COLLECTION_MODULOS",
+    "payment_methods": "MONGO_COLLECTION_PAYMENT_METHODS",
+    "receivables": "MONGO_COLLECTION_RECEIVABLE",
+}
+
+# Processed webhook events are kept this long, redeliveries within it are detected as duplicates
+WEBHOOK_EVENTS_RETENTION_DAYS = int(os.getenv("WEBHOOK_EVENTS_RETENTION_DAYS", "7"))
+
+# Declared indexes per dataset. MongoDB partial filters can't express
+# "$exists: False", so unprocessed DataControle lookups use the compound
+# index (missing fields are indexed as null) and the partial index serves
+# the already-processed lookups.
+INDEX_SPECS = {
+    "sellers": [
+        {"name": "id_unique", "keys": [("id", ASCENDING)], "unique": True},
+    ],
+    "modulos": [
+        {"name": "module_id", "keys": [("module_id", ASCENDING)]},
+    ],
+    "payment_methods": [
+        {"name": "id_unique", "keys": [("id", ASCENDING)], "unique": True},
+    ],
+    "receivables": [
+        {"name": "CRParcelaID_unique", "keys": [("CRParcelaID", ASCENDING)], "unique": True},
+        {"name": "CREmissao_DataControle", "keys": [("CREmissao", ASCENDING), ("DataControle", ASCENDING)]},
+        {
+            "name": "CREmissao_DataControle_processed",
+            "keys": [("CREmissao", ASCENDING)],
+            "partialFilterExpression": {"DataControle": {"$exists": True}},
+        },
+        {"name": "dataEmissao_x_CRPedidoN", "keys": [("dataEmissao_x", ASCENDING), ("CRPedidoNº", ASCENDING)]},
+        {"name": "loja_CREmissao", "keys": [("loja", ASCENDING), ("CREmissao", ASCENDING)]},
+        {"name": "CREmissao__id", "keys": [("CREmissao", ASCENDING), ("_id", ASCENDING)]},
+    ],
+    # Queue of webhooks.py, claimed by status and due date
+    "webhook_events": [
+        {"name": "status_available_at", "keys": [("status", ASCENDING), ("available_at", ASCENDING)]},
+        {
+            "name": "processed_at_ttl",
+            "keys": [("processed_at", ASCENDING)],
+            "expireAfterSeconds": WEBHOOK_EVENTS_RETENTION_DAYS * 24 * 60 * 60,
+        },
+    ],
+}
+
+# Known hot queries, each must be served by an index
+QUERY_CHECKS = [
+    ("receivables", "CREmissao range", lambda: {"CREmissao": {"$gte": datetime.now() - timedelta(days=1)}}),
+    ("receivables", "dataEmissao_x range", lambda: {"dataEmissao_x": {"$gte": (datetime.now() - timedelta(days=4)).strftime("%Y-%m-%d")}}),
+    ("receivables", "unprocessed DataControle", lambda: {"CREmissao": datetime.now(), "$or": [{"DataControle": {"$exists": False}}, {"DataControle": None}]}),
+    ("receivables", "processed DataControle", lambda: {"CREmissao": datetime.now(), "DataControle": {"$exists": True, "$ne": None}}),
+    ("receivables", "CRParcelaID upsert", lambda: {"CRParcelaID": 0}),
+    ("receivables", "API page by emission", lambda: {"CREmissao": {"$gte": datetime.now() - timedelta(days=30)}}),
+]
+
+# Index options compared by the drift detection
+_COMPARED_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+class IndexPlanError(Exception):
+    """Raised when a known query is not served by an index"""
+
+
+def collection_name(dataset: str) -> str:
+    if dataset in DATASET_COLLECTIONS:
+        return setting(DATASET_COLLECTIONS[dataset])
+    # Datasets added later (see pipelines.py) default to their own name
+    return setting(f"MONGO_COLLECTION_{dataset.upper()}", dataset)
+
+
+def index_models(dataset: str) -> list:
+    """Return the declared indexes of a dataset as pymongo IndexModels"""
+    models = []
+    for spec in INDEX_SPECS.get(dataset, []):
+        options = {k: v for k, v in spec.items() if k != "keys"}
+        models.append(IndexModel(spec["keys"], **options))
+    return models
+
+
+def ensure_indexes(db) -> dict:
+    """
+    Create the declared indexes that are missing, idempotently.
+
+    Existing indexes declared with different keys or options are reported
+    as drift and left alone, so a bad spec never drops a live index.
+
+    Returns:
+        dict: Names of the indexes created per dataset.
+    """
+    created = {}
+    for dataset in INDEX_SPECS:
+        collection = db[collection_name(dataset)]
+        created[dataset] = []
+        for model in index_models(dataset):
+            try:
+                created[dataset].extend(collection.create_indexes([model]))
+            except OperationFailure as e:
+                logging.error(f"Could not create index {model.document['name']} on {collection.name}: {e}")
+    for dataset, drift in detect_drift(db).items():
+        if any(drift.values()):
+            logging.warning(f"Index drift on {collection_name(dataset)}: {drift}")
+    logging.info(f"Indexes ensured: {created}")
+    return created
+
+
+def detect_drift(db) -> dict:
+    """
+    Compare the live indexes with INDEX_SPECS.
+
+    Returns:
+        dict: Per dataset, the "missing", "changed" and "unexpected" index names.
+    """
+    report = {}
+    for dataset in INDEX_SPECS:
+        live = db[collection_name(dataset)].index_information()
+        live.pop("_id_", None)
+        declared = {model.document["name"]: model.document for model in index_models(dataset)}
+        missing, changed = [], []
+        for name, document in declared.items():
+            if name not in live:
+                missing.append(name)
+                continue
+            live_keys = [tuple(key) for key in live[name]["key"]]
+            declared_keys = list(document["key"].items())
+            live_options = {k: live[name].get(k) for k in _COMPARED_OPTIONS}
+            declared_options = {k: document.get(k) for k in _COMPARED_OPTIONS}
+            # unique=False and a missing unique flag are the same thing
+            live_options["unique"] = bool(live_options["unique"])
+            declared_options["unique"] = bool(declared_options["unique"])
+            if live_keys != declared_keys or live_options != declared_options:
+                changed.append(name)
+        report[dataset] = {
+            "missing": missing,
+            "changed": changed,
+            "unexpected": sorted(set(live) - set(declared)),
+        }
+    return report
+
+
+def _plan_stages(plan) -> list:
+    """Return every stage name of an explain plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_plan_stages(value))
+    return stages
+
+
+def check_query_plans(db) -> dict:
+    """
+    Explain every query of QUERY_CHECKS and fail when one falls back to COLLSCAN.
+
+    Returns:
+        dict: Winning plan stages per query.
+
+    Raises:
+        IndexPlanError: Listing the queries doing a full collection scan.
+    """
+    plans = {}
+    scans = []
+    for dataset, name, build_filter in QUERY_CHECKS:
+        explain = db[collection_name(dataset)].find(build_filter()).explain()
+        stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        plans[name] = stages
+        if "COLLSCAN" in stages:
+            scans.append(f"{name} on {collection_name(dataset)}")
+    if scans:
+        raise IndexPlanError(f"Queries without index support (COLLSCAN): {', '.join(scans)}")
+    logging.info(f"Query plans checked: {plans}")
+    return plans
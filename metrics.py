@@ -0,0 +1,149 @@
+import logging
+import os
+import re
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from time import perf_counter
+
+from prometheus_client import REGISTRY, Counter, Histogram, start_http_server
+
+# Port of the ingester's /metrics endpoint, 0 disables it (the API serves its own)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+MONGO_COLLECTION_SYNC_RUNS = os.getenv("MONGO_COLLECTION_SYNC_RUNS", "sync_runs")
+
+BLING_REQUESTS = Counter(
+    "bling_requests", "Bling API responses", ["endpoint", "status"]
+)
+BLING_REQUEST_SECONDS = Histogram(
+    "bling_request_seconds", "Bling API request latency, per attempt", ["endpoint"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+BLING_THROTTLED = Counter(
+    "bling_throttled", "Bling API 429 responses", ["endpoint"]
+)
+BLING_RETRIES = Counter(
+    "bling_retries", "Bling API requests sent again after a 429", ["endpoint"]
+)
+TOKEN_CACHE = Counter(
+    "bling_token_cache", "Access token cache lookups", ["result"]
+)
+TOKEN_FETCH_SECONDS = Histogram(
+    "bling_token_fetch_seconds", "Access token fetch latency"
+)
+RECORDS_FETCHED = Counter(
+    "sync_records_fetched", "Records fetched from the Bling API", ["dataset", "loja"]
+)
+MONGO_DOCUMENTS = Counter(
+    "mongo_documents", "Documents handled by the MongoDB writers", ["collection", "operation"]
+)
+MONGO_WRITE_SECONDS = Histogram(
+    "mongo_write_seconds", "MongoDB bulk write latency", ["collection", "operation"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+WEBHOOK_EVENTS = Counter(
+    "bling_webhook_events", "Webhook events by outcome (queued, duplicate, ignored, done, retried, failed)", ["dataset", "status"]
+)
+STAGE_SECONDS = Histogram(
+    "sync_stage_seconds", "Duration of the sync pipeline stages", ["stage", "dataset"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800),
+)
+
+_ENDPOINT_ID = re.compile(r"/\d+")
+_server_lock = threading.Lock()
+_server_started = False
+
+
+def endpoint_label(url: str, base_url: str = None) -> str:
+    """Bling API path with ids replaced, e.g. /contas/receber/{id}, to bound the label values"""
+    path = str(url)
+    if base_url and path.startswith(base_url):
+        path = path[len(base_url):]
+    else:
+        path = re.sub(r"^[a-z]+://[^/]+", "", path)
+    return _ENDPOINT_ID.sub("/{id}", path.split("?")[0]) or "/"
+
+
+@contextmanager
+def stage(name: str, dataset: str = ""):
+    """Time a pipeline stage into sync_stage_seconds"""
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(name, dataset).observe(perf_counter() - started)
+
+
+def start_metrics_server(port: int = METRICS_PORT) -> bool:
+    """Serve /metrics for this process, once. Returns whether a server is running"""
+    global _server_started
+    if port <= 0:
+        return False
+    with _server_lock:
+        if not _server_started:
+            start_http_server(port)
+            _server_started = True
+            logging.info(f"Prometheus metrics served on port {port}")
+    return True
+
+
+# Families of this module, sampled into the per-run summary
+_SUMMARY_METRICS = (
+    BLING_REQUESTS, BLING_REQUEST_SECONDS, BLING_THROTTLED, BLING_RETRIES, TOKEN_CACHE,
+    TOKEN_FETCH_SECONDS, RECORDS_FETCHED, MONGO_DOCUMENTS, MONGO_WRITE_SECONDS, STAGE_SECONDS, WEBHOOK_EVENTS,
+)
+_SUMMARY_SUFFIXES = ("_total", "_sum", "_count")
+
+
+def snapshot() -> dict:
+    """Current value of every counter and histogram sum/count, keyed by (sample name, labels)"""
+    values = {}
+    names = {metric._name for metric in _SUMMARY_METRICS}
+    for family in REGISTRY.collect():
+        if family.name not in names:
+            continue
+        for sample in family.samples:
+            if sample.name.endswith(_SUMMARY_SUFFIXES):
+                values[(sample.name, tuple(sorted(sample.labels.items())))] = sample.value
+    return values
+
+
+class RunSummary:
+    """
+    Metrics of one sync run, as the difference of two snapshots, stored
+    in MONGO_COLLECTION_SYNC_RUNS to follow the performance over time.
+
+    Runs overlapping in the same process (e.g. the receivables and the
+    reference jobs) share the counters, so each summary includes both.
+    """
+
+    def __init__(self, kind: str, **fields):
+        self.kind = kind
+        self.fields = fields
+        self.started_at = datetime.now()
+        self._started = perf_counter()
+        self._before = snapshot()
+
+    def finish(self, db=None, **fields) -> dict:
+        """Build the summary document and insert it when `db` is given"""
+        after = snapshot()
+        samples = []
+        for (name, labels), value in sorted(after.items()):
+            delta = value - self._before.get((name, labels), 0.0)
+            if delta:
+                samples.append({"metric": name, "labels": dict(labels), "value": delta})
+        document = {
+            "kind": self.kind,
+            "started_at": self.started_at,
+            "finished_at": datetime.now(),
+            "duration_seconds": perf_counter() - self._started,
+            **self.fields,
+            **fields,
+            "metrics": samples,
+        }
+        if db is not None:
+            try:
+                db[MONGO_COLLECTION_SYNC_RUNS].insert_one(document)
+            except Exception as e:
+                logging.error(f"Could not store the run summary: {e}")
+        return document
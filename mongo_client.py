@@ -0,0 +1,182 @@
+import logging
+import os
+import threading
+from time import monotonic
+
+from pymongo import MongoClient
+from pymongo.monitoring import ConnectionPoolListener
+
+from settings import setting
+
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "2"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "10000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "10000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "120000"))
+
+
+class PoolStatsListener(ConnectionPoolListener):
+    """Collect connection pool usage and checkout wait times"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections_open = 0
+            self.connections_created = 0
+            self.in_use = 0
+            self.max_in_use = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "connections_open": self.connections_open,
+                "connections_created": self.connections_created,
+                "in_use": self.in_use,
+                "max_in_use": self.max_in_use,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+    def _waited(self) -> float:
+        started = getattr(self._local, "started", None)
+        return monotonic() - started if started is not None else 0.0
+
+    def connection_check_out_started(self, event):
+        self._local.started = monotonic()
+
+    def connection_checked_out(self, event):
+        waited = self._waited()
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use = max(0, self.in_use - 1)
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_open += 1
+            self.connections_created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_open = max(0, self.connections_open - 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+
+pool_listener = PoolStatsListener()
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> MongoClient:
+    """
+    Return the process-wide MongoClient, created on first use.
+
+    Every module shares this client and its connection pool. After a fork the
+    child builds its own client instead of reusing the parent's sockets.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = MongoClient(
+                    setting("MONGO_URI"),
+                    maxPoolSize=MONGO_MAX_POOL_SIZE,
+                    minPoolSize=MONGO_MIN_POOL_SIZE,
+                    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+                    event_listeners=[pool_listener],
+                )
+                _client_pid = os.getpid()
+    return _client
+
+
+def get_db(name: str = None):
+    """Return a database of the shared client, MONGO_DATABASE by default"""
+    return get_client()[name or setting("MONGO_DATABASE")]
+
+
+def get_collection(name: str, database: str = None):
+    """Return a collection of the shared client"""
+    return get_db(database)[name]
+
+
+def check_connection() -> bool:
+    """Ping the server once, logging the outcome. Called by entry points, never on import"""
+    try:
+        get_client().admin.command("ping")
+        logging.info("Successfully connected to MongoDB")
+        return True
+    except Exception as e:
+        logging.error(f"Failed to connect to MongoDB: {str(e)}")
+        return False
+
+
+def pool_stats() -> dict:
+    """Return connection pool usage and checkout wait times of the shared client"""
+    return pool_listener.snapshot()
+
+
+def close_client():
+    """Close the shared client, the next get_client() call opens a new one"""
+    global _client, _client_pid
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+def _reset_after_fork():
+    # The parent's client must not be used nor closed from the child,
+    # and locks held by other parent threads at fork time are never released
+    global _client, _client_pid, _client_lock
+    _client = None
+    _client_pid = None
+    _client_lock = threading.Lock()
+    pool_listener._lock = threading.Lock()
+    pool_listener.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
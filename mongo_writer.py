@@ -0,0 +1,128 @@
+import hashlib
+import json
+import logging
+import os
+from typing import Iterable, Sequence
+
+from pymongo import ReplaceOne, UpdateOne
+
+from metrics import MONGO_DOCUMENTS, MONGO_WRITE_SECONDS
+
+MONGO_WRITE_BATCH_SIZE = int(os.getenv("MONGO_WRITE_BATCH_SIZE", "1000"))
+
+# Hash of the synced content, used by diff mode to skip unchanged documents
+HASH_FIELD = "_sync_hash"
+
+
+def record_hash(record: dict) -> str:
+    """Stable hash of a record's content, ignoring _id and the hash field itself"""
+    content = {k: v for k, v in record.items() if k not in ("_id", HASH_FIELD)}
+    payload = json.dumps(content, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def _key_name(key_fields: Sequence[str]) -> str:
+    if len(key_fields) == 1 and "." not in key_fields[0]:
+        return key_fields[0]
+    return "_id"
+
+
+def natural_key_filter(record: dict, key_fields: Sequence[str]) -> dict:
+    """
+    Return the filter matching a record by its natural key.
+
+    A single plain field is matched directly (e.g. {"CRParcelaID": 123}).
+    Compound keys, or fields whose name contains a dot such as "id.Situacoes",
+    can't be used in a filter, so their values are joined into `_id`.
+    """
+    key_name = _key_name(key_fields)
+    if key_name == "_id":
+        record["_id"] = ":".join(str(record[field]) for field in key_fields)
+    return {key_name: record[key_name]}
+
+
+def bulk_upsert(
+    collection,
+    records: Iterable[dict],
+    key_fields: Sequence[str],
+    batch_size: int = MONGO_WRITE_BATCH_SIZE,
+    diff: bool = False,
+    prune_missing: bool = False,
+    prune_scope: dict = None,
+    update: bool = False,
+) -> dict:
+    """
+    Idempotently write records with unordered `bulk_write` ReplaceOne(upsert=True) batches.
+
+    Args:
+        collection: MongoDB collection.
+        records (Iterable[dict]): Records to write, may be a generator.
+        key_fields (Sequence[str]): Natural key, e.g. ("CRParcelaID",).
+        batch_size (int): Operations per bulk_write call.
+        diff (bool): Skip records whose content hash matches the stored one.
+        prune_missing (bool): Delete documents whose key isn't in `records`,
+            for datasets that are full snapshots (sellers, payment methods...).
+        prune_scope (dict): Limits the pruning, e.g. to the store being synced.
+        update (bool): Write UpdateOne($set) instead, keeping the stored fields the
+            records don't have, e.g. those derived after the sync (see derivations.py).
+
+    Returns:
+        dict: {"written", "upserted", "modified", "skipped", "pruned"} counters.
+    """
+    key_name = _key_name(key_fields)
+    counters = {"written": 0, "upserted": 0, "modified": 0, "skipped": 0, "pruned": 0}
+    seen_keys = []
+
+    def flush(batch):
+        if diff:
+            changed = skip_unchanged(collection, key_name, batch)
+            counters["skipped"] += len(batch) - len(changed)
+            batch = changed
+        if not batch:
+            return
+        with MONGO_WRITE_SECONDS.labels(collection.name, "bulk_upsert").time():
+            if update:
+                operations = [UpdateOne(f, {"$set": r}, upsert=True) for f, r in batch]
+            else:
+                operations = [ReplaceOne(f, r, upsert=True) for f, r in batch]
+            result = collection.bulk_write(operations, ordered=False)
+        counters["written"] += len(batch)
+        counters["upserted"] += result.upserted_count
+        counters["modified"] += result.modified_count
+
+    batch = []
+    for record in records:
+        if key_name != "_id":
+            # A stale _id (e.g. left by insert_many) can't replace an existing document's _id
+            record.pop("_id", None)
+        key_filter = natural_key_filter(record, key_fields)
+        if diff:
+            record[HASH_FIELD] = record_hash(record)
+        if prune_missing:
+            seen_keys.append(key_filter[key_name])
+        batch.append((key_filter, record))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    if prune_missing and seen_keys:
+        counters["pruned"] = collection.delete_many({**(prune_scope or {}), key_name: {"$nin": seen_keys}}).deleted_count
+    elif prune_missing:
+        logging.warning(f"No records for {collection.name}, keeping existing documents")
+
+    for operation in ("upserted", "modified", "skipped", "pruned"):
+        MONGO_DOCUMENTS.labels(collection.name, operation).inc(counters[operation])
+    logging.info(f"Bulk upsert into {collection.name}: {counters}")
+    return counters
+
+
+def skip_unchanged(collection, key_name: str, batch: list) -> list:
+    """Drop the (filter, record) pairs whose stored hash equals the new one"""
+    keys = [f[key_name] for f, _ in batch]
+    stored = {
+        doc[key_name]: doc.get(HASH_FIELD)
+        for doc in collection.find({key_name: {"$in": keys}}, {key_name: 1, HASH_FIELD: 1})
+    }
+    return [(f, r) for f, r in batch if stored.get(f[key_name]) != r[HASH_FIELD]]
@@ -0,0 +1,176 @@
+import math
+from datetime import date, datetime
+from typing import Callable, Iterable, Iterator
+
+# Declarative transforms per dataset, applied in order: flatten, rename, coalesce, types.
+# - flatten: nested documents expanded into dotted fields ("contato" -> "contato.nome")
+# - rename: field -> new name, only for fields present
+# - coalesce: field -> source fields, set to the first one present when the field is absent
+# - types: field -> "str" | "float" | "number" | "datetime", only for fields present
+SCHEMAS = {
+    "sellers": {
+        "flatten": ("loja", "contato"),
+        "rename": {"contato.nome": "CRVendedor"},
+        "types": {"id": "str", "descontoLimite": "float", "loja.id": "str", "contato.id": "str", "CRVendedor": "str"},
+    },
+    "modulos": {
+        "types": {"id": "str", "nome": "str", "descricao": "str"},
+    },
+    "situacoes": {
+        "types": {"id": "str", "nome": "str", "idHerdado": "str", "cor": "str"},
+    },
+    "payment_methods": {
+        "types": {"id": "str", "descricao": "str", "tipoPagamento": "str", "situacao": "str", "padrao": "str", "finalidade": "str"},
+    },
+    # Applied to the list row merged with its detail (see merge_records). Fields of
+    # both sides are suffixed by the merge, so the renames only apply to rows
+    # without detail and the CR fields are coalesced from the detail (_y) first,
+    # the suffixed fields being kept as they are.
+    "receivables": {
+        "rename": {
+            "situacao": "CRSituacao",
+            "vencimento": "CRVenc",
+            "valor": "CRValorParcela",
+            "dataEmissao": "CREmissao",
+            "saldo": "CRSaldoVenda",
+            "vendedorid": "CRVendedorID",
+            "formaPagamentoid": "CRFormaPagamento",
+            "contatoid": "CRContatoID",
+        },
+        "coalesce": {
+            "CRSituacao": ("situacao_y", "situacao_x"),
+            "CRVenc": ("vencimento_y", "vencimento_x"),
+            "CRValorParcela": ("valor_y", "valor_x"),
+            "CREmissao": ("dataEmissao_y", "dataEmissao_x"),
+            "CRSaldoVenda": ("saldo_y", "saldo_x"),
+        },
+        "types": {"CRVenc": "datetime", "CREmissao": "datetime", "CRValorParcela": "number", "CRSaldoVenda": "number"},
+    },
+}
+
+
+def _is_missing(value) -> bool:
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def to_str(value):
+    return None if _is_missing(value) else str(value)
+
+
+def to_float(value):
+    if _is_missing(value) or value == "":
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def to_number(value):
+    """Like pd.to_numeric(errors="coerce"): keep ints as ints, None when not a number"""
+    if _is_missing(value) or isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return to_float(value)
+
+
+def to_datetime(value):
+    """Like pd.to_datetime(errors="coerce") for ISO dates, None instead of NaT"""
+    if _is_missing(value) or value == "":
+        return None
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+COERCERS = {
+    "str": to_str,
+    "float": to_float,
+    "number": to_number,
+    "datetime": to_datetime,
+}
+
+
+def _flatten_into(record: dict, prefix: str, value: dict):
+    for key, item in value.items():
+        if isinstance(item, dict):
+            _flatten_into(record, f"{prefix}.{key}", item)
+        else:
+            record[f"{prefix}.{key}"] = item
+
+
+def compile_schema(schema: dict) -> Callable[[dict], dict]:
+    """
+    Compile a schema of SCHEMAS into a function normalizing one record.
+
+    The returned function builds a new dict and never mutates its input.
+    Missing values stay None (no NaN/NaT) and absent fields stay absent.
+    """
+    flatten = tuple(schema.get("flatten", ()))
+    rename = dict(schema.get("rename", {}))
+    coalesce = dict(schema.get("coalesce", {}))
+    types = [(field, COERCERS[type_name]) for field, type_name in schema.get("types", {}).items()]
+
+    def normalize(record: dict) -> dict:
+        out = {}
+        for key, value in record.items():
+            if key in flatten and isinstance(value, dict):
+                _flatten_into(out, key, value)
+            else:
+                out[key] = value
+        if rename:
+            out = {rename.get(key, key): value for key, value in out.items()}
+        for field, sources in coalesce.items():
+            if field not in out:
+                for source in sources:
+                    if source in out and not _is_missing(out[source]):
+                        out[field] = out[source]
+                        break
+        for field, coerce in types:
+            if field in out:
+                out[field] = coerce(out[field])
+        return out
+
+    return normalize
+
+
+NORMALIZERS = {dataset: compile_schema(schema) for dataset, schema in SCHEMAS.items()}
+
+
+def normalize(dataset: str, records: Iterable[dict]) -> Iterator[dict]:
+    """Stream the normalized records of a dataset, one at a time"""
+    transform = NORMALIZERS[dataset]
+    for record in records:
+        yield transform(record)
+
+
+def merge_records(left: dict, right: dict, on: str, suffixes=("_x", "_y"), right_fields=None) -> dict:
+    """
+    Merge two records like a pandas merge on `on`: fields present on both
+    sides get the suffixes, the others keep their name.
+
+    Args:
+        right (dict): May be None (left merge without match).
+        right_fields: Fields of the whole right side, like the columns of a
+            DataFrame, so unmatched records are suffixed the same way as
+            matched ones. Defaults to the fields of `right`.
+    """
+    right = right or {}
+    right_fields = right.keys() if right_fields is None else right_fields
+    merged = {}
+    for key, value in left.items():
+        merged[key if key == on or key not in right_fields else f"{key}{suffixes[0]}"] = value
+    for key, value in right.items():
+        if key == on:
+            continue
+        merged[key if key not in left else f"{key}{suffixes[1]}"] = value
+    return merged
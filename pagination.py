@@ -0,0 +1,106 @@
+import logging
+import queue
+import threading
+from typing import Iterable, Iterator, Tuple
+
+from access_api import get, get_headers
+from http_client import HttpClient
+
+# Largest page size accepted by Bling API v3 list endpoints
+BLING_PAGE_LIMIT = 100
+
+
+def iter_pages(
+    url: str,
+    params: dict = None,
+    loja=None,
+    client: HttpClient = None,
+    limit: int = BLING_PAGE_LIMIT,
+    start_page: int = 1,
+) -> Iterator[Tuple[int, list]]:
+    """
+    Lazily walk a paginated Bling list endpoint using `pagina`/`limite`.
+
+    Stops on the first empty page: Bling may serve fewer rows than `limit`
+    asked for, so a short page doesn't mean it was the last one.
+
+    Args:
+        url (str): Endpoint URL, e.g. f"{API_BASE_URL}/contas/receber".
+        params (dict): Extra query parameters (filters).
+        loja (str): Store whose token is used, defaults to LOJA.
+        client (HttpClient): HTTP client, defaults to the shared one.
+        limit (int): Page size, defaults to the API maximum.
+        start_page (int): First page to request.
+
+    Yields:
+        tuple: (page number, list of records on that page)
+
+    Raises:
+        requests.HTTPError: When a page can't be fetched, so no page is silently lost.
+    """
+    page = start_page
+    while True:
+        page_params = dict(params or {}, pagina=page, limite=limit)
+        response = get(url, headers=get_headers(loja, client=client), params=page_params, client=client, loja=loja)
+        if response.status_code != 200:
+            logging.error(f"Failed to fetch page {page} of {url}: {response.status_code}, {response.text}")
+            response.raise_for_status()
+        records = response.json().get("data", [])
+        if not records:
+            return
+        logging.info(f"Fetched page {page} of {url} with {len(records)} records")
+        yield page, records
+        page += 1
+
+
+def iter_records(url: str, params: dict = None, loja=None, client: HttpClient = None, limit: int = BLING_PAGE_LIMIT) -> Iterator[dict]:
+    """Yield every record of a paginated Bling list endpoint, one at a time"""
+    for _, records in iter_pages(url, params, loja=loja, client=client, limit=limit):
+        yield from records
+
+
+_DONE = object()
+
+
+def prefetch(iterable: Iterable, buffer: int = 2) -> Iterator:
+    """
+    Consume `iterable` in a background thread, keeping up to `buffer` items ahead.
+
+    Lets downstream stages (detail fetch, transform, Mongo write) work on the
+    first pages while the next ones are still loading. Exceptions raised by the
+    producer are re-raised in the consumer.
+    """
+    items = queue.Queue(maxsize=buffer)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        """Queue an item unless the consumer is gone, a full queue would block forever"""
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(e)
+
+    producer = threading.Thread(target=produce, name="bling-prefetch", daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
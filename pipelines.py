@@ -0,0 +1,330 @@
+"""
+Declarative Bling datasets and the executor that syncs them.
+
+A dataset is declared once in PIPELINES: its list endpoint and filters,
+whether it is paginated, an optional per-record detail request (merged into
+the record) or child list (one record per child), and the keys it is
+upserted on. `run_pipeline` then fetches it the same way for every dataset:
+pages streamed ahead of the detail requests, details fanned out on the
+shared pool, every request through the store's rate limiter and token, the
+records normalized (normalizer.SCHEMAS) and tagged with the store.
+`sync_pipeline` also writes them with `save_dataset` (bulk upsert or swap)
+when their TTL expired and they changed, it runs the reference datasets.
+
+A new resource only needs a declaration, e.g.
+
+    PIPELINES["pedidos"] = Pipeline(
+        "pedidos", "/pedidos/vendas", keys=("pedidoID",), detail=Detail("/pedidos/vendas/{id}", "pedidoID")
+    )
+
+plus a normalizer schema and indexes when it needs them. Its collection is
+MONGO_COLLECTION_PEDIDOS, "pedidos" by default (see indexes.collection_name).
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Tuple
+
+import requests
+
+from access_api import api_url, get, get_headers
+from detail_cache import get_detail_cache
+from fanout import FanoutResult, fan_out
+from http_client import HttpClient
+from indexes import collection_name, index_models
+from mongo_writer import bulk_upsert
+from normalizer import NORMALIZERS, merge_records
+from pagination import iter_pages, prefetch
+from reference_data import refresh_reference_dataset
+from settings import setting
+from staged_load import MONGO_LOAD_MODE, staged_swap
+
+
+@dataclass(frozen=True)
+class Detail:
+    """Request per record, merged into it like contas/receber/{id}"""
+    endpoint: str  # with an {id} placeholder
+    key: str  # record id field on both sides of the merge, the list "id" is renamed to it
+    suffixes: tuple = ("_x", "_y")
+    # Serve unchanged records from the detail cache (keyed by record id, see detail_cache.py)
+    cached: bool = False
+
+
+@dataclass(frozen=True)
+class Children:
+    """List request per record, the record is repeated once per child like situacoes/modulos/{id}"""
+    endpoint: str  # with an {id} placeholder
+    dataset: str  # normalizer schema of the children
+    parent_field: str  # set on each child to the parent id
+    suffix: str  # added to the child fields also present on the parent
+    fields: Callable = None  # loja -> extra fields set on each child
+
+
+@dataclass(frozen=True)
+class Pipeline:
+    dataset: str  # normalizer schema, index specs and collection (indexes.collection_name)
+    endpoint: str
+    params: dict = field(default_factory=dict)
+    paginated: bool = True  # pagina/limite pages, else one request
+    keys: tuple = ("id",)  # natural key the records are upserted on, the detail key when there is one
+    detail: Detail = None
+    children: Children = None
+    # List filter -> record field it selects on (dotted path into the API record),
+    # to check the records fetched outside the list endpoint (see in_scope)
+    scope: dict = field(default_factory=dict)
+
+
+PIPELINES = {
+    "sellers": Pipeline("sellers", "/vendedores", {"situacaoContato": "A"}),
+    "modulos": Pipeline(
+        "modulos", "/situacoes/modulos", paginated=False, keys=("loja", "id", "id.Situacoes"),
+        children=Children(
+            "/situacoes/modulos/{id}", "situacoes", parent_field="module_id", suffix=".Situacoes",
+            fields=lambda loja: {"bling_endpoint": loja},
+        ),
+    ),
+    "payment_methods": Pipeline("payment_methods", "/formas-pagamentos"),
+    # Date filters are added per run by get_bling_receivable_data
+    "receivables": Pipeline(
+        "receivables", "/contas/receber", {"situacoes[]": "1", "idFormaPagamento": "4951136"}, keys=("CRParcelaID",),
+        detail=Detail("/contas/receber/{id}", "CRParcelaID", cached=True),
+        scope={"situacoes[]": "situacao", "idFormaPagamento": "formaPagamento.id"},
+    ),
+}
+
+# Natural keys the datasets are upserted on
+DATASET_KEYS = {name: pipeline.keys for name, pipeline in PIPELINES.items()}
+
+
+def iter_batches(pipeline: Pipeline, loja=None, client: HttpClient = None, params: dict = None, start_page: int = 1) -> Iterator[Tuple[int, list]]:
+    """
+    Yield (page, records) of the list endpoint, with the run `params` added
+    to the declared ones.
+
+    Raises:
+        requests.HTTPError: When a page can't be fetched.
+    """
+    url = api_url(pipeline.endpoint)
+    query = dict(pipeline.params, **(params or {}))
+    if pipeline.paginated:
+        yield from iter_pages(url, query, loja=loja, client=client, start_page=start_page)
+        return
+    response = get(url, headers=get_headers(loja, client=client), params=query or None, client=client, loja=loja)
+    if response.status_code != 200:
+        logging.error(f"Failed to fetch {url}: {response.status_code}, {response.text}")
+        response.raise_for_status()
+    records = response.json().get("data", [])
+    if records:
+        yield 1, records
+
+
+def in_scope(pipeline: Pipeline, record: dict, params: dict = None) -> bool:
+    """
+    Whether the list endpoint, with the run `params` added to the declared ones,
+    would return `record` (as the API returns it), judged on the filters of
+    `pipeline.scope`. E.g. a receivable paid with another payment method is not.
+    """
+    query = dict(pipeline.params, **(params or {}))
+    for param, path in pipeline.scope.items():
+        if param not in query:
+            continue
+        value = record
+        for part in path.split("."):
+            value = value.get(part) if isinstance(value, dict) else None
+        accepted = [query[param]] if isinstance(query[param], (str, int)) else query[param]
+        if str(value) not in {str(accepted_value) for accepted_value in accepted}:
+            return False
+    return True
+
+
+def _fetch_data(url: str, loja=None, client: HttpClient = None):
+    """
+    Return the "data" of a single resource, None when the request failed.
+    A resource deleted meanwhile (404) has no data ({}), fetching it again won't help.
+    """
+    response = get(url, headers=get_headers(loja, client=client), client=client, loja=loja)
+    if response.status_code == 404:
+        logging.warning(f"{url} not found, deleted since it was listed")
+        return {}
+    if response.status_code != 200:
+        logging.error(f"Failed to fetch {url}: {response.status_code}, {response.text}")
+        return None
+    return response.json().get("data")
+
+
+def fetch_details(pipeline: Pipeline, records: list, loja=None, client: HttpClient = None, executor: ThreadPoolExecutor = None) -> FanoutResult:
+    """
+    Fetch the detail of every record concurrently. Each detail carries the
+    record id in `detail.key`, an empty one ({}) means the API had nothing.
+    """
+    detail = pipeline.detail
+    cache = get_detail_cache() if detail.cached else None
+
+    def fetch(record):
+        record_id = record["id"]
+        data = cache.get(record_id, record) if cache is not None else None
+        if data is None:
+            data = _fetch_data(api_url(detail.endpoint.format(id=record_id)), loja, client)
+            if data is None:
+                return None
+            if cache is not None and data:
+                cache.put(record_id, record, data)
+        return dict(data, **{detail.key: record_id}) if data else {}
+
+    return fan_out(records, fetch, key=lambda record: record["id"], executor=executor)
+
+
+def merge_details(pipeline: Pipeline, records: list, details: list, detail_fields=None) -> Iterator[dict]:
+    """
+    Left merge of each record with its detail, fields on both sides get the detail suffixes.
+
+    `detail_fields` are the fields of the whole detail side, defaults to those of `details`.
+    """
+    key = pipeline.detail.key
+    details_by_id = {detail[key]: detail for detail in details}
+    # Like DataFrame columns, unmatched records are suffixed the same way as matched ones
+    if detail_fields is None:
+        detail_fields = set().union(*details) if details else set()
+    for record in records:
+        yield merge_records(
+            {(key if field_name == "id" else field_name): value for field_name, value in record.items()},
+            details_by_id.get(record["id"]), on=key, suffixes=pipeline.detail.suffixes, right_fields=detail_fields
+        )
+
+
+def fetch_children(pipeline: Pipeline, parents: list, loja=None, client: HttpClient = None, executor: ThreadPoolExecutor = None) -> list:
+    """Fetch the children of every parent concurrently, return each parent merged with each of its children"""
+    children = pipeline.children
+    extra = children.fields(loja or setting("LOJA")) if children.fields else {}
+
+    def fetch(parent_id):
+        data = _fetch_data(api_url(children.endpoint.format(id=parent_id)), loja, client)
+        if data is None:
+            return None
+        for child in data:
+            child[children.parent_field] = parent_id
+            child.update(extra)
+        return data
+
+    by_parent = {}
+    child_fields = set()
+    for data in fan_out([parent["id"] for parent in parents], fetch, executor=executor).results:
+        for child in normalize_records(children.dataset, data or []):
+            by_parent.setdefault(child[children.parent_field], []).append(child)
+            child_fields.update(child)
+    # Parents without children are left out
+    return [
+        merge_records(parent, child, on=None, suffixes=("", children.suffix), right_fields=child_fields)
+        for parent in parents
+        for child in by_parent.get(parent["id"], [])
+    ]
+
+
+def normalize_records(dataset: str, records) -> Iterator[dict]:
+    """Normalize with the dataset schema, records of datasets without one are kept as they are"""
+    transform = NORMALIZERS.get(dataset)
+    for record in records:
+        yield transform(record) if transform else record
+
+
+def tag_store(records: list, loja=None) -> list:
+    """Add the store (loja) the records come from, collections are shared by all stores"""
+    loja = loja or setting("LOJA")
+    for record in records:
+        record["loja"] = loja
+    return records
+
+
+def run_pipeline(pipeline: Pipeline, loja=None, client: HttpClient = None, executor: ThreadPoolExecutor = None, params: dict = None) -> list:
+    """
+    Fetch a whole dataset and return its normalized records, tagged with the store.
+
+    The next pages load while the details of the current one are fetched.
+
+    Args:
+        pipeline (Pipeline): Dataset declaration, e.g. PIPELINES["sellers"].
+        loja (str): Store whose token and rate budget are used, defaults to LOJA.
+        client (HttpClient): HTTP client, defaults to the shared one.
+        executor (ThreadPoolExecutor): Worker pool shared between stores for details.
+        params (dict): Query parameters added to the declared ones.
+
+    Returns:
+        list: The records, None when nothing could be fetched.
+    """
+    records, details = [], []
+    try:
+        for _, batch in prefetch(iter_batches(pipeline, loja, client, params)):
+            records.extend(batch)
+            if pipeline.detail:
+                details.extend(detail for _, detail in fetch_details(pipeline, batch, loja, client, executor).succeeded() if detail)
+    except requests.RequestException as e:
+        logging.error(f"Failed to fetch {pipeline.dataset} data: {e}")
+        return None
+
+    if not records:
+        logging.info(f"No {pipeline.dataset} data found.")
+        return None
+    logging.info(f"Successfully fetched {len(records)} {pipeline.dataset} records from API")
+
+    if pipeline.detail:
+        records = merge_details(pipeline, records, details)
+    records = list(normalize_records(pipeline.dataset, records))
+    if pipeline.children:
+        records = fetch_children(pipeline, records, loja, client)
+        if not records:
+            logging.info(f"No {pipeline.children.dataset} data found")
+            return None
+    return tag_store(records, loja)
+
+
+def save_dataset(db, dataset: str, collection_name: str, records: list, load_mode: str = None, loja=None, keys: tuple = None) -> dict:
+    """
+    Write a full dataset once, with the configured load mode.
+
+    Args:
+        db: MongoDB database.
+        dataset (str): Key of DATASET_KEYS, e.g. "sellers".
+        collection_name (str): Target collection.
+        records (list): Every record of the dataset.
+        load_mode (str): "upsert" (idempotent bulk upsert, pruning missing keys) or
+            "swap" (staging collection renamed over the live one), defaults to MONGO_LOAD_MODE.
+        loja (str): Store the records belong to, other stores' documents are left as they are.
+        keys (tuple): Natural key of the records, defaults to DATASET_KEYS[dataset].
+
+    Returns:
+        dict: Write counters.
+    """
+    load_mode = load_mode or MONGO_LOAD_MODE
+    loja = loja or setting("LOJA")
+    if load_mode == "swap":
+        return staged_swap(
+            db, collection_name, records, indexes=index_models(dataset),
+            keep_filter={"loja": {"$exists": True, "$ne": loja}}
+        )
+    # Documents without loja predate multi-store sync and belong to any store
+    return bulk_upsert(
+        db[collection_name], records, keys or DATASET_KEYS[dataset], diff=True,
+        prune_missing=True, prune_scope={"loja": {"$in": [loja, None]}}
+    )
+
+
+def sync_pipeline(pipeline: Pipeline, db, loja=None, client: HttpClient = None, executor: ThreadPoolExecutor = None,
+                  params: dict = None, load_mode: str = None, force: bool = False) -> dict:
+    """
+    Fetch a dataset and replace the store's documents in its collection, once
+    its TTL expired and only when it changed (see reference_data.py).
+
+    Returns:
+        dict: Refresh status of refresh_reference_dataset, the stored data is
+            kept when nothing was fetched.
+    """
+    loja = loja or setting("LOJA")
+    return refresh_reference_dataset(
+        db, pipeline.dataset,
+        lambda: run_pipeline(pipeline, loja, client, executor, params),
+        lambda records: save_dataset(
+            db, pipeline.dataset, collection_name(pipeline.dataset), records, load_mode=load_mode, loja=loja, keys=pipeline.keys
+        ),
+        loja=loja,
+        force=force,
+    )
@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic, sleep
+
+# Bling API v3 limits: 3 requests per second and 120.000 requests per day
+BLING_RATE_PER_SECOND = float(os.getenv("BLING_RATE_PER_SECOND", "3"))
+BLING_RATE_BURST = float(os.getenv("BLING_RATE_BURST", "3"))
+BLING_RATE_PER_DAY = float(os.getenv("BLING_RATE_PER_DAY", "120000"))
+BLING_MAX_RETRIES = int(os.getenv("BLING_MAX_RETRIES", "5"))
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens are added per second, up to `capacity`.
+    Not thread-safe by itself, RateLimiter guards it with a lock.
+    """
+
+    def __init__(self, rate: float, capacity: float, clock=monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.updated_at = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, tokens: float = 1) -> float:
+        """Return how many seconds until `tokens` are available (0 if available now)"""
+        self._refill()
+        if self.tokens >= tokens:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+    def consume(self, tokens: float = 1):
+        self._refill()
+        self.tokens -= tokens
+
+
+class RateLimiter:
+    """
+    Per-second and per-day token buckets with adaptive backoff.
+
+    Every request reserves one token from both buckets. When the API answers
+    429 the limiter blocks all callers until `Retry-After` (or an exponential
+    backoff) has passed and halves the per-second rate; the rate grows back
+    slowly on each successful response.
+
+    Safe to share between threads (`acquire`) and asyncio tasks (`acquire_async`).
+    """
+
+    def __init__(
+        self,
+        per_second: float = BLING_RATE_PER_SECOND,
+        per_day: float = BLING_RATE_PER_DAY,
+        burst: float = BLING_RATE_BURST,
+        min_per_second: float = 0.25,
+        clock=monotonic,
+    ):
+        self.max_per_second = per_second
+        self.min_per_second = min(min_per_second, per_second)
+        self.second_bucket = TokenBucket(per_second, burst, clock)
+        self.day_bucket = TokenBucket(per_day / 86400, per_day, clock)
+        self.clock = clock
+        self.blocked_until = 0.0
+        self.consecutive_throttles = 0
+        self._lock = threading.Lock()
+
+    @property
+    def per_second(self) -> float:
+        return self.second_bucket.rate
+
+    def _reserve(self) -> float:
+        """Take a token if possible, otherwise return the seconds to wait before retrying"""
+        with self._lock:
+            blocked = self.blocked_until - self.clock()
+            if blocked > 0:
+                return blocked
+            wait = max(self.second_bucket.wait_time(), self.day_bucket.wait_time())
+            if wait > 0:
+                return wait
+            self.second_bucket.consume()
+            self.day_bucket.consume()
+            return 0.0
+
+    def acquire(self):
+        """Block the current thread until a request may be sent"""
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            sleep(wait)
+
+    async def acquire_async(self):
+        """Wait, without blocking the event loop, until a request may be sent"""
+        while True:
+            wait = self._reserve()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        """Additive increase of the per-second rate after a throttle"""
+        with self._lock:
+            self.consecutive_throttles = 0
+            if self.second_bucket.rate < self.max_per_second:
+                self.second_bucket.rate = min(self.max_per_second, self.second_bucket.rate + 0.1)
+
+    def on_throttled(self, retry_after: float = None) -> float:
+        """
+        Register a 429 answer and return the backoff applied, in seconds.
+
+        Args:
+            retry_after (float): Seconds from the `Retry-After` header, if any.
+        """
+        with self._lock:
+            self.consecutive_throttles += 1
+            if retry_after is None:
+                retry_after = min(60.0, 2 ** (self.consecutive_throttles - 1))
+            self.blocked_until = max(self.blocked_until, self.clock() + retry_after)
+            self.second_bucket.rate = max(self.min_per_second, self.second_bucket.rate / 2)
+            # Drop the burst so callers resume at the reduced pace
+            self.second_bucket.tokens = 0
+            return retry_after
+
+
+def parse_retry_after(value) -> float:
+    """
+    Parse a `Retry-After` header (delta-seconds or HTTP-date) into seconds.
+    Returns None when the header is missing or invalid.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def call_with_rate_limit(send, *args, limiter: RateLimiter = None, max_retries: int = BLING_MAX_RETRIES, **kwargs):
+    """
+    Send a request through the rate limiter, retrying on 429 responses.
+
+    Args:
+        send: Callable doing the HTTP request and returning a `requests.Response`.
+        limiter (RateLimiter): Limiter to use, defaults to the shared Bling limiter.
+        max_retries (int): How many times a throttled request is retried.
+
+    Returns:
+        requests.Response: The last response received.
+    """
+    limiter = limiter or bling_limiter
+    attempt = 0
+    while True:
+        limiter.acquire()
+        response = send(*args, **kwargs)
+        if response.status_code != 429:
+            limiter.on_success()
+            return response
+        backoff = limiter.on_throttled(parse_retry_after(response.headers.get("Retry-After")))
+        attempt += 1
+        if attempt > max_retries:
+            logging.error(f"Rate limited by Bling API, giving up after {max_retries} retries")
+            return response
+        logging.warning(
+            f"Rate limited by Bling API (429), retrying in {backoff:.1f}s "
+            f"at {limiter.per_second:.2f} req/s (attempt {attempt}/{max_retries})"
+        )
+
+
+# Shared limiter for every Bling API call of this process, for the default store (LOJA)
+bling_limiter = RateLimiter()
+
+_store_limiters = {}
+_store_limiters_lock = threading.Lock()
+
+
+def get_limiter(loja: str = None) -> RateLimiter:
+    """Return the limiter of a store, each Bling store (account) has its own API budget"""
+    if loja is None or loja == os.getenv("LOJA"):
+        return bling_limiter
+    with _store_limiters_lock:
+        if loja not in _store_limiters:
+            _store_limiters[loja] = RateLimiter()
+        return _store_limiters[loja]
@@ -0,0 +1,73 @@
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Callable
+
+from metrics import RECORDS_FETCHED, stage
+from mongo_writer import record_hash
+from sync_state import get_sync_state, update_sync_state
+
+# Reference data changes about once a month, each dataset is refreshed on its own TTL
+REFERENCE_TTL_HOURS = {
+    "sellers": float(os.getenv("REFERENCE_TTL_HOURS_SELLERS", "24")),
+    "modulos": float(os.getenv("REFERENCE_TTL_HOURS_MODULOS", "168")),
+    "payment_methods": float(os.getenv("REFERENCE_TTL_HOURS_PAYMENT_METHODS", "168")),
+}
+# Scheduled runs are spaced from one start to the next, so a dataset expiring
+# within this slack is refreshed now instead of one full interval later
+REFERENCE_TTL_SLACK_MINUTES = float(os.getenv("REFERENCE_TTL_SLACK_MINUTES", "30"))
+
+
+def dataset_hash(records: list) -> str:
+    """Hash of a normalized dataset, independent of the record order"""
+    digest = hashlib.sha1()
+    for value in sorted(record_hash(record) for record in records):
+        digest.update(value.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def refresh_reference_dataset(db, dataset: str, fetch: Callable, save: Callable, loja: str = None, force: bool = False) -> dict:
+    """
+    Refresh a reference dataset only when its TTL expired, and write it only when it changed.
+
+    The dataset hash and fetch time are kept in the sync-state collection.
+
+    Args:
+        db: MongoDB database.
+        dataset (str): "sellers", "modulos" or "payment_methods".
+        fetch (Callable): Returns the normalized records, None on failure.
+        save (Callable): Writes the records, returns write counters.
+        loja (str): Store the data belongs to, defaults to LOJA.
+        force (bool): Ignore the TTL.
+
+    Returns:
+        dict: {"status": "fresh" | "unchanged" | "written" | "failed", ...}
+    """
+    loja = loja or os.getenv("LOJA")
+    state = get_sync_state(db, dataset, loja)
+    fetched_at = state.get("fetched_at")
+    ttl = timedelta(hours=REFERENCE_TTL_HOURS.get(dataset, 24))
+    if not force and fetched_at and datetime.now() - fetched_at < ttl - timedelta(minutes=REFERENCE_TTL_SLACK_MINUTES):
+        logging.info(f"{dataset} fetched at {fetched_at}, still fresh (TTL {ttl}), skipping")
+        return {"status": "fresh", "fetched_at": fetched_at}
+
+    with stage("fetch", dataset):
+        records = fetch()
+    if not records:
+        logging.error(f"No {dataset} data fetched, keeping the stored version")
+        return {"status": "failed"}
+    RECORDS_FETCHED.labels(dataset, loja).inc(len(records))
+
+    new_hash = dataset_hash(records)
+    now = datetime.now()
+    if new_hash == state.get("hash"):
+        update_sync_state(db, dataset, loja, fetched_at=now, records=len(records))
+        logging.info(f"{dataset} unchanged ({len(records)} records), skipping MongoDB write")
+        return {"status": "unchanged", "records": len(records)}
+
+    with stage("write", dataset):
+        counters = save(records)
+    update_sync_state(db, dataset, loja, hash=new_hash, fetched_at=now, changed_at=now, records=len(records))
+    logging.info(f"{dataset} changed, saved {len(records)} records: {counters}")
+    return {"status": "written", "records": len(records), "counters": counters}
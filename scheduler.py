@@ -0,0 +1,129 @@
+import logging
+import os
+import traceback
+from datetime import datetime
+
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
+from apscheduler.jobstores.mongodb import MongoDBJobStore
+from apscheduler.schedulers.blocking import BlockingScheduler
+
+from indexes import check_query_plans, ensure_indexes
+from metrics import start_metrics_server
+from mongo_client import check_connection, get_client, get_db
+from settings import setting
+
+# Receivables feed the BI dashboards and are synced hourly, reference data daily
+SCHEDULE_RECEIVABLES_MINUTES = int(os.getenv("SCHEDULE_RECEIVABLES_MINUTES", "60"))
+SCHEDULE_REFERENCE_HOURS = int(os.getenv("SCHEDULE_REFERENCE_HOURS", "24"))
+# Random delay added to every run, so jobs don't all hit the Bling API at the same second
+SCHEDULE_JITTER_SECONDS = int(os.getenv("SCHEDULE_JITTER_SECONDS", "120"))
+# A run missed by more than this (e.g. container down) is skipped, not run late
+SCHEDULE_MISFIRE_GRACE_SECONDS = int(os.getenv("SCHEDULE_MISFIRE_GRACE_SECONDS", "900"))
+# Queued webhook events are applied this often (see webhooks.py), 0 disables the job
+WEBHOOK_POLL_SECONDS = int(os.getenv("WEBHOOK_POLL_SECONDS", "15"))
+MONGO_COLLECTION_JOBS = os.getenv("MONGO_COLLECTION_JOBS", "scheduler_jobs")
+
+# Jobs are stored in MongoDB, so their functions are referenced by name and their kwargs pickled
+JOBS = {
+    "receivables": {
+        "func": "bling_sources:sync_stores",
+        "kwargs": {"datasets": ["receivables"]},
+        "trigger_args": {"minutes": SCHEDULE_RECEIVABLES_MINUTES},
+    },
+    "reference_data": {
+        "func": "bling_sources:sync_stores",
+        "kwargs": {"datasets": ["reference"]},
+        "trigger_args": {"hours": SCHEDULE_REFERENCE_HOURS},
+    },
+    "webhook_events": {
+        "func": "webhooks:process_events",
+        "kwargs": {},
+        "trigger_args": {"seconds": WEBHOOK_POLL_SECONDS},
+        # Frequent and cheap when the queue is empty, never delayed
+        "jitter": 0,
+        "enabled": WEBHOOK_POLL_SECONDS > 0,
+    },
+}
+
+JOB_DEFAULTS = {
+    # Runs missed while another one was running (or while down) collapse into one
+    "coalesce": True,
+    # A slow run is never overlapped by the next one
+    "max_instances": 1,
+    "misfire_grace_time": SCHEDULE_MISFIRE_GRACE_SECONDS,
+}
+
+
+def _log_event(event):
+    if event.code == EVENT_JOB_ERROR:
+        logging.error(f"Job {event.job_id} failed: {event.exception}\n{''.join(traceback.format_tb(event.traceback))}")
+    elif event.code == EVENT_JOB_MISSED:
+        logging.warning(f"Job {event.job_id} missed its run at {event.scheduled_run_time}, skipped")
+    elif event.code == EVENT_JOB_MAX_INSTANCES:
+        logging.warning(f"Job {event.job_id} still running, run at {event.scheduled_run_time} skipped")
+
+
+def _next_run_time(jobstore, job_id: str, now: datetime) -> datetime:
+    """
+    Keep the next run of a job already in the store, so a restart doesn't
+    resync everything. New jobs run right away.
+    """
+    try:
+        job = jobstore.lookup_job(job_id)
+    except Exception as e:
+        logging.warning(f"Could not restore job {job_id}, rescheduling it: {e}")
+        job = None
+    if job is None or job.next_run_time is None:
+        return now
+    return job.next_run_time
+
+
+def build_scheduler(jobstore=None, scheduler_class=BlockingScheduler):
+    """
+    Return a scheduler with one interval job per dataset.
+
+    Args:
+        jobstore: APScheduler job store, defaults to MONGO_COLLECTION_JOBS in MONGO_DATABASE.
+        scheduler_class: APScheduler scheduler class, BackgroundScheduler to run
+            next to another service.
+    """
+    jobstore = jobstore or MongoDBJobStore(database=setting("MONGO_DATABASE"), collection=MONGO_COLLECTION_JOBS, client=get_client())
+    scheduler = scheduler_class(jobstores={"default": jobstore}, job_defaults=JOB_DEFAULTS)
+    scheduler.add_listener(_log_event, EVENT_JOB_ERROR | EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES)
+
+    now = datetime.now().astimezone(scheduler.timezone)
+    for job_id, job in JOBS.items():
+        if not job.get("enabled", True):
+            continue
+        scheduler.add_job(
+            job["func"],
+            "interval",
+            id=job_id,
+            name=job_id,
+            kwargs=job["kwargs"],
+            jitter=job.get("jitter", SCHEDULE_JITTER_SECONDS),
+            next_run_time=_next_run_time(jobstore, job_id, now),
+            replace_existing=True,
+            **job["trigger_args"],
+        )
+    return scheduler
+
+
+def run_scheduler():
+    """Ensure the indexes, then run the data collection jobs until the process stops"""
+    logging.info("Starting data collection process...")
+    start_metrics_server()
+    check_connection()
+
+    # Declared indexes must exist and serve the hot queries before syncing
+    ensure_indexes(get_db())
+    check_query_plans(get_db())
+
+    scheduler = build_scheduler()
+    for job in scheduler.get_jobs():
+        logging.info(f"Job {job.id} scheduled, next run at {job.next_run_time}")
+    try:
+        scheduler.start()
+    except (KeyboardInterrupt, SystemExit):
+        logging.info("Scheduler stopped")
+
@@ -0,0 +1,56 @@
+import logging
+import os
+import sys
+import threading
+
+_env_loaded = False
+_env_lock = threading.Lock()
+_logging_configured = False
+
+
+def load_env() -> bool:
+    """
+    Load the .env file once, on first use. Variables already set in the
+    environment take precedence.
+
+    Entry points call it before importing the modules whose tunables are
+    read at import time (rate limits, pool sizes...), everything else reads
+    its settings lazily through `setting`.
+
+    Returns:
+        bool: Whether a .env file was loaded (on the first call).
+    """
+    global _env_loaded
+    if _env_loaded:
+        return True
+    with _env_lock:
+        if _env_loaded:
+            return True
+        from dotenv import load_dotenv
+
+        loaded = load_dotenv()
+        _env_loaded = True
+    if loaded:
+        logging.info("Environment variables loaded successfully from .env file")
+    else:
+        logging.warning("Could not load environment variables from .env file")
+    return loaded
+
+
+def setting(name: str, default: str = None) -> str:
+    """Return an environment setting, loading the .env file first if needed"""
+    load_env()
+    return os.getenv(name, default)
+
+
+def configure_logging(level: int = logging.INFO):
+    """Log to stdout, once per process. Called by entry points, never on import"""
+    global _logging_configured
+    if _logging_configured:
+        return
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+    _logging_configured = True
@@ -0,0 +1,169 @@
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime
+from itertools import islice
+from typing import Iterable, Sequence
+
+from metrics import MONGO_DOCUMENTS, MONGO_WRITE_SECONDS
+from mongo_writer import MONGO_WRITE_BATCH_SIZE
+
+# "upsert" merges into the live collections, "swap" loads a staging copy and renames it in place
+MONGO_LOAD_MODE = os.getenv("MONGO_LOAD_MODE", "upsert")
+# Previous versions kept after each swap, for rollback
+MONGO_KEEP_GENERATIONS = int(os.getenv("MONGO_KEEP_GENERATIONS", "3"))
+# Refuse a swap when the new dataset is smaller than this fraction of the live one
+MONGO_SWAP_MIN_RATIO = float(os.getenv("MONGO_SWAP_MIN_RATIO", "0.5"))
+
+STAGING_SUFFIX = "__staging"
+GENERATION_SUFFIX = "__gen_"
+
+
+class StagedLoadError(Exception):
+    """Raised when a staging collection fails validation, the live collection is left untouched"""
+
+
+_swap_locks = {}
+_swap_locks_lock = threading.Lock()
+
+
+def _swap_lock(collection_name: str) -> threading.Lock:
+    """
+    Lock serializing the swaps of a collection. Stores synced concurrently
+    swap the same collection, each copying the others' documents: unserialized,
+    the last rename would drop what the other stores just loaded.
+    """
+    with _swap_locks_lock:
+        return _swap_locks.setdefault(collection_name, threading.Lock())
+
+
+def _staging_name(collection_name: str) -> str:
+    """Staging collection of one swap, never shared with another one"""
+    return f"{collection_name}{STAGING_SUFFIX}_{uuid.uuid4().hex[:12]}"
+
+
+def list_generations(db, collection_name: str) -> list:
+    """Return the kept generations of a collection, newest first"""
+    prefix = f"{collection_name}{GENERATION_SUFFIX}"
+    return sorted((name for name in db.list_collection_names() if name.startswith(prefix)), reverse=True)
+
+
+def staged_swap(
+    db,
+    collection_name: str,
+    records: Iterable[dict],
+    expected_count: int = None,
+    indexes: Sequence = None,
+    keep_generations: int = MONGO_KEEP_GENERATIONS,
+    min_ratio: float = MONGO_SWAP_MIN_RATIO,
+    batch_size: int = MONGO_WRITE_BATCH_SIZE,
+    keep_filter: dict = None,
+) -> dict:
+    """
+    Load records into a staging collection and atomically swap it in.
+
+    The staging collection is filled, indexed and validated, the live
+    collection is archived as a generation, then the staging collection is
+    renamed over it with `renameCollection(dropTarget=True)`. Readers see
+    either the previous or the new version, never a partial one. Each swap
+    stages into its own collection, swaps of the same collection (one per
+    store) run one at a time in the process.
+
+    Args:
+        db: MongoDB database.
+        collection_name (str): Live collection name.
+        records (Iterable[dict]): Full dataset, may be a generator.
+        expected_count (int): Rows returned by the source, defaults to len(records).
+        indexes (Sequence[IndexModel]): Indexes built on staging before the swap.
+        keep_generations (int): Previous versions to keep for rollback.
+        min_ratio (float): Minimum new/live row count ratio accepted.
+        keep_filter (dict): Live documents copied into staging as they are,
+            e.g. the other stores' documents when swapping one store.
+
+    Returns:
+        dict: {"loaded", "previous", "generation"} of the swap.
+
+    Raises:
+        StagedLoadError: When validation fails, the live collection is not changed.
+    """
+    if expected_count is None and hasattr(records, "__len__"):
+        expected_count = len(records)
+
+    with _swap_lock(collection_name):
+        staging_name = _staging_name(collection_name)
+        staging = db[staging_name]
+        try:
+            kept = 0
+            if keep_filter and collection_name in db.list_collection_names():
+                db[collection_name].aggregate([{"$match": keep_filter}, {"$out": staging_name}])
+                kept = staging.count_documents({})
+
+            loaded = 0
+            iterator = iter(records)
+            while True:
+                batch = list(islice(iterator, batch_size))
+                if not batch:
+                    break
+                for record in batch:
+                    record.pop("_id", None)
+                with MONGO_WRITE_SECONDS.labels(collection_name, "staged_insert").time():
+                    staging.insert_many(batch, ordered=False)
+                loaded += len(batch)
+
+            if indexes:
+                staging.create_indexes(list(indexes))
+
+            live = db[collection_name]
+            previous = live.estimated_document_count() if collection_name in db.list_collection_names() else 0
+            staged = staging.count_documents({})
+            errors = []
+            if expected_count is not None and staged != expected_count + kept:
+                errors.append(f"staging has {staged} documents, source returned {expected_count} (+{kept} kept)")
+            if staged == 0:
+                errors.append("staging is empty")
+            elif previous and staged < previous * min_ratio:
+                errors.append(f"staging has {staged} documents, live has {previous} (min ratio {min_ratio})")
+            if errors:
+                raise StagedLoadError(f"Refusing to swap {collection_name}: {'; '.join(errors)}")
+
+            generation = None
+            if previous and keep_generations > 0:
+                generation = f"{collection_name}{GENERATION_SUFFIX}{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+                live.aggregate([{"$match": {}}, {"$out": generation}])
+
+            staging.rename(collection_name, dropTarget=True)
+            MONGO_DOCUMENTS.labels(collection_name, "swapped").inc(loaded)
+            logging.info(f"Swapped {collection_name}: {staged} documents (previous {previous}, archived as {generation})")
+
+            for old_generation in list_generations(db, collection_name)[keep_generations:]:
+                db.drop_collection(old_generation)
+                logging.info(f"Dropped old generation {old_generation}")
+
+            return {"loaded": staged, "previous": previous, "generation": generation}
+        finally:
+            # Left behind only when the swap failed
+            db.drop_collection(staging_name)
+
+
+def rollback(db, collection_name: str, generation: str = None) -> str:
+    """
+    Restore a kept generation (the newest one by default) as the live collection.
+
+    The generation is copied to staging first, so it stays available and the
+    swap itself is still a single atomic rename.
+
+    Returns:
+        str: The generation restored.
+    """
+    generations = list_generations(db, collection_name)
+    generation = generation or (generations[0] if generations else None)
+    if generation not in generations:
+        raise StagedLoadError(f"No generation {generation} for {collection_name}")
+
+    with _swap_lock(collection_name):
+        staging_name = _staging_name(collection_name)
+        db[generation].aggregate([{"$match": {}}, {"$out": staging_name}])
+        db[staging_name].rename(collection_name, dropTarget=True)
+    logging.info(f"Rolled back {collection_name} to {generation}")
+    return generation
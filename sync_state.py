@@ -0,0 +1,120 @@
+import os
+import uuid
+from datetime import datetime
+
+MONGO_COLLECTION_SYNC_STATE = os.getenv("MONGO_COLLECTION_SYNC_STATE", "sync_state")
+
+
+def _state_id(dataset: str, loja: str) -> str:
+    return f"{dataset}:{loja}"
+
+
+def get_sync_state(db, dataset: str, loja: str) -> dict:
+    """Return the sync-state document of a dataset/store, or an empty dict"""
+    return db[MONGO_COLLECTION_SYNC_STATE].find_one({"_id": _state_id(dataset, loja)}) or {}
+
+
+def get_watermark(db, dataset: str, loja: str) -> datetime:
+    """Return the high-water mark of the last successful sync, None if never synced"""
+    return get_sync_state(db, dataset, loja).get("watermark")
+
+
+def update_sync_state(db, dataset: str, loja: str, **fields):
+    """Set fields on the sync-state document of a dataset/store, creating it if needed"""
+    db[MONGO_COLLECTION_SYNC_STATE].update_one(
+        {"_id": _state_id(dataset, loja)},
+        {"$set": {
+            "dataset": dataset,
+            "loja": loja,
+            "updated_at": datetime.now(),
+            **fields
+        }},
+        upsert=True
+    )
+
+
+def set_watermark(db, dataset: str, loja: str, watermark: datetime, **extra):
+    """
+    Persist the high-water mark of a dataset/store after a successful sync.
+
+    Args:
+        db: MongoDB database.
+        dataset (str): Dataset name, e.g. "receivables".
+        loja (str): Store the data belongs to.
+        watermark (datetime): Everything up to this date is in MongoDB.
+        **extra: Additional fields stored with the state (counters, mode...).
+    """
+    update_sync_state(db, dataset, loja, watermark=watermark, **extra)
+
+
+# Batches of an unfinished run, removed once the run completes
+MONGO_COLLECTION_SYNC_CHECKPOINTS = os.getenv("MONGO_COLLECTION_SYNC_CHECKPOINTS", "sync_checkpoints")
+
+
+def get_run(db, dataset: str, loja: str) -> dict:
+    """Return the last run of a dataset/store ({run_id, status, cursor...}), or None"""
+    return get_sync_state(db, dataset, loja).get("run")
+
+
+def start_run(db, dataset: str, loja: str, **params) -> dict:
+    """
+    Record the start of a resumable run and return it.
+
+    Args:
+        **params: What the run needs to resume identically (mode, date range...).
+    """
+    run = {
+        "run_id": uuid.uuid4().hex,
+        "status": "running",
+        "started_at": datetime.now(),
+        "cursor": None,
+        "batches": 0,
+        **params,
+    }
+    update_sync_state(db, dataset, loja, run=run)
+    return run
+
+
+def _checkpoint_range(run_id: str) -> dict:
+    # Checkpoint ids are "<run_id>:<batch>", ';' sorts right after ':' so the range uses the _id index
+    return {"_id": {"$gte": f"{run_id}:", "$lt": f"{run_id};"}}
+
+
+def save_checkpoint(db, dataset: str, loja: str, run: dict, batch: dict, cursor: dict):
+    """
+    Persist one processed batch of a run, then move the run cursor past it.
+
+    The batch is written first, so a crash between both writes only makes
+    the resumed run process the batch again.
+    """
+    run["batches"] += 1
+    db[MONGO_COLLECTION_SYNC_CHECKPOINTS].replace_one(
+        {"_id": f"{run['run_id']}:{run['batches']:06d}"},
+        {"run_id": run["run_id"], "created_at": datetime.now(), **batch},
+        upsert=True,
+    )
+    run["cursor"] = cursor
+    db[MONGO_COLLECTION_SYNC_STATE].update_one(
+        {"_id": _state_id(dataset, loja), "run.run_id": run["run_id"]},
+        {"$set": {"run.cursor": cursor, "run.batches": run["batches"], "updated_at": datetime.now()}},
+    )
+
+
+def load_checkpoints(db, run_id: str):
+    """Yield the persisted batches of a run, in the order they were processed"""
+    yield from db[MONGO_COLLECTION_SYNC_CHECKPOINTS].find(_checkpoint_range(run_id)).sort("_id", 1)
+
+
+def finish_run(db, dataset: str, loja: str, run: dict, **fields):
+    """Mark a run completed and drop its checkpoints"""
+    db[MONGO_COLLECTION_SYNC_STATE].update_one(
+        {"_id": _state_id(dataset, loja), "run.run_id": run["run_id"]},
+        {"$set": {"run.status": "completed", "run.completed_at": datetime.now(), "updated_at": datetime.now(),
+                  **{f"run.{key}": value for key, value in fields.items()}}},
+    )
+    drop_checkpoints(db, run["run_id"])
+
+
+def drop_checkpoints(db, run_id: str) -> int:
+    """Delete the checkpoints of a run, e.g. an abandoned one. Returns how many were deleted"""
+    return db[MONGO_COLLECTION_SYNC_CHECKPOINTS].delete_many(_checkpoint_range(run_id)).deleted_count
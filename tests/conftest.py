@@ -0,0 +1,68 @@
+"""
+Tests run against an in-memory MongoDB (pip install mongomock pytest), with
+settings pointing away from the real .env values.
+"""
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+
+# Before the project modules read their tunables, the environment wins over .env
+os.environ.update({
+    "LOJA": "teste",
+    "LOJAS": "teste",
+    "MONGO_URI": "mongodb://localhost:27017",
+    "MONGO_DATABASE": "bling_test",
+    "MONGO_COLLECTION_SELLERS": "sellers",
+    "MONGO_COLLECTION_PAYMENT_METHODS": "payment_methods",
+    "MONGO_COLLECTION_MODULOS": "modulos",
+    "MONGO_COLLECTION_RECEIVABLE": "accounts_receivable",
+    "API_BASE_URL": "http://bling.invalid/Api/v3",
+    "API_TOKEN_BLING": "http://bling.invalid/token",
+    "METRICS_PORT": "0",
+    # Read on import, kept out of the service's cache/ directory
+    "DETAIL_CACHE_PATH": os.path.join(tempfile.mkdtemp(prefix="bling-test-"), "receivable_details.sqlite3"),
+    "TOKEN_CACHE_PATH": os.path.join(tempfile.mkdtemp(prefix="bling-test-"), "tokens.json"),
+})
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """Empty database of a fresh in-memory server, shared by every get_db() of the test"""
+    mongomock = pytest.importorskip("mongomock")
+    import mongo_client
+
+    server = mongomock.MongoClient()
+    monkeypatch.setattr(mongo_client, "_client", server)
+    monkeypatch.setattr(mongo_client, "_client_pid", os.getpid())
+    return mongo_client.get_db()
+
+
+def fixture(*path):
+    """Recorded Bling response or webhook event (benchmarks/fixtures)"""
+    with open(os.path.join(FIXTURES, *path), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def synced_receivable(receivable_id: int, derived: bool = False, **fields) -> dict:
+    """
+    A receivable built the way get_bling_receivable_data builds it, from the
+    recorded list row and detail with `fields` set on both. With `derived`,
+    CRPedidoNº and DataControle are set like the derivation jobs set them.
+    """
+    from derivations import data_controle, derive_record
+    from pipelines import PIPELINES, merge_details, normalize_records, tag_store
+
+    row = dict(fixture("contas_receber.json")["data"][0], id=receivable_id, **fields)
+    detail = dict(fixture("contas_receber_detail.json")["data"], id=receivable_id, CRParcelaID=receivable_id, **fields)
+    record = tag_store(list(normalize_records("receivables", merge_details(PIPELINES["receivables"], [row], [detail]))), "teste")[0]
+    if derived:
+        record.update(derive_record(record))
+        record["DataControle"] = data_controle(record["CREmissao"])
+    return record
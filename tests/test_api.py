@@ -0,0 +1,50 @@
+from datetime import date
+
+import pytest
+
+from conftest import synced_receivable
+
+
+@pytest.fixture
+def client(db):
+    pytest.importorskip("httpx")
+    from fastapi.testclient import TestClient
+
+    import api
+
+    api.response_cache.clear()
+    return TestClient(api.app)
+
+
+def test_synced_receivable_has_the_api_fields():
+    document = synced_receivable(101)
+    assert document["CREmissao"].date() == date(2025, 2, 8)
+    assert document["CRSituacao"] == 1
+    assert document["CRValorParcela"] == 389.9
+    # The merge columns are kept for the existing readers
+    assert document["dataEmissao_x"] == "2025-02-08"
+
+
+def test_date_filtered_page_returns_the_seeded_receivable(db, client):
+    db.accounts_receivable.insert_one(synced_receivable(101))
+    db.accounts_receivable.insert_one(synced_receivable(102, dataEmissao="2025-03-02"))
+
+    page = client.get("/receivables", params={"start": "2025-02-01", "end": "2025-02-28"}).json()
+    assert [document["CRParcelaID"] for document in page["data"]] == [101]
+    assert page["next_cursor"] is None
+
+    ndjson = client.get("/receivables/export.ndjson", params={"start": "2025-02-01", "end": "2025-02-28"})
+    assert len(ndjson.text.strip().splitlines()) == 1
+
+
+def test_overlapping_fields_are_a_bad_request(client):
+    response = client.get("/receivables", params={"fields": "contato_x,contato_x.nome"})
+    assert response.status_code == 400
+
+
+def test_if_none_match_compares_whole_etags(client):
+    etag = client.get("/sellers").headers["ETag"]
+    assert client.get("/sellers", headers={"If-None-Match": f'"other", {etag}'}).status_code == 304
+    assert client.get("/sellers", headers={"If-None-Match": "*"}).status_code == 304
+    # A fragment of the ETag is not a match
+    assert client.get("/sellers", headers={"If-None-Match": etag[:-1] + 'x", ' + etag[1:9]}).status_code == 200
@@ -0,0 +1,45 @@
+import glob
+import os
+from datetime import datetime
+
+import pytest
+
+
+@pytest.fixture
+def export(db):
+    pytest.importorskip("pyarrow")
+    import columnar_export
+
+    db.accounts_receivable.insert_one({"CRParcelaID": 1, "loja": "teste", "CREmissao": datetime(2025, 2, 8), "CRSituacao": 1})
+    return lambda directory: columnar_export.export_receivables_parquet(db.accounts_receivable, directory)
+
+
+def versions(directory: str) -> list:
+    return sorted(glob.glob(f"{directory}.__v*"))
+
+
+def test_failed_export_keeps_the_published_versions(export, tmp_path, monkeypatch):
+    import columnar_export
+
+    directory = str(tmp_path / "receivables")
+    export(directory)
+    export(directory)
+    published = versions(directory)
+    assert os.path.realpath(directory) == published[-1]
+
+    def failing(collection, query=None):
+        yield from iter_rows(collection, query)
+        raise RuntimeError("cursor lost")
+
+    iter_rows = columnar_export.iter_rows
+    monkeypatch.setattr(columnar_export, "iter_rows", failing)
+    with pytest.raises(RuntimeError):
+        export(directory)
+    monkeypatch.setattr(columnar_export, "iter_rows", iter_rows)
+    assert versions(directory) == published
+
+    # Left by an export killed before publishing
+    os.makedirs(f"{published[-1]}_killed")
+    export(directory)
+    # The version readers were on is kept, the unpublished and older ones are removed
+    assert versions(directory) == [published[-1], os.path.realpath(directory)]
@@ -0,0 +1,43 @@
+import threading
+import time
+
+import pagination
+
+
+class Response:
+    status_code = 200
+
+    def __init__(self, records):
+        self.records = records
+
+    def json(self):
+        return {"data": self.records}
+
+
+def test_short_pages_dont_end_the_walk(monkeypatch):
+    # The server serves 50 rows whatever `limite` asks for
+    rows = list(range(120))
+    monkeypatch.setattr(pagination, "get_headers", lambda loja=None, client=None: {})
+    monkeypatch.setattr(pagination, "get", lambda url, headers=None, params=None, client=None, loja=None: Response(
+        rows[(params["pagina"] - 1) * 50:params["pagina"] * 50]
+    ))
+
+    pages = list(pagination.iter_pages("http://bling.invalid/contas/receber", limit=100))
+    assert [page for page, _ in pages] == [1, 2, 3]
+    assert [row for _, records in pages for row in records] == rows
+
+
+def test_prefetch_producer_stops_when_the_consumer_is_gone():
+    def failing():
+        yield from range(2)
+        raise RuntimeError("page 3")
+
+    items = pagination.prefetch(failing(), buffer=1)
+    assert next(items) == 0
+    # The queue is full, the producer must not stay blocked on its last put
+    time.sleep(0.1)
+    items.close()
+    deadline = time.monotonic() + 5
+    while any(thread.name == "bling-prefetch" for thread in threading.enumerate()) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not any(thread.name == "bling-prefetch" for thread in threading.enumerate())
@@ -0,0 +1,158 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from fanout import FanoutResult
+
+
+class FakeBling:
+    """contas/receber of one store: list rows filtered like Bling filters them, and their details"""
+
+    def __init__(self, parcelas):
+        self.parcelas = {parcela["id"]: parcela for parcela in parcelas}
+        # Ids whose detail request fails
+        self.failing = set()
+        self.detail_requests = []
+
+    def iter_batches(self, pipeline, loja=None, client=None, params=None, start_page=1):
+        query = dict(pipeline.params, **(params or {}))
+        situacoes = query["situacoes[]"]
+        situacoes = {int(situacao) for situacao in ([situacoes] if isinstance(situacoes, str) else situacoes)}
+        date_field = {"E": "dataEmissao", "R": "dataRecebimento"}[query["tipoFiltroData"]]
+        rows = [
+            {key: value for key, value in parcela.items() if key != "dataRecebimento"}
+            for parcela in self.parcelas.values()
+            if parcela["situacao"] in situacoes and query["dataInicial"] <= (parcela.get(date_field) or "") <= query["dataFinal"]
+        ]
+        if rows:
+            yield 1, rows
+
+    def fetch_details(self, pipeline, records, loja=None, client=None, executor=None):
+        self.detail_requests.extend(record["id"] for record in records)
+        return FanoutResult(
+            items=records,
+            results=[
+                None if record["id"] in self.failing else
+                dict(self.parcelas[record["id"]], saldo=record["valor"], numeroDocumento=f"{record['id']}/1", CRParcelaID=record["id"])
+                for record in records
+            ],
+            failures={record["id"]: "HTTP 500" for record in records if record["id"] in self.failing},
+        )
+
+
+def day(days_ago: int) -> str:
+    return (datetime.now() - timedelta(days=days_ago)).strftime("%Y-%m-%d")
+
+
+def parcela(receivable_id: int, emitted: int, situacao: int = 1, received: int = None) -> dict:
+    return {
+        "id": receivable_id, "situacao": situacao, "dataEmissao": day(emitted), "vencimento": day(emitted - 30),
+        "valor": 100.0, "dataRecebimento": day(received) if received is not None else None,
+    }
+
+
+@pytest.fixture
+def bling(db, monkeypatch):
+    import bling_sources
+
+    fake = FakeBling([])
+    monkeypatch.setattr(bling_sources, "iter_batches", fake.iter_batches)
+    monkeypatch.setattr(bling_sources, "fetch_details", fake.fetch_details)
+    return fake
+
+
+def stored(db) -> dict:
+    return {document["CRParcelaID"]: document["CRSituacao"] for document in db.accounts_receivable.find()}
+
+
+def seed(db, bling, *parcelas):
+    """Store parcelas the way a past sync stored them"""
+    from mongo_writer import bulk_upsert
+    from pipelines import DATASET_KEYS, PIPELINES, merge_details, normalize_records, tag_store
+
+    rows = [{key: value for key, value in parcela.items() if key != "dataRecebimento"} for parcela in parcelas]
+    details = bling.fetch_details(PIPELINES["receivables"], rows).results
+    records = tag_store(list(normalize_records("receivables", merge_details(PIPELINES["receivables"], rows, details))), "teste")
+    bulk_upsert(db.accounts_receivable, records, DATASET_KEYS["receivables"], diff=True)
+
+
+def test_full_run_keeps_history(db, bling):
+    import bling_sources
+
+    bling.parcelas = {parcela["id"]: parcela for parcela in [
+        parcela(1, emitted=90, situacao=2, received=60),
+        parcela(2, emitted=90, situacao=1),
+        parcela(3, emitted=10, situacao=1),
+        parcela(4, emitted=10, situacao=1),
+        parcela(5, emitted=10, situacao=1),
+    ]}
+    seed(db, bling, *bling.parcelas.values())
+    # 4 is cancelled, 5 received
+    del bling.parcelas[4]
+    bling.parcelas[5].update(situacao=2, dataRecebimento=day(1))
+
+    result = bling_sources.get_bling_receivable_data(mode="full", loja="teste")
+
+    assert sorted(record["CRParcelaID"] for record in result) == [3, 5]
+    # Only the open parcela of the window that Bling no longer returns is dropped
+    assert stored(db) == {1: 2, 2: 1, 3: 1, 5: 2}
+
+
+def test_changed_parcela_keeps_its_derived_fields(db, bling):
+    import bling_sources
+    from derivations import derive_fields
+
+    bling.parcelas = {1: parcela(1, emitted=3), 2: parcela(2, emitted=3)}
+    seed(db, bling, *bling.parcelas.values())
+    derive_fields(db.accounts_receivable)
+    # mongomock can't run the DataControle pipeline, set as compute_data_controle would
+    db.accounts_receivable.update_many({}, {"$set": {"DataControle": int(day(3).replace("-", ""))}})
+    bling.parcelas[1].update(situacao=2, dataRecebimento=day(0), dataEmissao=day(2))
+
+    bling_sources.get_bling_receivable_data(mode="full", loja="teste")
+
+    document = db.accounts_receivable.find_one({"CRParcelaID": 1})
+    assert document["CRSituacao"] == 2
+    assert document["CRPedidoNº"] == "1"
+    # Recomputed from the new CREmissao
+    assert document["DataControle"] == int(day(2).replace("-", ""))
+    assert db.accounts_receivable.find_one({"CRParcelaID": 2})["CRPedidoNº"] == "2"
+
+
+def test_failed_details_are_retried_without_holding_the_watermark(db, bling, monkeypatch):
+    import bling_sources
+    from sync_state import get_sync_state
+
+    monkeypatch.setattr(bling_sources, "RECEIVABLE_RECONCILE_DAYS", 0)
+    bling.parcelas = {1: parcela(1, emitted=10), 2: parcela(2, emitted=10)}
+    bling.failing = {2}
+    bling_sources.get_bling_receivable_data(mode="incremental", loja="teste")
+
+    state = get_sync_state(db, "receivables", "teste")
+    assert state["watermark"].date() == datetime.now().date()
+    assert [entry["row"]["id"] for entry in state["pending_details"]] == [2]
+    assert db.accounts_receivable.find_one({"CRParcelaID": 2}).get("numeroDocumento") is None
+
+    # Emitted before the new window: only the failed detail is requested again
+    bling.failing = set()
+    bling.detail_requests = []
+    bling_sources.get_bling_receivable_data(mode="incremental", loja="teste")
+
+    assert bling.detail_requests == [2]
+    assert db.accounts_receivable.find_one({"CRParcelaID": 2})["numeroDocumento"] == "2/1"
+    assert get_sync_state(db, "receivables", "teste")["pending_details"] == []
+
+
+def test_deleted_parcela_has_an_empty_detail(monkeypatch):
+    import pipelines
+
+    class NotFound:
+        status_code = 404
+        text = '{"error": {"type": "RESOURCE_NOT_FOUND"}}'
+
+    monkeypatch.setattr(pipelines, "get_headers", lambda loja=None, client=None: {})
+    monkeypatch.setattr(pipelines, "get", lambda url, headers=None, client=None, loja=None: NotFound())
+    fetched = pipelines.fetch_details(pipelines.PIPELINES["receivables"], [{"id": 3, "situacao": 1}], "teste")
+
+    assert fetched.failures == {}
+    assert fetched.results == [{}]
@@ -0,0 +1,11 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_modules_import_within_the_startup_budget():
+    # Each module in a fresh interpreter, against STARTUP_BUDGET_MS (cli.py startup-check)
+    completed = subprocess.run([sys.executable, "cli.py", "startup-check"], cwd=ROOT, capture_output=True, text=True)
+    assert completed.returncode == 0, completed.stdout + completed.stderr
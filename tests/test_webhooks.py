@@ -0,0 +1,88 @@
+import json
+
+import pytest
+
+from conftest import fixture, synced_receivable
+from fanout import FanoutResult
+from mongo_writer import HASH_FIELD, bulk_upsert
+from pipelines import DATASET_KEYS
+
+
+def apply(db, event: dict) -> dict:
+    import webhooks
+
+    body = json.dumps(event).encode("utf-8")
+    assert webhooks.enqueue_event(db, event, body) == "queued"
+    return webhooks.process_events(db)
+
+
+def test_webhook_update_keeps_the_synced_schema(db):
+    event = fixture("webhooks", "accounts_receivable_updated.json")
+    receivable_id = event["data"]["id"]
+    bulk_upsert(db.accounts_receivable, [synced_receivable(receivable_id, derived=True)], DATASET_KEYS["receivables"], diff=True)
+    synced = db.accounts_receivable.find_one({"CRParcelaID": receivable_id})
+
+    assert apply(db, event) == {"done": 1, "retried": 0, "failed": 0}
+
+    document = db.accounts_receivable.find_one({"CRParcelaID": receivable_id})
+    assert set(document) == set(synced) - {HASH_FIELD}
+    assert document["CRSituacao"] == 2
+    assert document["situacao_y"] == 2
+    assert document["CRSaldoVenda"] == 0
+    assert document["CRPedidoNº"] == "10452"
+    assert document["DataControle"] == 20250208
+    # Fields missing from the payload keep their synced value
+    assert document["linkBoleto_y"] == synced["linkBoleto_y"]
+    assert document["borderos"] == synced["borderos"]
+
+
+def test_webhook_for_a_new_parcela_fetches_its_detail(db, monkeypatch):
+    import webhooks
+
+    event = fixture("webhooks", "accounts_receivable_paid_partial.json")
+    receivable_id = event["data"]["id"]
+    detail = dict(fixture("contas_receber_detail.json")["data"], id=receivable_id, situacao=2)
+
+    def fetch_details(pipeline, records, loja=None, client=None, executor=None):
+        assert [record["id"] for record in records] == [receivable_id]
+        return FanoutResult(items=records, results=[dict(detail, CRParcelaID=receivable_id)])
+
+    monkeypatch.setattr(webhooks, "fetch_details", fetch_details)
+    assert apply(db, event)["done"] == 1
+
+    document = db.accounts_receivable.find_one({"CRParcelaID": receivable_id}, {"_id": 0})
+    assert set(document) == set(synced_receivable(receivable_id))
+    assert document["CRSituacao"] == 2
+    assert document["loja"] == "teste"
+
+
+@pytest.mark.parametrize("changes", [{"formaPagamento": {"id": 1234567}}, {"situacao": 5}], ids=["payment method", "cancelled"])
+def test_webhook_for_a_parcela_the_sync_leaves_out(db, monkeypatch, changes):
+    import webhooks
+
+    event = fixture("webhooks", "accounts_receivable_paid_partial.json")
+    receivable_id = event["data"]["id"]
+    detail = dict(fixture("contas_receber_detail.json")["data"], id=receivable_id, CRParcelaID=receivable_id, **changes)
+    monkeypatch.setattr(webhooks, "fetch_details", lambda pipeline, records, loja=None, client=None, executor=None: (
+        FanoutResult(items=records, results=[detail])
+    ))
+
+    assert apply(db, event)["done"] == 1
+    assert db.accounts_receivable.count_documents({}) == 0
+
+
+def test_webhook_delete(db):
+    event = fixture("webhooks", "accounts_receivable_deleted.json")
+    receivable_id = event["data"]["id"]
+    db.accounts_receivable.insert_one(synced_receivable(receivable_id, derived=True))
+
+    apply(db, event)
+    assert db.accounts_receivable.count_documents({"CRParcelaID": receivable_id}) == 0
+
+
+def test_sign_without_secret(monkeypatch):
+    import webhooks
+
+    monkeypatch.delenv("BLING_WEBHOOK_SECRET", raising=False)
+    with pytest.raises(ValueError):
+        webhooks.sign(b"{}")
@@ -0,0 +1,260 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from time import sleep, time
+
+import requests
+
+from http_client import HttpClient, get_client
+from metrics import TOKEN_CACHE, TOKEN_FETCH_SECONDS
+from settings import setting
+
+# "file" shares tokens between the processes of a host, "mongo" between hosts
+TOKEN_BACKEND = os.getenv("TOKEN_BACKEND", "file")
+TOKEN_CACHE_PATH = os.getenv("TOKEN_CACHE_PATH", "cache/tokens.json")
+MONGO_COLLECTION_TOKENS = os.getenv("MONGO_COLLECTION_TOKENS", "bling_tokens")
+# Lifetime assumed when the token endpoint doesn't return expires_in
+TOKEN_TTL_SECONDS = int(os.getenv("TOKEN_TTL_SECONDS", str(5 * 60 * 60)))
+# Tokens are refreshed in the background this long before they expire
+TOKEN_REFRESH_MARGIN_SECONDS = int(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS", str(15 * 60)))
+# A refresh lock older than this is considered abandoned (crashed process)
+TOKEN_LOCK_TIMEOUT_SECONDS = int(os.getenv("TOKEN_LOCK_TIMEOUT_SECONDS", "30"))
+
+
+class Token:
+    """An access token, its expiry (epoch seconds) and the request headers built from it"""
+
+    __slots__ = ("value", "expires_at", "headers")
+
+    def __init__(self, value: str, expires_at: float):
+        self.value = value
+        self.expires_at = expires_at
+        # Built once, shared by every request: callers must not modify them
+        self.headers = {"Accept": "application/json", "Authorization": f"Bearer {value}"}
+
+    def remaining(self, now: float = None) -> float:
+        return self.expires_at - (now or time())
+
+
+class FileTokenStore:
+    """Tokens in a JSON file, refreshes serialized across processes with flock"""
+
+    def __init__(self, path: str = TOKEN_CACHE_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def load(self, loja: str) -> Token:
+        entry = self._read().get(loja)
+        return Token(entry["token"], entry["expires_at"]) if entry else None
+
+    def save(self, loja: str, token: Token):
+        # Called under lock(loja), other stores of the file may be written concurrently
+        with open(f"{self.path}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entries = self._read()
+            entries[loja] = {"token": token.value, "expires_at": token.expires_at}
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.path)
+
+    @contextmanager
+    def lock(self, loja: str):
+        with open(f"{self.path}.{loja}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class MongoTokenStore:
+    """
+    Tokens in MONGO_COLLECTION_TOKENS, refreshes serialized across hosts with
+    a lease document that expires after TOKEN_LOCK_TIMEOUT_SECONDS.
+    """
+
+    def __init__(self, collection=None):
+        if collection is None:
+            from mongo_client import get_collection
+
+            collection = get_collection(MONGO_COLLECTION_TOKENS)
+        self.collection = collection
+
+    def load(self, loja: str) -> Token:
+        entry = self.collection.find_one({"_id": loja, "token": {"$exists": True}})
+        return Token(entry["token"], entry["expires_at"]) if entry else None
+
+    def save(self, loja: str, token: Token):
+        self.collection.update_one(
+            {"_id": loja}, {"$set": {"token": token.value, "expires_at": token.expires_at, "updated_at": datetime.now()}}, upsert=True
+        )
+
+    @contextmanager
+    def lock(self, loja: str):
+        from pymongo.errors import DuplicateKeyError
+
+        lock_id = f"lock:{loja}"
+        owner = f"{os.uname().nodename}:{os.getpid()}:{threading.get_ident()}"
+        while True:
+            now = datetime.now(timezone.utc)
+            try:
+                # Takes a free or abandoned lease, a held one makes the upsert collide on _id
+                self.collection.update_one(
+                    {"_id": lock_id, "locked_until": {"$lt": now}},
+                    {"$set": {"owner": owner, "locked_until": now + timedelta(seconds=TOKEN_LOCK_TIMEOUT_SECONDS)}},
+                    upsert=True,
+                )
+                break
+            except DuplicateKeyError:
+                sleep(0.2)
+        try:
+            yield
+        finally:
+            self.collection.update_one({"_id": lock_id, "owner": owner}, {"$set": {"locked_until": datetime.min}})
+
+
+class TokenService:
+    """
+    Access tokens of every store, shared by threads through memory and by
+    processes through `store`.
+
+    Callers read the in-memory token, a refresh only happens in the request
+    path when there is no valid token at all (first use, or the refresher
+    failed until expiry). Then one thread per process and one process per
+    store fetch it, the others wait and reuse its result. Tokens close to
+    expiry are refreshed by a background thread.
+    """
+
+    def __init__(self, store=None, client: HttpClient = None):
+        self.store = store
+        self.client = client
+        self._tokens = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._refresher = None
+
+    def _lock(self, loja: str) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(loja, threading.Lock())
+
+    def _store(self):
+        if self.store is None:
+            self.store = MongoTokenStore() if TOKEN_BACKEND == "mongo" else FileTokenStore()
+        return self.store
+
+    def get(self, loja: str = None, client: HttpClient = None) -> Token:
+        """
+        Return a valid token of the store, None if it can't be fetched.
+        A token missing from memory is fetched with `client`, defaults to the service's.
+        """
+        loja = loja or setting("LOJA")
+        token = self._tokens.get(loja)
+        if token is not None and token.remaining() > 0:
+            TOKEN_CACHE.labels("hit").inc()
+            return token
+        TOKEN_CACHE.labels("miss").inc()
+        self._start_refresher()
+        with self._lock(loja):
+            # Another thread may have refreshed it while this one waited
+            token = self._tokens.get(loja)
+            if token is not None and token.remaining() > 0:
+                return token
+            return self.refresh(loja, margin=0, client=client)
+
+    def refresh(self, loja: str, margin: float = None, client: HttpClient = None) -> Token:
+        """
+        Fetch a new token unless the shared store has one valid for more than
+        `margin` seconds (TOKEN_REFRESH_MARGIN_SECONDS), under the store lock
+        so processes fetch it once.
+        """
+        margin = TOKEN_REFRESH_MARGIN_SECONDS if margin is None else margin
+        store = self._store()
+        with store.lock(loja):
+            token = store.load(loja)
+            if token is None or token.remaining() <= margin:
+                token = self._fetch(loja, client)
+                if token is None:
+                    return self._tokens.get(loja)
+                store.save(loja, token)
+            else:
+                TOKEN_CACHE.labels("shared").inc()
+        self._tokens[loja] = token
+        self._wakeup.set()
+        return token
+
+    def _fetch(self, loja: str, client: HttpClient = None) -> Token:
+        url = f"{setting('API_TOKEN_BLING')}/{loja}"
+        headers = {
+            'Authorization': 'Bearer 0123456789',
+            'Content-Type': 'application/json'
+        }
+        try:
+            with TOKEN_FETCH_SECONDS.time():
+                response = (client or self.client or get_client()).get(url, headers=headers)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Error fetching access token: {e}")
+            return None
+        if response.status_code != 200:
+            logging.error(f"Failed to fetch access token: {response.status_code}")
+            return None
+        payload = response.json()
+        access_token = payload.get("access_token")
+        if not access_token:
+            logging.error("Failed to fetch access token.")
+            return None
+        logging.info(f"Successfully fetched access token for {loja}")
+        return Token(access_token, time() + float(payload.get("expires_in") or TOKEN_TTL_SECONDS))
+
+    def _start_refresher(self):
+        if self._refresher is None or not self._refresher.is_alive():
+            with self._locks_lock:
+                if self._refresher is None or not self._refresher.is_alive():
+                    self._refresher = threading.Thread(target=self._refresh_loop, name="token-refresher", daemon=True)
+                    self._refresher.start()
+
+    def _refresh_loop(self):
+        """Refresh each token TOKEN_REFRESH_MARGIN_SECONDS before it expires"""
+        while True:
+            self._wakeup.clear()
+            for loja, token in list(self._tokens.items()):
+                if token.remaining() <= TOKEN_REFRESH_MARGIN_SECONDS:
+                    try:
+                        with self._lock(loja):
+                            self.refresh(loja)
+                    except Exception as e:
+                        logging.error(f"Background refresh of the {loja} token failed: {e}")
+            # Sleep until the next token is due, a failed refresh is retried a minute later
+            now = time()
+            waits = [token.remaining(now) - TOKEN_REFRESH_MARGIN_SECONDS for token in list(self._tokens.values())]
+            self._wakeup.wait(min([wait if wait > 0 else 60 for wait in waits] or [60]))
+
+
+_service = None
+_service_pid = None
+_service_lock = threading.Lock()
+
+
+def get_token_service() -> TokenService:
+    """Return the process-wide token service. After a fork the child gets its own"""
+    global _service, _service_pid
+    if _service is None or _service_pid != os.getpid():
+        with _service_lock:
+            if _service is None or _service_pid != os.getpid():
+                _service = TokenService()
+                _service_pid = os.getpid()
+    return _service
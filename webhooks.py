@@ -0,0 +1,338 @@
+"""
+Bling webhooks: near real-time updates between the scheduled syncs.
+
+The API receives the events (POST /webhooks/bling), checks their HMAC
+signature and queues them in MONGO_COLLECTION_WEBHOOK_EVENTS, keyed by
+eventId so a redelivered event is queued once. The ingester applies the
+queue every WEBHOOK_POLL_SECONDS (scheduler.JOBS):
+
+    receivables      changed fields set (or documents deleted) in MONGO_COLLECTION_RECEIVABLE,
+                     built like the sync builds them. The detail is fetched only
+                     for new parcelas and payloads lacking fields, new parcelas
+                     the sync wouldn't fetch (pipelines.in_scope) are left out
+    reference data   the dataset is refreshed, ignoring its TTL
+
+The scheduled receivable sync then only reconciles what webhooks missed.
+`cli.py webhook-replay` posts recorded events (benchmarks/fixtures/webhooks)
+to a local API for testing.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+from dataclasses import replace
+from datetime import datetime, timedelta
+
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from derivations import DERIVED_FIELDS, data_controle, derive_record
+from indexes import collection_name
+from metrics import WEBHOOK_EVENTS
+from mongo_writer import HASH_FIELD
+from pipelines import DATASET_KEYS, PIPELINES, fetch_details, in_scope, merge_details, normalize_records, tag_store
+from settings import setting
+from sync_state import update_sync_state
+
+SIGNATURE_HEADER = "X-Bling-Signature-256"
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "500"))
+# An event claimed by a worker that died is retried after this
+WEBHOOK_LEASE_SECONDS = int(os.getenv("WEBHOOK_LEASE_SECONDS", "300"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+
+# Bling resource of the event ("<resource>.<action>") and the dataset it updates
+WEBHOOK_RESOURCES = {
+    "accounts_receivable": "receivables",
+    "seller": "sellers",
+    "payment_method": "payment_methods",
+    "situation": "modulos",
+}
+# Fields of a receivable event that make the detail request unnecessary, for parcelas already stored
+RECEIVABLE_EVENT_FIELDS = (
+    "id", "situacao", "vencimento", "valor", "saldo", "dataEmissao", "contato",
+    "formaPagamento", "numeroDocumento", "origem", "vendedor",
+)
+# Fields of the contas/receber list rows. The sync merges each row with its detail,
+# which has them too, so they are stored suffixed (_x from the row, _y from the detail)
+RECEIVABLE_LIST_FIELDS = (
+    "id", "situacao", "vencimento", "valor", "idTransacao", "linkQRCodePix", "linkBoleto",
+    "dataEmissao", "contato", "formaPagamento", "contaContabil", "origem",
+)
+
+
+def events_collection(db):
+    return db[collection_name("webhook_events")]
+
+
+def verify_signature(body: bytes, signature: str, secret: str = None) -> bool:
+    """
+    Check the HMAC-SHA256 of the raw body, sent by Bling as "sha256=<hex>".
+    Events are rejected when BLING_WEBHOOK_SECRET is not configured.
+    """
+    secret = secret or setting("BLING_WEBHOOK_SECRET")
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(f"sha256={expected}", signature.strip())
+
+
+def sign(body: bytes, secret: str = None) -> str:
+    """
+    Signature header value of a body, as Bling sends it (used to replay events).
+
+    Raises:
+        ValueError: When no secret is given and BLING_WEBHOOK_SECRET is not set.
+    """
+    secret = secret or setting("BLING_WEBHOOK_SECRET")
+    if not secret:
+        raise ValueError("BLING_WEBHOOK_SECRET is not set, events can't be signed")
+    return "sha256=" + hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+
+
+def event_store(event: dict) -> str:
+    """Store (loja) of an event, from WEBHOOK_STORES ("companyId=loja,..."), defaults to LOJA"""
+    stores = dict(
+        pair.strip().split("=", 1) for pair in (setting("WEBHOOK_STORES") or "").split(",") if "=" in pair
+    )
+    return stores.get(str(event.get("companyId")), setting("LOJA"))
+
+
+def enqueue_event(db, event: dict, body: bytes = None) -> str:
+    """
+    Queue a verified event.
+
+    Returns:
+        str: "queued", "duplicate" (already received) or "ignored" (resource not synced).
+    """
+    resource, _, action = str(event.get("event", "")).partition(".")
+    data = event.get("data")
+    if resource not in WEBHOOK_RESOURCES or not isinstance(data, dict) or "id" not in data:
+        logging.info(f"Ignoring webhook event {event.get('event')}")
+        WEBHOOK_EVENTS.labels("", "ignored").inc()
+        return "ignored"
+    # Bling's eventId identifies redeliveries, the body hash stands in for events without one
+    event_id = event.get("eventId") or hashlib.sha1(body or json.dumps(event, sort_keys=True).encode("utf-8")).hexdigest()
+    now = datetime.now()
+    try:
+        events_collection(db).insert_one({
+            "_id": event_id,
+            "event": event["event"],
+            "dataset": WEBHOOK_RESOURCES[resource],
+            "action": action,
+            "loja": event_store(event),
+            "data": event["data"],
+            "event_date": event.get("date"),
+            "received_at": now,
+            "available_at": now,
+            "status": "pending",
+            "attempts": 0,
+        })
+    except DuplicateKeyError:
+        WEBHOOK_EVENTS.labels(WEBHOOK_RESOURCES[resource], "duplicate").inc()
+        return "duplicate"
+    WEBHOOK_EVENTS.labels(WEBHOOK_RESOURCES[resource], "queued").inc()
+    return "queued"
+
+
+def claim_events(db, limit: int = WEBHOOK_BATCH_SIZE) -> list:
+    """Take up to `limit` due events, oldest first, leased for WEBHOOK_LEASE_SECONDS"""
+    collection = events_collection(db)
+    events = []
+    while len(events) < limit:
+        now = datetime.now()
+        event = collection.find_one_and_update(
+            {"$or": [
+                {"status": "pending", "available_at": {"$lte": now}},
+                {"status": "processing", "locked_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": "processing", "locked_until": now + timedelta(seconds=WEBHOOK_LEASE_SECONDS)}, "$inc": {"attempts": 1}},
+            sort=[("available_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+        if event is None:
+            break
+        events.append(event)
+    return events
+
+
+def _stored_list_row(document: dict, suffix: str) -> dict:
+    """The list row a stored receivable was merged from, empty when it was stored without detail"""
+    return {
+        field: document[f"{field}{suffix}"] for field in RECEIVABLE_LIST_FIELDS if f"{field}{suffix}" in document
+    }
+
+
+def build_receivable_update(pipeline, loja: str, receivable_id, data: dict, detail: dict, stored: dict = None) -> dict:
+    """
+    Build the document of a receivable the way the sync does, and return the
+    fields that differ from the stored one.
+
+    The list row is the stored one (its _x fields), updated with the list
+    fields of the event payload, then merged with `detail` (the payload or the
+    fetched detail) and normalized. Derived fields the stored document has are
+    recomputed, fields the event knows nothing about are left as they are.
+    """
+    suffix = pipeline.detail.suffixes[0]
+    row = _stored_list_row(stored, suffix) if stored else {}
+    if not row:
+        # New parcela, or stored without detail: the detail has every field of the list row
+        row = {field: detail[field] for field in RECEIVABLE_LIST_FIELDS if field in detail}
+    row.update({field: data[field] for field in RECEIVABLE_LIST_FIELDS if field in data})
+    row["id"] = receivable_id
+    detail = dict(detail, **{pipeline.detail.key: receivable_id})
+
+    # Fields of both sides are suffixed like in the sync, even when this detail lacks some of them
+    detail_fields = set(detail) | (set(RECEIVABLE_LIST_FIELDS) - {"id"})
+    record = tag_store(list(normalize_records("receivables", merge_details(pipeline, [row], [detail], detail_fields))), loja)[0]
+
+    if stored:
+        record.update(derive_record(record, [field for field in DERIVED_FIELDS if field in stored]))
+        if "DataControle" in stored:
+            record["DataControle"] = data_controle(record.get("CREmissao", stored.get("CREmissao")))
+        return {field: value for field, value in record.items() if field not in stored or stored[field] != value}
+    return record
+
+
+def apply_receivable_events(db, loja: str, events: list, client=None) -> dict:
+    """
+    Apply the receivable events of a store as targeted writes: only the
+    changed fields of each document are set, its other fields are kept.
+
+    Returns:
+        dict: Error per event id, for the events that could not be applied.
+    """
+    collection = db[collection_name("receivables")]
+    key = DATASET_KEYS["receivables"][0]
+    # The last event of a parcela wins
+    latest = {}
+    for event in sorted(events, key=lambda event: (str(event.get("event_date")), event["received_at"])):
+        latest[event["data"]["id"]] = event
+
+    deleted = [receivable_id for receivable_id, event in latest.items() if event["action"] == "deleted"]
+    if deleted:
+        collection.delete_many({key: {"$in": deleted}, "loja": {"$in": [loja, None]}})
+
+    updated = [receivable_id for receivable_id, event in latest.items() if event["action"] != "deleted"]
+    stored = {
+        document[key]: document
+        for document in collection.find({key: {"$in": updated}, "loja": {"$in": [loja, None]}})
+    }
+    details, incomplete = {}, []
+    for receivable_id in updated:
+        data = latest[receivable_id]["data"]
+        if receivable_id in stored and all(field in data for field in RECEIVABLE_EVENT_FIELDS):
+            details[receivable_id] = data
+        else:
+            # New parcelas are fetched too, so they are stored with every field of a synced one
+            incomplete.append(data)
+
+    errors = {}
+    # Declared filters of the receivable list and those of each date filter of the sync
+    from bling_sources import RECEIVABLE_DATE_FILTER_PARAMS
+
+    scopes = [{}, *RECEIVABLE_DATE_FILTER_PARAMS.values()]
+    if incomplete:
+        # Not through the detail cache: a partial payload has no reliable fingerprint
+        pipeline = replace(PIPELINES["receivables"], detail=replace(PIPELINES["receivables"].detail, cached=False))
+        fetched = fetch_details(pipeline, incomplete, loja, client)
+        for data, detail in fetched.succeeded():
+            if not detail:
+                continue
+            if data["id"] not in stored and not any(in_scope(pipeline, detail, params) for params in scopes):
+                logging.info(f"Webhook for receivable {data['id']} of {loja} ignored, not synced (situacao or payment method)")
+                continue
+            details[data["id"]] = detail
+        for receivable_id, error in fetched.failures.items():
+            errors[latest[receivable_id]["_id"]] = error
+
+    operations = []
+    for receivable_id, detail in details.items():
+        document = stored.get(receivable_id)
+        changes = build_receivable_update(PIPELINES["receivables"], loja, receivable_id, latest[receivable_id]["data"], detail, document)
+        if not changes:
+            continue
+        # The sync hash no longer matches, the next sync rewrites the whole document
+        operations.append(UpdateOne(
+            {"_id": document["_id"]} if document else {key: receivable_id, "loja": loja},
+            {"$set": changes, "$unset": {HASH_FIELD: ""}},
+            upsert=True,
+        ))
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    if details or deleted:
+        logging.info(
+            f"Webhook events of {loja}: {len(operations)} receivables written, "
+            f"{len(details) - len(operations)} unchanged, {len(deleted)} deleted"
+        )
+    if operations or deleted:
+        # Moves the API cache generation of receivables
+        update_sync_state(db, "receivables", loja, webhook_applied_at=datetime.now())
+    return errors
+
+
+def process_events(db=None, limit: int = WEBHOOK_BATCH_SIZE) -> dict:
+    """
+    Apply one batch of queued events. Failed events are retried with an
+    exponential backoff, up to WEBHOOK_MAX_ATTEMPTS.
+
+    Returns:
+        dict: {"done": n, "retried": n, "failed": n}
+    """
+    if db is None:
+        from mongo_client import get_db
+
+        db = get_db()
+    events = claim_events(db, limit)
+    if not events:
+        return {"done": 0, "retried": 0, "failed": 0}
+
+    errors = {}
+    receivables, references = {}, {}
+    for event in events:
+        if event["dataset"] == "receivables":
+            receivables.setdefault(event["loja"], []).append(event)
+        else:
+            references.setdefault((event["loja"], event["dataset"]), []).append(event)
+
+    for loja, store_events in receivables.items():
+        try:
+            errors.update(apply_receivable_events(db, loja, store_events))
+        except Exception as e:
+            logging.error(f"Could not apply the receivable events of {loja}: {e}")
+            errors.update({event["_id"]: str(e) for event in store_events})
+
+    if references:
+        # Reference datasets are small, every event of a dataset triggers one refresh
+        from bling_sources import sync_reference_data
+
+        for (loja, dataset), dataset_events in references.items():
+            result = sync_reference_data(db, force=True, loja=loja, datasets=[dataset])[dataset]
+            if result["status"] == "failed":
+                errors.update({event["_id"]: result.get("error", "refresh failed") for event in dataset_events})
+
+    now = datetime.now()
+    collection = events_collection(db)
+    done = [event["_id"] for event in events if event["_id"] not in errors]
+    for event in events:
+        if event["_id"] not in errors:
+            WEBHOOK_EVENTS.labels(event["dataset"], "done").inc()
+    if done:
+        collection.update_many({"_id": {"$in": done}}, {"$set": {"status": "done", "processed_at": now}, "$unset": {"locked_until": ""}})
+    retried = failed = 0
+    for event in events:
+        if event["_id"] not in errors:
+            continue
+        if event["attempts"] >= WEBHOOK_MAX_ATTEMPTS:
+            update = {"status": "failed", "processed_at": now, "error": errors[event["_id"]]}
+            failed += 1
+            WEBHOOK_EVENTS.labels(event["dataset"], "failed").inc()
+        else:
+            retry_at = now + timedelta(seconds=30 * 2 ** (event["attempts"] - 1))
+            update = {"status": "pending", "available_at": retry_at, "error": errors[event["_id"]]}
+            retried += 1
+            WEBHOOK_EVENTS.labels(event["dataset"], "retried").inc()
+        collection.update_one({"_id": event["_id"]}, {"$set": update, "$unset": {"locked_until": ""}})
+    if failed:
+        logging.error(f"{failed} webhook events failed after {WEBHOOK_MAX_ATTEMPTS} attempts")
+    return {"done": len(done), "retried": retried, "failed": failed}